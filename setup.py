@@ -16,9 +16,10 @@ setup(
         "openpyxl==3.1.5",
         "python-docx==1.1.2",
         "requests==2.32.4",
+        "httpx==0.28.1",
         "langchain==0.3.24",
         "langchain-core==0.3.56",
-        "langchain-ollama==0.3.2",
+        "ollama==0.6.3",
         "pdfplumber==0.11.6",
         "chromadb==1.0.7",
         "mako==1.3.10",
@@ -71,8 +71,9 @@ def test_areyoualive_responds(va_client):
     response = va_client.get("/areyoualive/")
     assert response.status_code == 200
     data = response.json
-    assert len(data) == 1
+    assert len(data) == 2
     assert data["status"] == "ok"
+    assert isinstance(data["ready"], bool)
 
 
 def test_query_fails_for_unknown_unary_query(va_client):
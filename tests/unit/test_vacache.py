@@ -0,0 +1,137 @@
+from vareq.vacache import CacheConfig, LruCache, PersistentCache, hash_text
+import logging
+import sqlite3
+import tempfile
+import os
+import time
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def create_cache(max_entries: int = 0) -> PersistentCache:
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    return PersistentCache(CacheConfig(True, path, max_entries))
+
+
+def test_cache_returns_stored_values():
+    cache = create_cache()
+
+    cache.put("a", b"apple")
+    cache.put_many([("b", b"banana"), ("c", b"cherry")])
+
+    assert b"apple" == cache.get("a")
+    assert {"b": b"banana", "c": b"cherry"} == cache.get_many(["b", "c", "d"])
+    assert cache.get("d") is None
+
+
+def test_cache_counts_hits_and_misses():
+    cache = create_cache()
+    cache.put("a", b"apple")
+
+    cache.get("a")
+    cache.get_many(["a", "b"])
+
+    assert 2 == cache.stats.hits
+    assert 1 == cache.stats.misses
+    assert 2 / 3 == cache.stats.hit_rate()
+
+
+def test_cache_evicts_least_recently_used_entries():
+    cache = create_cache(max_entries=2)
+    cache.put("a", b"apple")
+    cache.put("b", b"banana")
+    cache.get("a")
+
+    cache.put("c", b"cherry")
+
+    assert 2 == cache.size()
+    assert cache.get("b") is None
+    assert b"apple" == cache.get("a")
+    assert 1 == cache.stats.evictions
+
+
+def test_cache_evicts_entries_over_size_bound():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    cache = PersistentCache(CacheConfig(True, path, max_bytes=10))
+    cache.put("a", b"apple")
+    cache.put("b", b"bean")
+    cache.get("a")
+
+    cache.put("c", b"cab")
+
+    assert cache.get("b") is None
+    assert b"apple" == cache.get("a")
+    assert b"cab" == cache.get("c")
+    assert 1 == cache.stats.evictions
+
+
+def test_cache_sizes_entries_of_older_databases():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB, accessed REAL, created REAL)"
+    )
+    connection.execute("INSERT INTO entries VALUES ('a', x'0102030405', 0, 0)")
+    connection.commit()
+    connection.close()
+    cache = PersistentCache(CacheConfig(True, path, max_bytes=8))
+
+    cache.put("b", b"bean")
+
+    assert cache.get("a") is None
+    assert b"bean" == cache.get("b")
+
+
+def test_cache_expires_old_entries():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    cache = PersistentCache(CacheConfig(True, path, ttl_seconds=60))
+    cache.put("a", b"apple")
+    cache.put("b", b"banana")
+    # Pretend that the first entry was created long ago
+    cache._connect().execute("UPDATE entries SET created = 0 WHERE key = 'a'")
+
+    assert cache.get("a") is None
+    assert b"banana" == cache.get("b")
+    assert 1 == cache.stats.expirations
+
+
+def test_cache_is_persistent():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    cache = PersistentCache(CacheConfig(True, path))
+    cache.put("a", b"apple")
+    cache.close()
+
+    reopened = PersistentCache(CacheConfig(True, path))
+
+    assert b"apple" == reopened.get("a")
+
+
+def test_text_hash_is_content_based():
+    assert hash_text("Lorem ipsum") == hash_text("Lorem ipsum")
+    assert hash_text("Lorem ipsum") != hash_text("Lorem ipsum.")
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LruCache(CacheConfig(max_entries=2))
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+
+    cache.put("c", [3.0])
+
+    assert [1.0] == cache.get("a")
+    assert cache.get("b") is None
+    assert 2 == cache.size()
+    assert 1 == cache.stats.evictions
+    assert 2 == cache.stats.hits
+    assert 1 == cache.stats.misses
+
+
+def test_lru_cache_expires_entries():
+    cache = LruCache(CacheConfig(ttl_seconds=0.01))
+    cache.put(("a", 1), "value")
+
+    time.sleep(0.05)
+
+    assert cache.get(("a", 1)) is None
+    assert 1 == cache.stats.expirations
@@ -47,6 +47,14 @@ def test_update_nested_object_attribute_from_json_silently_ignores_non_json():
     assert "test" == obj.a.b.c
 
 
+def test_update_nested_object_attribute_from_json_updates_dictionaries():
+    obj = SimpleNamespace()
+    obj.routes = {"a": {"model": "x"}}
+    json_data = {"routes": {"b": {"model": "y"}}}
+    vaconfig.update_nested_object_attribute_from_json(obj, json_data)
+    assert {"a": {"model": "x"}, "b": {"model": "y"}} == obj.routes
+
+
 def test_update_engine_configuration_from_json_succeeds():
     config = EngineConfig()
     config.batch_query_context_size = 10
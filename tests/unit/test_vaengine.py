@@ -1,17 +1,49 @@
+from vareq import vaengine
 from vareq.vallminterface import LlmConfig, Llm
 from vareq.varequirementreader import Mappings, Requirement
-from vareq.vaengine import Engine, EngineConfig, PredefinedQuery
+from vareq.vaengine import (
+    AugmentedChat,
+    AugmentedChatConfig,
+    Engine,
+    EngineConfig,
+    PredefinedQuery,
+)
+from vareq.vaknowledgelibrary import ItemKind
 from vareq.vaqueries import QueryArity, QueryKind
 import logging
 import pytest
 import os
 import tempfile
+import time
 
 TEST_DIR: str = os.path.dirname(os.path.realpath(__file__))
 RESOURCE_DIR: str = os.path.join(TEST_DIR, "resources")
 logging.basicConfig(level=logging.DEBUG)
 
 
+class LibraryMock:
+    kinds: list
+    counts: list
+    documents: list
+
+    def __init__(self):
+        self.kinds = None
+        self.counts = []
+        self.documents = [
+            ("REQ-1", ItemKind.REQUIREMENT, "### Requirement REQ-1\n" + "a" * 40),
+            ("REQ-2", ItemKind.REQUIREMENT, "### Requirement REQ-2\n" + "b" * 40),
+            ("REQ-3", ItemKind.REQUIREMENT, "### Requirement REQ-3\n" + "c" * 40),
+        ]
+
+    def get_relevant_documents(self, text: str, count: int, kinds=None):
+        self.kinds = kinds
+        self.counts.append(count)
+        return self.documents[0:count]
+
+    def find_mentioned_requirements(self, text: str):
+        return [document for document in self.documents if document[0] in text]
+
+
 def check_ollama_and_skip():
     config = LlmConfig()
     llm = Llm(config)
@@ -28,8 +60,9 @@ def prepare_engine_config() -> EngineConfig:
         {"worksheet_name": "reqs"}
     )
     # Use temporary database
-    db_path = os.path.join(tempfile.mkdtemp(), "db")
-    cfg.lib_config.persistent_storage_path = db_path
+    db_dir = tempfile.mkdtemp()
+    cfg.lib_config.persistent_storage_path = os.path.join(db_dir, "db")
+    cfg.llm_config.embedding_cache.path = os.path.join(db_dir, "cache.db")
     return cfg
 
 
@@ -108,6 +141,62 @@ def test_engine_cannot_process_non_existing_query():
     assert reply is None
 
 
+def test_engine_is_not_ready_when_warm_up_fails():
+    cfg = prepare_engine_config()
+    # Nothing listens there
+    cfg.llm_config.url = "127.0.0.1:9"
+
+    engine = Engine(cfg)
+
+    assert not engine.is_ready()
+
+
+def test_background_warm_up_is_retried_until_ready(monkeypatch):
+    monkeypatch.setattr(vaengine, "WARM_UP_RETRY_DELAY", 0.01)
+    cfg = prepare_engine_config()
+    cfg.llm_config.url = "127.0.0.1:9"
+    # Ollama becomes available on the third attempt
+    attempts = []
+    monkeypatch.setattr(
+        vaengine.Llm,
+        "is_available",
+        lambda llm: attempts.append(True) or len(attempts) >= 3,
+    )
+    monkeypatch.setattr(vaengine.Llm, "warm_up", lambda llm: True)
+
+    engine = Engine(cfg, warm_up_in_background=True)
+    for _ in range(500):
+        if engine.is_ready():
+            break
+        time.sleep(0.01)
+    engine.stop()
+
+    assert engine.is_ready()
+    assert 3 == len(attempts)
+
+
+def test_engine_is_ready_without_warm_up():
+    cfg = prepare_engine_config()
+    cfg.warm_up = False
+
+    engine = Engine(cfg)
+
+    assert engine.is_ready()
+
+
+def test_engine_exposes_usage_stats():
+    cfg = prepare_engine_config()
+    cfg.warm_up = False
+    engine = Engine(cfg)
+
+    stats = engine.get_usage_stats()
+
+    assert {} == stats["llm"]
+    assert 0 == stats["scheduler"]["completed"]
+    assert "embedding_cache" in stats["caches"]
+    assert "response_cache" not in stats["caches"]
+
+
 def test_query_can_access_all_requirement_data():
     check_ollama_and_skip()
     cfg = EngineConfig()
@@ -141,3 +230,51 @@ Traces: {6}
     assert "br-10" in reply
     assert "br-20" in reply
     assert "at least 100 ghz" in reply
+
+
+def test_augmented_chat_retrieves_only_enabled_kinds():
+    lib = LibraryMock()
+    config = AugmentedChatConfig()
+    config.use_documents = False
+    chat = AugmentedChat(None, lib, config)
+
+    documents = chat.get_relevant_documents("query")
+
+    assert [ItemKind.REQUIREMENT] == lib.kinds
+    assert 3 == len(documents)
+
+
+def test_augmented_chat_limits_knowledge_size():
+    lib = LibraryMock()
+    config = AugmentedChatConfig()
+    config.max_knowledge_size = 100
+    chat = AugmentedChat(None, lib, config)
+
+    documents = chat.get_relevant_documents("query")
+
+    assert [ItemKind.DOCUMENT, ItemKind.REQUIREMENT] == lib.kinds
+    assert ["REQ-1", "REQ-2"] == [name for name, _, _ in documents]
+
+
+def test_augmented_chat_pins_mentioned_requirements():
+    lib = LibraryMock()
+    config = AugmentedChatConfig()
+    config.max_knowledge_items = 2
+    chat = AugmentedChat(None, lib, config)
+
+    documents = chat.get_relevant_documents("What about REQ-3")
+
+    assert [2] == lib.counts
+    assert ["REQ-3", "REQ-1"] == [name for name, _, _ in documents]
+
+
+def test_augmented_chat_skips_search_when_mentions_fill_budget():
+    lib = LibraryMock()
+    config = AugmentedChatConfig()
+    config.max_knowledge_items = 2
+    chat = AugmentedChat(None, lib, config)
+
+    documents = chat.get_relevant_documents("Compare REQ-3, REQ-2 and REQ-1")
+
+    assert [] == lib.counts
+    assert ["REQ-1", "REQ-2"] == [name for name, _, _ in documents]
@@ -1,11 +1,15 @@
+from vareq import vaingestion
 from vareq import vaknowledgelibrary
 from vareq import vallminterface
 from vareq import varequirementreader
 from typing import List
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 import tempfile
 import logging
 import pytest
 import os
+import threading
 
 TEST_DIR: str = os.path.dirname(os.path.realpath(__file__))
 RESOURCE_DIR: str = os.path.join(TEST_DIR, "resources")
@@ -13,14 +17,38 @@ logging.basicConfig(level=logging.DEBUG)
 
 
 class FakeLlm(vallminterface.Llm):
+    embeddings_calls: int
+    embedded_texts: List[str]
+
     def __init__(self):
-        pass
+        self.embeddings_model_name = "fake-embed"
+        self.embeddings_calls = 0
+        self.embedded_texts = []
 
-    def embedding(self, text: str) -> List[float]:
+    def embedding(self, text: str, task: str = None) -> List[float]:
         # Differentiate by length to support fake relevance searches
         result = [len(text), 2, 3, 4]
         return result
 
+    def embeddings(
+        self, texts: List[str], batch_size: int = None, task: str = None
+    ) -> List[List[float]]:
+        self.embeddings_calls = self.embeddings_calls + 1
+        self.embedded_texts.extend(texts)
+        return [self.embedding(text) for text in texts]
+
+
+def get_stored_timestamp(
+    library: vaknowledgelibrary.KnowledgeLibrary, path: str = None
+) -> float:
+    where = (
+        {"path": path}
+        if path is not None
+        else {"type": vaknowledgelibrary.ItemKind.REQUIREMENT.value}
+    )
+    metadatas = library.documents.get(where=where, include=["metadatas"])["metadatas"]
+    return min([metadata["timestamp"] for metadata in metadatas], default=-1)
+
 
 def test_docx_is_read_properly():
     llm = None  # unused
@@ -87,8 +115,8 @@ def test_registering_document_works():
     library.register_document("Test1", "test1.txt", 200, "Lorem Ipsum")
     library.register_document("Test2", "test2.txt", 500, "Lorem Ipsum")
 
-    timestamp1 = library.get_document_timestamp("test1.txt")
-    timestamp2 = library.get_document_timestamp("test2.txt")
+    timestamp1 = get_stored_timestamp(library, "test1.txt")
+    timestamp2 = get_stored_timestamp(library, "test2.txt")
     assert 200 == timestamp1
     assert 500 == timestamp2
 
@@ -177,6 +205,23 @@ def test_adding_requirements_works():
     assert "REQ-FUN-30" in docs[0] or "REQ-FUN-30" in docs[1]
 
 
+def test_adding_requirements_uses_single_embeddings_call():
+    db_path = os.path.join(tempfile.mkdtemp(), "db")
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = db_path
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    requirements = [
+        varequirementreader.Requirement(f"REQ-FUN-{i}", f"It should do {i}")
+        for i in range(10)
+    ]
+
+    library.add_requirements(requirements)
+
+    assert 1 == llm.embeddings_calls
+    assert 10 == len(library.get_all_documents())
+
+
 def test_deleting_requirements_works():
     db_path = os.path.join(tempfile.mkdtemp(), "db")
     llm = FakeLlm()
@@ -203,6 +248,551 @@ def test_getting_requirements_timestamp_works():
     req2 = varequirementreader.Requirement("REQ-FUN-30", "It should dance")
     library.add_requirements([req1, req2], 20.0)
 
-    timestamp = library.get_requirements_timestamp()
+    timestamp = get_stored_timestamp(library)
 
     assert 20.0 == timestamp
+
+
+def create_text_files(count: int) -> str:
+    directory = tempfile.mkdtemp()
+    for i in range(count):
+        with open(os.path.join(directory, f"file{i}.txt"), "w") as file:
+            file.write(f"Content of file {i}")
+    return directory
+
+
+def test_adding_directory_batches_chunks_of_many_documents():
+    directory = create_text_files(10)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.ingestion_config.workers = 2
+    config.ingestion_config.batch_size = 4
+    config.ingestion_config.queue_size = 2
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    added = library.add_directory(directory)
+
+    assert 10 == added
+    assert 3 == llm.embeddings_calls
+    assert 10 == len(library.get_all_documents())
+    assert 0 < get_stored_timestamp(library, os.path.join(directory, "file9.txt"))
+
+
+def test_touched_documents_are_saved_in_manifest_once():
+    directory = create_text_files(5)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.add_directory(directory)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    saves = []
+    save = library.manifest.save
+    library.manifest.save = lambda: saves.append(True) or save()
+
+    added = library.add_directory(directory)
+
+    assert 0 == added
+    assert 1 == len(saves)
+    assert 1 == llm.embeddings_calls
+
+
+def test_adding_directory_without_workers_works():
+    directory = create_text_files(3)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.ingestion_config.workers = 0
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    added = library.add_directory(directory)
+
+    assert 3 == added
+    assert 1 == llm.embeddings_calls
+
+
+class BrokenProcessPoolExecutor:
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, *args) -> Future:
+        future = Future()
+        future.set_exception(BrokenProcessPool("Worker died"))
+        return future
+
+
+def test_adding_directory_falls_back_to_parsing_without_workers(monkeypatch):
+    monkeypatch.setattr(vaingestion, "ProcessPoolExecutor", BrokenProcessPoolExecutor)
+    directory = create_text_files(10)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.ingestion_config.workers = 2
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    added = library.add_directory(directory)
+
+    assert 10 == added
+    assert 10 == len(library.get_all_documents())
+
+
+def test_few_documents_are_parsed_without_workers(monkeypatch):
+    monkeypatch.setattr(vaingestion, "ProcessPoolExecutor", None)
+    directory = create_text_files(3)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    added = library.add_directory(directory)
+
+    assert 3 == added
+
+
+def test_adding_directory_skips_unreadable_documents():
+    directory = create_text_files(2)
+    with open(os.path.join(directory, "broken.pdf"), "w") as file:
+        file.write("Not a PDF")
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    added = library.add_directory(directory)
+
+    assert 2 == added
+    assert 2 == len(library.get_all_documents())
+
+
+def test_adding_up_to_date_directory_adds_nothing():
+    directory = create_text_files(2)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.add_directory(directory)
+
+    added = library.add_directory(directory)
+
+    assert 0 == added
+    assert 1 == llm.embeddings_calls
+
+
+def create_chunked_library(llm: FakeLlm) -> vaknowledgelibrary.KnowledgeLibrary:
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    # Every paragraph becomes a chunk
+    config.chunk_size = 10
+    config.chunk_overlap = 0
+    return vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+
+def test_reregistering_unchanged_document_reuses_embeddings():
+    llm = FakeLlm()
+    library = create_chunked_library(llm)
+    library.register_document("Test", "test.txt", 200, "Alpha\n\nBeta\n\nGamma")
+
+    library.register_document("Test", "test.txt", 300, "Alpha\n\nBeta\n\nGamma")
+
+    assert 3 == len(llm.embedded_texts)
+    assert 300 == get_stored_timestamp(library, "test.txt")
+
+
+def test_reregistering_document_embeds_only_changed_chunks():
+    llm = FakeLlm()
+    library = create_chunked_library(llm)
+    library.register_document("Test", "test.txt", 200, "Alpha\n\nBeta\n\nGamma")
+
+    library.register_document("Test", "test.txt", 300, "Alpha\n\nDelta\n\nGamma")
+
+    assert ["Alpha", "Beta", "Gamma", "Delta"] == llm.embedded_texts
+    assert "### Document Test part 1\nDelta" in library.get_all_documents()
+
+
+def test_reregistering_document_reuses_moved_chunks():
+    llm = FakeLlm()
+    library = create_chunked_library(llm)
+    library.register_document("Test", "test.txt", 200, "Alpha\n\nBeta")
+
+    library.register_document("Test", "test.txt", 300, "Delta\n\nAlpha\n\nBeta")
+
+    assert ["Alpha", "Beta", "Delta"] == llm.embedded_texts
+    assert [
+        "### Document Test part 0\nDelta",
+        "### Document Test part 1\nAlpha",
+        "### Document Test part 2\nBeta",
+    ] == sorted(library.get_all_documents())
+    docs = library.get_relevant_documents("Beta", 1)
+    assert "### Document Test part 2\nBeta" == docs[0][2]
+
+
+def test_reregistering_shrunk_document_deletes_stale_chunks():
+    llm = FakeLlm()
+    library = create_chunked_library(llm)
+    library.register_document("Test", "test.txt", 200, "Alpha\n\nBeta\n\nGamma")
+    library.register_document("Other", "other.txt", 200, "Alpha\n\nBeta")
+
+    library.register_document("Test", "test.txt", 300, "Alpha")
+
+    assert [
+        "### Document Other part 0\nAlpha",
+        "### Document Other part 1\nBeta",
+        "### Document Test part 0\nAlpha",
+    ] == sorted(library.get_all_documents())
+
+
+def test_syncing_requirements_embeds_only_changes():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.sync_requirements(
+        [
+            varequirementreader.Requirement("REQ-1", "It should work"),
+            varequirementreader.Requirement("REQ-2", "It should dance"),
+            varequirementreader.Requirement("REQ-3", "It should sing"),
+        ],
+        10.0,
+    )
+    llm.embedded_texts = []
+
+    sync = library.sync_requirements(
+        [
+            varequirementreader.Requirement("REQ-1", "It should work"),
+            varequirementreader.Requirement("REQ-2", "It should jump"),
+            varequirementreader.Requirement("REQ-4", "It should fly"),
+        ],
+        20.0,
+    )
+
+    assert {"added": 1, "changed": 1, "removed": 1, "unchanged": 1} == sync.to_dict()
+    assert 2 == len(llm.embedded_texts)
+    docs = library.get_all_documents()
+    assert 3 == len(docs)
+    assert not any("REQ-3" in doc for doc in docs)
+    assert any("It should jump" in doc for doc in docs)
+    assert 20.0 == get_stored_timestamp(library)
+
+
+def test_setting_requirements_document_keeps_unchanged_requirements():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.requirement_document_mappings = varequirementreader.Mappings()
+    config.requirement_document_mappings.worksheet_name = "reqs"
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    path = os.path.join(RESOURCE_DIR, "test_requirements.xlsx")
+    library.set_requirements_document(path)
+    embedded = len(llm.embedded_texts)
+
+    updated = library.set_requirements_document(path, override=True)
+
+    assert updated
+    assert 0 < embedded
+    assert embedded == len(llm.embedded_texts)
+
+
+def test_reopened_library_uses_manifest():
+    directory = create_text_files(3)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    vaknowledgelibrary.KnowledgeLibrary(llm, config).add_directory(directory)
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    queried = []
+    get = library.documents.get
+    library.documents.get = lambda *args, **kwargs: queried.append(kwargs) or get(
+        *args, **kwargs
+    )
+
+    added = library.add_directory(directory)
+
+    assert 0 == added
+    assert [] == queried
+    assert 3 == len(library.manifest.documents)
+
+
+def test_manifest_is_rebuilt_for_existing_store():
+    directory = create_text_files(2)
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.add_directory(directory)
+    library.add_requirements(
+        [varequirementreader.Requirement("REQ-1", "It should work")], 10.0
+    )
+    os.remove(library.manifest.path)
+
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    assert 2 == len(library.manifest.documents)
+    assert 10.0 == library.manifest.requirements.mtime
+    assert 0 == library.add_directory(directory)
+
+
+def test_searching_for_relevant_documents_applies_filters():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Test1", "test1.txt", 200, "Car")
+    library.register_document("Test2", "test2.txt", 500, "Elephant")
+    library.add_requirements(
+        [varequirementreader.Requirement("REQ-1", "Cars shall be fast")]
+    )
+    kind = vaknowledgelibrary.ItemKind
+
+    requirements = library.get_relevant_documents("Car", 3, kinds=[kind.REQUIREMENT])
+    documents = library.get_relevant_documents("Car", 3, kinds=[kind.DOCUMENT])
+    by_path = library.get_relevant_documents("Car", 3, paths=["test2.txt"])
+    by_name = library.get_relevant_documents(
+        "Car", 3, kinds=[kind.DOCUMENT], names=["Test1", "REQ-1"]
+    )
+    nothing = library.get_relevant_documents("Car", 3, kinds=[])
+
+    assert ["REQ-1"] == [name for name, _, _ in requirements]
+    assert ["Test1", "Test2"] == [name for name, _, _ in documents]
+    assert ["Test2"] == [name for name, _, _ in by_path]
+    assert ["Test1"] == [name for name, _, _ in by_name]
+    assert [] == nothing
+
+
+def test_hybrid_search_ranks_exact_terms_first():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.hybrid_retrieval_config.enabled = True
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Food", "food.txt", 200, "Cat food")
+    library.register_document(
+        "Link", "link.txt", 200, "The SpaceWire link shall run at 200 Mbit/s"
+    )
+    library.add_requirements(
+        [varequirementreader.Requirement("REQ-1", "SpaceWire shall be used")]
+    )
+
+    docs = library.get_relevant_documents("SpaceWire", 2, kinds=[])
+    assert [] == docs
+    docs = library.get_relevant_documents(
+        "SpaceWire", 2, kinds=[vaknowledgelibrary.ItemKind.DOCUMENT]
+    )
+    assert ["Link", "Food"] == [name for name, _, _ in docs]
+
+    library.remove_document("link.txt")
+    docs = library.get_relevant_documents("SpaceWire", 2)
+    assert "REQ-1" == docs[0][0]
+    assert "Link" not in [name for name, _, _ in docs]
+
+
+def test_mentioned_requirements_are_found_without_embedding():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.add_requirements(
+        [
+            varequirementreader.Requirement("SRS-ASW-1", "It should work"),
+            varequirementreader.Requirement("SRS-ASW-10", "It should dance"),
+            varequirementreader.Requirement("SRS-ASW-117", "It should sing"),
+        ]
+    )
+    llm.embedded_texts = []
+
+    found = library.find_mentioned_requirements(
+        "Compare srs-asw-117 and SRS-ASW-10, but not SRS-ASW-1000 or XSRS-ASW-1"
+    )
+
+    assert ["SRS-ASW-117", "SRS-ASW-10"] == [name for name, _, _ in found]
+    assert "It should sing" in found[0][2]
+    assert [] == llm.embedded_texts
+
+
+def test_mentioned_requirements_follow_updates():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.sync_requirements([varequirementreader.Requirement("REQ-1", "It works")])
+    assert 1 == len(library.find_mentioned_requirements("REQ-1 and REQ-2"))
+
+    library.sync_requirements([varequirementreader.Requirement("REQ-2", "It runs")])
+
+    found = library.find_mentioned_requirements("REQ-1 and REQ-2")
+    assert ["REQ-2"] == [name for name, _, _ in found]
+    library.delete_all_requirements()
+    assert [] == library.find_mentioned_requirements("REQ-1 and REQ-2")
+
+
+class CountingLlm(FakeLlm):
+    embedding_calls: int
+
+    def __init__(self):
+        super().__init__()
+        self.embedding_calls = 0
+
+    def embedding(self, text: str, task: str = None) -> List[float]:
+        if task == "retrieval":
+            self.embedding_calls = self.embedding_calls + 1
+        return super().embedding(text, task)
+
+
+def test_repeated_retrieval_is_cached():
+    llm = CountingLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Test1", "test1.txt", 200, "Car")
+    queried = []
+    query = library.documents.query
+    library.documents.query = lambda *args, **kwargs: queried.append(kwargs) or query(
+        *args, **kwargs
+    )
+
+    first = library.get_relevant_documents("Car", 2)
+    second = library.get_relevant_documents("Car", 2)
+    library.get_relevant_documents("Car", 1)
+
+    assert first == second
+    assert 1 == llm.embedding_calls
+    assert 2 == len(queried)
+    stats = library.get_cache_stats()
+    assert 1 == stats["retrieval_cache"]["hits"]
+    assert 1 == stats["query_embedding_cache"]["hits"]
+
+
+def test_changes_invalidate_cached_retrieval():
+    llm = CountingLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Test1", "test1.txt", 200, "Car")
+    assert 1 == len(library.get_relevant_documents("Car", 2))
+
+    library.register_document("Test2", "test2.txt", 200, "Bus")
+    assert 2 == len(library.get_relevant_documents("Car", 2))
+    library.remove_document("test1.txt")
+    assert ["Test2"] == [
+        name for name, _, _ in library.get_relevant_documents("Car", 2)
+    ]
+    assert 1 == llm.embedding_calls
+
+
+def test_documents_stored_while_building_lexical_index_are_indexed():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Food", "food.txt", 200, "Cat food")
+    writers = []
+    get = library.documents.get
+
+    def get_while_storing(*args, **kwargs):
+        results = get(*args, **kwargs)
+        # Chunks are stored after the collection was read for the index
+        writer = threading.Thread(
+            target=library.index_lexically,
+            args=(["link.txt:0"], [{"name": "Link"}], ["The SpaceWire link"]),
+        )
+        writer.start()
+        writer.join(0.5)
+        writers.append(writer)
+        return results
+
+    library.documents.get = get_while_storing
+    index = library.get_lexical_index()
+    library.documents.get = get
+    writers[0].join()
+
+    assert ["Link"] == [
+        metadata["name"] for _, metadata, _ in index.search("SpaceWire", 2)
+    ]
+
+
+def test_requirements_stored_while_building_id_index_are_found():
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    writers = []
+    get = library.documents.get
+
+    def get_while_storing(*args, **kwargs):
+        results = get(*args, **kwargs)
+        # Requirements are stored after the collection was read for the index
+        writer = threading.Thread(
+            target=library.index_requirement_ids,
+            args=(["REQ-1"], ["Use SpaceWire"]),
+        )
+        writer.start()
+        writer.join(0.5)
+        writers.append(writer)
+        return results
+
+    library.documents.get = get_while_storing
+    index = library.get_requirement_index()
+    library.documents.get = get
+    writers[0].join()
+
+    assert ["REQ-1"] == [id for id, _ in index.find("See REQ-1")]
+
+
+def test_cached_retrieval_depends_on_model_and_hybrid_settings():
+    llm = CountingLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Test1", "test1.txt", 200, "Car")
+    queried = []
+    query = library.documents.query
+    library.documents.query = lambda *args, **kwargs: queried.append(kwargs) or query(
+        *args, **kwargs
+    )
+
+    library.get_relevant_documents("Car", 2)
+    config.hybrid_retrieval_config.enabled = True
+    library.get_relevant_documents("Car", 2)
+    llm.embeddings_model_name = "other-embed"
+    library.get_relevant_documents("Car", 2)
+    library.get_relevant_documents("Car", 2)
+
+    assert 3 == len(queried)
+
+
+def test_query_embeddings_are_cached_per_model():
+    llm = CountingLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+
+    library.get_query_embedding("Car")
+    llm.embeddings_model_name = "other-embed"
+    library.get_query_embedding("Car")
+    library.get_query_embedding("Car")
+
+    assert 2 == llm.embedding_calls
+
+
+def test_retrieval_caches_can_be_disabled():
+    llm = CountingLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.query_embedding_cache.enabled = False
+    config.retrieval_cache.enabled = False
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.register_document("Test1", "test1.txt", 200, "Car")
+
+    library.get_relevant_documents("Car", 2)
+    library.get_relevant_documents("Car", 2)
+
+    assert 2 == llm.embedding_calls
+    assert {} == library.get_cache_stats()
@@ -0,0 +1,107 @@
+from vareq.valexical import HybridRetrievalConfig, LexicalIndex, fuse_rankings, tokenize
+import logging
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def create_index() -> LexicalIndex:
+    index = LexicalIndex(HybridRetrievalConfig())
+    index.add(
+        ["a", "b", "c"],
+        [{"type": 1}, {"type": 1}, {"type": 2}],
+        [
+            "The SpaceWire link shall support 200 Mbit/s.",
+            "The TC(17,1) service shall be supported, as per ECSS-E-ST-70-41C.",
+            "Software shall follow ECSS-E-ST-40C.",
+        ],
+    )
+    return index
+
+
+def test_words_are_tokenized_whole_and_by_parts():
+    tokens = tokenize("Use TC(17,1) and ECSS-E-ST-40C.")
+
+    assert "tc(17,1)" in tokens
+    assert "tc" in tokens
+    assert "17" in tokens
+    assert "ecss-e-st-40c" in tokens
+    assert "40c" in tokens
+    assert "use" in tokens
+
+
+def test_brackets_around_words_are_not_tokenized():
+    tokens = tokenize(
+        "As required (ECSS-E-ST-40C). See [SRS-ASW-042], (TC(17,1)) and f(x"
+    )
+
+    assert "ecss-e-st-40c" in tokens
+    assert "srs-asw-042" in tokens
+    assert "tc(17,1)" in tokens
+    assert "f" in tokens
+    assert "x" in tokens
+    assert not any(token[0] in "([" for token in tokens)
+    assert "(tc(17,1))" not in tokens
+    assert "srs-asw-042]" not in tokens
+
+
+def test_bracketed_requirement_is_found_by_its_id():
+    index = LexicalIndex(HybridRetrievalConfig())
+    index.add(
+        ["a", "b"],
+        [{"type": 1}, {"type": 1}],
+        [
+            "The link is covered by [SRS-ASW-042].",
+            "The link is covered by SRS-ASW-043.",
+        ],
+    )
+
+    result = index.search("SRS-ASW-042", 1)
+
+    assert ["a"] == [id for id, _, _ in result]
+
+
+def test_exact_terms_are_ranked_first():
+    index = create_index()
+
+    assert ["c"] == [id for id, _, _ in index.search("ECSS-E-ST-40C", 1)]
+    assert "b" == index.search("What does TC(17,1) do", 3)[0][0]
+    assert "a" == index.search("spacewire", 3)[0][0]
+    assert [] == index.search("unknown", 3)
+
+
+def test_search_applies_predicate():
+    index = create_index()
+
+    results = index.search("ECSS", 3, lambda metadata: metadata["type"] == 1)
+
+    assert ["b"] == [id for id, _, _ in results]
+
+
+def test_removed_items_are_not_found():
+    index = create_index()
+
+    index.remove(["c"])
+
+    assert ["b"] == [id for id, _, _ in index.search("ECSS-E-ST-40C", 3)]
+    assert "40c" not in index.postings
+
+    index.remove_where(lambda metadata: metadata["type"] == 1)
+
+    assert [] == index.search("ECSS SpaceWire", 3)
+    assert 0 == index.size()
+    assert 0 == index.total_length
+
+
+def test_readded_item_replaces_previous_content():
+    index = create_index()
+
+    index.add(["a"], [{"type": 1}], ["Now about MIL-STD-1553"])
+
+    assert [] == index.search("SpaceWire", 3)
+    assert "a" == index.search("MIL-STD-1553", 3)[0][0]
+
+
+def test_rankings_are_fused_by_reciprocal_rank():
+    fused = fuse_rankings([["a", "b", "c"], ["b", "d"]], 60)
+
+    assert ["b", "a", "d", "c"] == fused
@@ -1,7 +1,13 @@
+from typing import List, Dict, Tuple
+import asyncio
 from vareq import vallminterface
 import logging
+import ollama
 import pytest
 import os
+import tempfile
+import threading
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -42,6 +48,724 @@ def test_chat_does_not_alter_thoughtless_replies():
     assert "This (2+1!=x^2) is some serious math!" == reply_out
 
 
+class FakeOllamaClient:
+    prompts: List[str]
+    batches: List[List[str]]
+    requests: List[Dict]
+    closed: bool
+
+    def __init__(self):
+        self.prompts = []
+        self.batches = []
+        self.requests = []
+        self.closed = False
+
+    def generate(self, stream: bool = False, **request):
+        self.requests.append(request)
+        self.prompts.append(request["prompt"])
+        reply = f"Reply {len(self.prompts)}"
+        counters = {
+            "prompt_eval_count": len(request["prompt"]),
+            "eval_count": 2,
+            "prompt_eval_duration": 1000000000,
+            "eval_duration": 500000000,
+            "load_duration": 0,
+        }
+        if stream:
+            return iter(
+                [
+                    {"response": "Reply ", "done": False},
+                    {"response": str(len(self.prompts)), "done": False},
+                    {"response": "", "done": True, **counters},
+                ]
+            )
+        return {"response": reply, "done": True, **counters}
+
+    def embed(self, **request):
+        self.requests.append(request)
+        texts = request["input"]
+        self.batches.append(texts)
+        return {
+            "embeddings": [[float(len(text)), 1.0] for text in texts],
+            "prompt_eval_count": len(texts),
+            "load_duration": 250000000,
+        }
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncOllamaClient:
+    client: FakeOllamaClient
+
+    def __init__(self, client: FakeOllamaClient):
+        self.client = client
+
+    async def generate(self, **request):
+        return self.client.generate(**request)
+
+    async def embed(self, **request):
+        return self.client.embed(**request)
+
+
+def install_fake_client(endpoint: vallminterface.LlmEndpoint) -> FakeOllamaClient:
+    client = FakeOllamaClient()
+    endpoint.client = client
+    endpoint.create_async_client = lambda: FakeAsyncOllamaClient(client)
+    return client
+
+
+def test_embeddings_are_computed_in_batches():
+    config = vallminterface.LlmConfig()
+    config.embeddings_batch_size = 2
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    model = install_fake_client(llm.endpoints[0])
+
+    result = llm.embeddings(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0], [4.0, 1.0], [5.0, 1.0]] == result
+    assert [["a", "bb"], ["ccc", "dddd"], ["eeeee"]] == model.batches
+
+
+def test_embeddings_are_computed_singly_for_zero_batch_size():
+    config = vallminterface.LlmConfig()
+    config.embeddings_batch_size = 0
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    model = install_fake_client(llm.endpoints[0])
+
+    result = llm.embeddings(["a", "bb"])
+
+    assert [[1.0, 1.0], [2.0, 1.0]] == result
+    assert [["a"], ["bb"]] == model.batches
+
+
+def test_embeddings_are_cached():
+    config = vallminterface.LlmConfig()
+    config.embedding_cache.path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    llm = vallminterface.Llm(config)
+    model = install_fake_client(llm.endpoints[0])
+
+    first = llm.embeddings(["a", "bb", "a"])
+    second = llm.embeddings(["bb", "ccc"])
+
+    assert [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]] == first
+    assert [[2.0, 1.0], [3.0, 1.0]] == second
+    assert [["a", "bb"], ["ccc"]] == model.batches
+    assert 1 == llm.embedding_cache.stats.hits
+    # Single precision values
+    assert 8 == len(llm.embedding_cache.get(llm.get_embedding_cache_key("a")))
+
+
+def create_llm_with_response_cache() -> vallminterface.Llm:
+    config = vallminterface.LlmConfig()
+    config.temperature = 0
+    config.response_cache.enabled = True
+    config.response_cache.path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    llm = vallminterface.Llm(config)
+    install_fake_client(llm.endpoints[0])
+    return llm
+
+
+def test_responses_are_cached_when_requested():
+    llm = create_llm_with_response_cache()
+
+    first = llm.query("What are you", use_cache=True)
+    second = llm.query("What are you", use_cache=True)
+
+    assert "Reply 1" == first
+    assert "Reply 1" == second
+    assert 1 == len(llm.endpoints[0].client.prompts)
+
+
+def test_response_cache_can_be_bypassed():
+    llm = create_llm_with_response_cache()
+
+    llm.query("What are you", use_cache=True)
+    bypassed = llm.query("What are you", use_cache=False)
+
+    assert "Reply 2" == bypassed
+    assert 2 == len(llm.endpoints[0].client.prompts)
+
+
+def test_async_embeddings_are_computed_in_batches():
+    config = vallminterface.LlmConfig()
+    config.embeddings_batch_size = 2
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    model = install_fake_client(llm.endpoints[0])
+
+    result = asyncio.run(llm.aembeddings(["a", "bb", "ccc"]))
+    single = asyncio.run(llm.aembedding("dddd"))
+
+    assert [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]] == result
+    assert [4.0, 1.0] == single
+    assert [["a", "bb"], ["ccc"], ["dddd"]] == model.batches
+
+
+class SlowAsyncOllamaClient(FakeAsyncOllamaClient):
+    async def embed(self, **request):
+        await asyncio.sleep(0.01)
+        return self.client.embed(**request)
+
+
+def test_async_embeddings_do_not_overflow_the_scheduler_queue():
+    config = vallminterface.LlmConfig()
+    config.embeddings_batch_size = 1
+    config.embedding_cache.enabled = False
+    config.scheduler_config.max_in_flight = 2
+    config.scheduler_config.queue_size = 0
+    llm = vallminterface.Llm(config)
+    model = install_fake_client(llm.endpoints[0])
+    llm.endpoints[0].create_async_client = lambda: SlowAsyncOllamaClient(model)
+    texts = ["a" * length for length in range(1, 9)]
+
+    result = asyncio.run(llm.aembeddings(texts))
+
+    assert [[float(length), 1.0] for length in range(1, 9)] == result
+    assert 8 == len(model.batches)
+    assert 0 == llm.scheduler.stats.rejected
+
+
+def test_async_clients_are_created_per_event_loop():
+    endpoint = vallminterface.LlmEndpoint("127.0.0.1:11434")
+
+    async def get_clients():
+        return endpoint.get_async_client(), endpoint.get_async_client()
+
+    first, same = asyncio.run(get_clients())
+    second, _ = asyncio.run(get_clients())
+
+    assert first is same
+    assert first is not second
+
+
+def test_async_query_shares_response_cache():
+    llm = create_llm_with_response_cache()
+
+    first = asyncio.run(llm.aquery("What are you", use_cache=True))
+    second = llm.query("What are you", use_cache=True)
+
+    assert "Reply 1" == first
+    assert "Reply 1" == second
+    assert 1 == len(llm.endpoints[0].client.prompts)
+
+
+def test_connection_pool_is_configured():
+    config = vallminterface.LlmConfig()
+    config.connection_config.pool_size = 7
+    config.connection_config.connect_timeout = 2.0
+    config.connection_config.read_timeout = 0
+    llm = vallminterface.Llm(config)
+
+    kwargs = llm.get_client_kwargs()
+
+    assert 7 == kwargs["limits"].max_connections
+    assert 2.0 == kwargs["timeout"].connect
+    assert kwargs["timeout"].read is None
+
+
+def stream_through_filter(tokens: List[str]) -> str:
+    thinking_filter = vallminterface.ThinkingFilter()
+    parts = [thinking_filter.feed(token) for token in tokens]
+    parts.append(thinking_filter.flush())
+    return "".join(parts)
+
+
+def test_thinking_filter_removes_thinking_from_stream():
+    tokens = ["<think>", "If a > b", "</think>", "\n", "Apples", " are green!"]
+
+    assert "Apples are green!" == stream_through_filter(tokens)
+
+
+def test_thinking_filter_handles_markers_split_between_tokens():
+    tokens = ["<th", "ink>hidden</th", "in", "k>Vis", "ible <", "b>bold</b>"]
+
+    assert "Visible <b>bold</b>" == stream_through_filter(tokens)
+
+
+def test_thinking_filter_does_not_alter_thoughtless_stream():
+    tokens = ["This (2+1!=x^2) ", "is some serious math", "!"]
+
+    assert "This (2+1!=x^2) is some serious math!" == stream_through_filter(tokens)
+
+
+def test_query_can_be_streamed():
+    config = vallminterface.LlmConfig()
+    llm = vallminterface.Llm(config)
+    install_fake_client(llm.endpoints[0])
+
+    tokens = list(llm.stream_query("What are you"))
+
+    assert ["Reply ", "1"] == tokens
+    assert 1 == llm.scheduler.stats.completed
+    assert 0 == llm.scheduler.stats.in_flight
+
+
+class StreamingLlmMock:
+    queries: List[str]
+
+    def __init__(self):
+        self.queries = []
+
+    def query(
+        self,
+        question: str,
+        use_cache: bool = False,
+        task: str = None,
+        routes: List[str] = None,
+    ) -> str:
+        self.queries.append(question)
+        return "Summary"
+
+    def stream_query(self, question: str, task: str = None):
+        self.queries.append(question)
+        yield from ["<think>", "Hmm", "</think>", "Apples", " are green!"]
+
+
+def test_chat_can_be_streamed():
+    llm = StreamingLlmMock()
+    chat = vallminterface.Chat(llm, vallminterface.ChatConfig())
+
+    parts = list(chat.chat_stream("", "What color are apples?"))
+
+    assert "Apples are green!" == "".join(parts)
+    assert "Summary" == chat.history
+    assert "Apples are green!" in llm.queries[1]
+    assert "Hmm" not in llm.queries[1]
+
+
+class SummarizingLlmMock:
+    queries: List[Tuple[str, str]]
+    release: threading.Event
+
+    def __init__(self):
+        self.queries = []
+        self.release = threading.Event()
+
+    def query(
+        self,
+        question: str,
+        use_cache: bool = False,
+        task: str = None,
+        routes: List[str] = None,
+    ) -> str:
+        self.queries.append((task, question))
+        if task == "history":
+            self.release.wait()
+            return "Summary"
+        return "Answer"
+
+    def get_queries(self, task: str) -> List[str]:
+        return [question for query_task, question in self.queries if query_task == task]
+
+
+def create_background_chat(timeout: float) -> vallminterface.Chat:
+    config = vallminterface.ChatConfig()
+    config.background_summarization = True
+    config.summary_wait_timeout = timeout
+    config.query_template = "{0}|{1}|{2}"
+    return vallminterface.Chat(SummarizingLlmMock(), config)
+
+
+def test_chat_returns_before_background_summary():
+    chat = create_background_chat(-1)
+
+    answer = chat.chat("", "First question")
+    pending = list(chat.pending_exchanges)
+    chat.llm.release.set()
+    chat.chat("", "Second question")
+
+    assert "Answer" == answer
+    assert [("First question", "Answer")] == pending
+    # The second query waited for the summary of the first exchange
+    assert chat.llm.get_queries("chat")[1].startswith("Summary|")
+
+
+def test_chat_uses_verbatim_exchange_when_summary_is_late():
+    chat = create_background_chat(0)
+
+    chat.chat("", "First question")
+    chat.chat("", "Second question")
+    chat.llm.release.set()
+    chat._summary.result()
+
+    second_query = chat.llm.get_queries("chat")[1]
+    assert "User: First question\nSystem: Answer" in second_query
+    assert [] == chat.pending_exchanges
+    assert "Summary" == chat.history
+
+
+def create_rolling_chat(budget: int) -> vallminterface.Chat:
+    config = vallminterface.ChatConfig()
+    config.memory_strategy = vallminterface.MemoryStrategy.ROLLING
+    config.memory_token_budget = budget
+    config.chars_per_token = 1
+    config.turn_template = "[{0}:{1}]"
+    config.query_template = "{0}|{1}|{2}"
+    llm = SummarizingLlmMock()
+    llm.release.set()
+    return vallminterface.Chat(llm, config)
+
+
+def test_rolling_memory_keeps_short_history_verbatim():
+    chat = create_rolling_chat(100)
+
+    chat.chat("", "Q1")
+    chat.chat("", "Q2")
+
+    assert [] == chat.llm.get_queries("history")
+    assert "[Q1:Answer]|" in chat.llm.get_queries("chat")[1]
+    assert "[Q1:Answer][Q2:Answer]" == chat.get_history()
+
+
+def test_rolling_memory_compresses_oldest_exchanges_over_budget():
+    # Each exchange takes 11 tokens
+    chat = create_rolling_chat(30)
+
+    for question in ["Q1", "Q2", "Q3"]:
+        chat.chat("", question)
+    compressions = chat.llm.get_queries("history")
+
+    assert 1 == len(compressions)
+    assert "[Q1:Answer][Q2:Answer]" in compressions[0]
+    assert "Q3" not in compressions[0]
+    assert [("Q3", "Answer")] == chat.pending_exchanges
+    assert "Summary[Q3:Answer]" == chat.get_history()
+
+
+def test_rolling_memory_can_be_compressed_in_background():
+    chat = create_rolling_chat(30)
+    chat.config.background_summarization = True
+
+    for question in ["Q1", "Q2", "Q3"]:
+        chat.chat("", question)
+    chat._summary.result()
+
+    assert 1 == len(chat.llm.get_queries("history"))
+    assert "Summary[Q3:Answer]" == chat.get_history()
+
+
+def test_warm_up_loads_both_models():
+    config = vallminterface.LlmConfig()
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    client = install_fake_client(llm.endpoints[0])
+
+    ready = llm.warm_up()
+
+    assert ready
+    assert [""] == client.prompts
+    assert 1 == len(client.batches)
+
+
+def test_keep_alive_is_passed_to_models():
+    config = vallminterface.LlmConfig()
+    config.keep_alive = 7200
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    client = install_fake_client(llm.endpoints[0])
+
+    llm.query("What are you")
+    llm.embeddings(["a"])
+
+    assert [7200, 7200] == [request["keep_alive"] for request in client.requests]
+
+
+class FailingOllamaClient:
+    def generate(self, **request):
+        raise ConnectionError("Server down")
+
+
+class RejectingOllamaClient:
+    status_code: int
+    prompts: List[str]
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.prompts = []
+
+    def generate(self, **request):
+        self.prompts.append(request["prompt"])
+        raise ollama.ResponseError("Request failed", self.status_code)
+
+
+def create_llm_with_endpoints(count: int) -> vallminterface.Llm:
+    config = vallminterface.LlmConfig()
+    config.urls = [f"host{i}:11434" for i in range(count)]
+    config.connection_config.health_check_interval = 0
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    for endpoint in llm.endpoints:
+        install_fake_client(endpoint)
+    return llm
+
+
+def test_llm_creates_endpoint_per_url():
+    config = vallminterface.LlmConfig()
+    config.urls = ["host0:11434", "host1:11434", "host2:11434"]
+    config.connection_config.health_check_interval = 0
+    llm = vallminterface.Llm(config)
+
+    assert ["host0:11434", "host1:11434", "host2:11434"] == [
+        endpoint.url for endpoint in llm.endpoints
+    ]
+    assert "http://host1:11434" == str(llm.endpoints[1].client._client.base_url)
+
+
+def test_closing_llm_stops_health_checks():
+    config = vallminterface.LlmConfig()
+    config.urls = ["host0:11434", "host1:11434"]
+    config.connection_config.health_check_interval = 60
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    for endpoint in llm.endpoints:
+        install_fake_client(endpoint)
+    health_checks = llm._health_checks
+
+    llm.close()
+
+    assert not health_checks.is_alive()
+    assert all(endpoint.client.closed for endpoint in llm.endpoints)
+    with pytest.raises(RuntimeError):
+        llm.scheduler.submit(lambda: None)
+
+
+def test_requests_are_spread_across_endpoints():
+    llm = create_llm_with_endpoints(2)
+    llm.endpoints[0].outstanding = 1
+
+    llm.query("What are you")
+    llm.embeddings(["a"])
+
+    assert 1 == len(llm.endpoints[1].client.prompts)
+    assert 1 == len(llm.endpoints[1].client.batches)
+    assert 0 == len(llm.endpoints[0].client.prompts)
+    assert 0 == llm.endpoints[1].outstanding
+
+
+def test_failed_request_is_retried_on_another_endpoint():
+    llm = create_llm_with_endpoints(2)
+    llm.endpoints[0].client = FailingOllamaClient()
+
+    result = llm.query("What are you")
+    next_result = llm.query("What are you")
+
+    assert "Reply 1" == result
+    assert "Reply 2" == next_result
+    assert not llm.endpoints[0].healthy
+    assert llm.endpoints[1].healthy
+
+
+def test_server_error_is_retried_on_another_endpoint():
+    llm = create_llm_with_endpoints(2)
+    llm.endpoints[0].client = RejectingOllamaClient(503)
+
+    result = llm.query("What are you")
+
+    assert "Reply 1" == result
+    assert not llm.endpoints[0].healthy
+
+
+def test_rejected_request_is_not_retried():
+    llm = create_llm_with_endpoints(2)
+    for endpoint in llm.endpoints:
+        endpoint.client = RejectingOllamaClient(404)
+
+    with pytest.raises(ollama.ResponseError):
+        llm.query("What are you")
+
+    assert 1 == sum(len(endpoint.client.prompts) for endpoint in llm.endpoints)
+    assert all(endpoint.healthy for endpoint in llm.endpoints)
+
+
+def test_request_fails_when_all_endpoints_fail():
+    llm = create_llm_with_endpoints(2)
+    for endpoint in llm.endpoints:
+        endpoint.client = FailingOllamaClient()
+
+    with pytest.raises(ConnectionError):
+        llm.query("What are you")
+
+
+def test_usage_is_aggregated_per_task():
+    config = vallminterface.LlmConfig()
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+    install_fake_client(llm.endpoints[0])
+
+    llm.query("abc", task="review")
+    llm.query("abcde", task="review")
+    list(llm.stream_query("ab", task="chat"))
+    llm.embeddings(["a", "b", "c"], task="ingestion")
+    usage = llm.usage.to_dict()
+
+    assert ["chat", "ingestion", "review"] == sorted(usage.keys())
+    assert 2 == usage["review"]["calls"]
+    assert 8 == usage["review"]["prompt_eval_count"]
+    assert 4 == usage["review"]["eval_count"]
+    assert 2.0 == usage["review"]["prompt_eval_duration"]
+    assert 1.0 == usage["review"]["eval_duration"]
+    assert 1 == usage["chat"]["calls"]
+    assert 2 == usage["chat"]["prompt_eval_count"]
+    assert 3 == usage["ingestion"]["prompt_eval_count"]
+    assert 0.25 == usage["ingestion"]["load_duration"]
+    assert 0 == usage["ingestion"]["eval_count"]
+
+
+def test_cached_responses_are_not_counted_as_usage():
+    llm = create_llm_with_response_cache()
+
+    llm.query("What are you", use_cache=True, task="review")
+    llm.query("What are you", use_cache=True, task="review")
+
+    assert 1 == llm.usage.get("review").calls
+
+
+def test_tasks_are_routed_to_configured_models():
+    config = vallminterface.LlmConfig()
+    config.temperature = 0.5
+    config.task_routes = {
+        "history": {"model": "small", "options": {"temperature": 0}},
+        "batch-pair": {"options": {"num_predict": 16}},
+    }
+    llm = vallminterface.Llm(config)
+    client = install_fake_client(llm.endpoints[0])
+
+    llm.query("Summarize", task="history")
+    llm.query("Compare", task="duplicates", routes=["duplicates", "batch-pair"])
+    llm.query("Answer", task="chat")
+
+    assert ["small", "qwen3:0.6b", "qwen3:0.6b"] == [
+        request["model"] for request in client.requests
+    ]
+    assert [
+        {"temperature": 0},
+        {"temperature": 0.5, "num_predict": 16},
+        {"temperature": 0.5},
+    ] == [request["options"] for request in client.requests]
+
+
+def test_response_cache_distinguishes_routed_models():
+    llm = create_llm_with_response_cache()
+    llm.task_routes = {"review": {"model": "small"}}
+
+    first = llm.query("What are you", use_cache=True, task="review")
+    second = llm.query("What are you", use_cache=True, task="chat")
+
+    assert "Reply 1" == first
+    assert "Reply 2" == second
+
+
+def test_constraints_are_added_to_request():
+    config = vallminterface.LlmConfig()
+    config.temperature = 0.5
+    config.task_routes = {"check": {"options": {"num_ctx": 4096}}}
+    llm = vallminterface.Llm(config)
+    client = install_fake_client(llm.endpoints[0])
+
+    llm.query(
+        "Score",
+        task="check",
+        constraints={"format": "json", "think": False, "options": {"num_predict": 8}},
+    )
+
+    request = client.requests[0]
+    assert "json" == request["format"]
+    assert request["think"] is False
+    assert {"temperature": 0.5, "num_ctx": 4096, "num_predict": 8} == request["options"]
+
+
+def test_warm_up_loads_routed_models():
+    config = vallminterface.LlmConfig()
+    config.embedding_cache.enabled = False
+    config.task_routes = {
+        "history": {"model": "small"},
+        "review": {"model": "small"},
+        "chat": {"options": {"temperature": 0}},
+    }
+    llm = vallminterface.Llm(config)
+    client = install_fake_client(llm.endpoints[0])
+
+    llm.warm_up()
+
+    assert ["qwen3:0.6b", "small"] == [
+        request["model"] for request in client.requests if "prompt" in request
+    ]
+
+
+class BlockingOllamaClient(FakeOllamaClient):
+    entered: threading.Event
+    release: threading.Event
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def generate(self, stream: bool = False, **request):
+        self.entered.set()
+        self.release.wait()
+        return super().generate(stream, **request)
+
+    def embed(self, **request):
+        self.entered.set()
+        self.release.wait()
+        return super().embed(**request)
+
+
+def run_concurrently(llm: vallminterface.Llm, calls: List) -> List:
+    client = BlockingOllamaClient()
+    llm.endpoints[0].client = client
+    results = [None] * len(calls)
+
+    def run(index: int):
+        results[index] = calls[index]()
+
+    def coalesced() -> int:
+        return llm.pending_responses.coalesced + llm.pending_embeddings.coalesced
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+    # The first call becomes the leader, the others join it
+    threads[0].start()
+    client.entered.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while coalesced() < len(calls) - 1:
+        time.sleep(0.01)
+    client.release.set()
+    for thread in threads:
+        thread.join()
+    return results, client
+
+
+def test_concurrent_identical_queries_share_a_call():
+    config = vallminterface.LlmConfig()
+    llm = vallminterface.Llm(config)
+
+    results, client = run_concurrently(
+        llm, [lambda: llm.query("What are you", task="review")] * 3
+    )
+
+    assert ["Reply 1"] * 3 == results
+    assert 1 == len(client.prompts)
+    assert 1 == llm.usage.get("review").calls
+
+
+def test_concurrent_identical_embeddings_share_a_call():
+    config = vallminterface.LlmConfig()
+    config.embedding_cache.enabled = False
+    llm = vallminterface.Llm(config)
+
+    results, client = run_concurrently(
+        llm, [lambda: llm.embeddings(["a", "bb"]), lambda: llm.embeddings(["bb"])]
+    )
+
+    assert [[[1.0, 1.0], [2.0, 1.0]], [[2.0, 1.0]]] == results
+    assert [["a", "bb"]] == client.batches
+
+
 def test_chat_query():
     config = vallminterface.LlmConfig()
     llm = vallminterface.Llm(config)
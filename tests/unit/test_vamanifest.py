@@ -0,0 +1,65 @@
+from vareq.vamanifest import IndexManifest, ManifestEntry, create_entry
+import logging
+import os
+import tempfile
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def create_file(content: str) -> str:
+    path = os.path.join(tempfile.mkdtemp(), "file.txt")
+    with open(path, "w") as file:
+        file.write(content)
+    return path
+
+
+def test_manifest_is_stored_and_loaded():
+    path = os.path.join(tempfile.mkdtemp(), "manifest.json")
+    manifest = IndexManifest(path)
+    manifest.set_document(ManifestEntry("a.txt", 10.0, 20, "abc", 3))
+    manifest.set_requirements(ManifestEntry("reqs.xlsx", 30.0, count=100))
+    manifest.save()
+
+    loaded = IndexManifest(path)
+    loaded.load()
+
+    assert (
+        manifest.get_document("a.txt").to_dict()
+        == loaded.get_document("a.txt").to_dict()
+    )
+    assert 100 == loaded.requirements.count
+    assert loaded.get_document("b.txt") is None
+
+
+def test_unchanged_file_is_up_to_date():
+    path = create_file("Content")
+    manifest = IndexManifest(os.path.join(tempfile.mkdtemp(), "manifest.json"))
+    entry = create_entry(path)
+
+    assert manifest.is_up_to_date(entry, path)
+    assert not manifest.is_up_to_date(None, path)
+
+
+def test_touched_file_is_up_to_date():
+    path = create_file("Content")
+    manifest = IndexManifest(os.path.join(tempfile.mkdtemp(), "manifest.json"))
+    entry = create_entry(path)
+    os.utime(path, (entry.mtime + 10, entry.mtime + 10))
+
+    assert manifest.is_up_to_date(entry, path)
+    assert entry.mtime == os.path.getmtime(path)
+    assert not manifest.exists()
+    manifest.save_if_dirty()
+    assert manifest.exists()
+    assert not manifest.dirty
+
+
+def test_modified_file_is_not_up_to_date():
+    path = create_file("Content")
+    manifest = IndexManifest(os.path.join(tempfile.mkdtemp(), "manifest.json"))
+    entry = create_entry(path)
+    with open(path, "w") as file:
+        file.write("Contest")
+    os.utime(path, (entry.mtime + 10, entry.mtime + 10))
+
+    assert not manifest.is_up_to_date(entry, path)
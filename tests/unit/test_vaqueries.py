@@ -1,9 +1,11 @@
-from typing import List
+from typing import List, Dict
 from vareq import helpers
 from vareq.vaqueries import PredefinedQueryReader, QueryKind, QueryArity
 import logging
 import pytest
 import os
+import threading
+import time
 from vareq.vaqueries import PredefinedQueries, PredefinedQuery, QueryArity, QueryKind
 from vareq.varequirementreader import Requirement
 
@@ -15,15 +17,26 @@ logging.basicConfig(level=logging.DEBUG)
 class LlmMock:
     _embedding_return: List[float]
     _query_return: str
+    routes: List[List[str]]
+    constraints: List[Dict]
 
     def __init__(self, embedding_return=None, query_return=None):
         self._embedding_return = embedding_return or [1.0, 0.0, 0.0]
         self._query_return = query_return or "42"
+        self.routes = []
+        self.constraints = []
 
-    def embedding(self, text):
+    def embedding(self, text, task=None):
         return self._embedding_return
 
-    def query(self, question):
+    def embeddings(self, texts, batch_size=None, task=None):
+        return [self._embedding_return for _ in texts]
+
+    def query(
+        self, question, use_cache=False, task=None, routes=None, constraints=None
+    ):
+        self.routes.append(routes)
+        self.constraints.append(constraints)
         return self._query_return
 
 
@@ -162,6 +175,117 @@ def test_process_batch_response_handles_binary_query_under_threshold():
         assert element.message is None
 
 
+class SlowLlmMock(LlmMock):
+    questions: List[str]
+    running: int
+    max_running: int
+
+    def __init__(self, query_return=None):
+        super().__init__(query_return=query_return)
+        self.questions = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def query(
+        self, question, use_cache=False, task=None, routes=None, constraints=None
+    ):
+        with self._lock:
+            self.questions.append(question)
+            self.running = self.running + 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running = self.running - 1
+        return super().query(question, use_cache, task, routes, constraints)
+
+
+def test_process_batch_response_queries_pairs_concurrently():
+    llm = SlowLlmMock(query_return="30")
+    queries = PredefinedQueries(llm)
+    query = PredefinedQuery(QueryKind.BINARY, QueryArity.NARY, "id", "{0} {7}")
+    query.threshold = 50
+    requirements = [
+        create_requirement(f"REQ-{i}", f"Description {i}") for i in range(6)
+    ]
+    batch = queries.initialize_batch_response(requirements)
+    result = queries.process_batch_response(query, batch)
+    assert 1 < llm.max_running
+    # Every pair is queried once, in either order
+    pairs = [frozenset(question.split(" ")) for question in llm.questions]
+    assert len(pairs) == len(set(pairs))
+    assert all(0 == len(element.applied_requirements) for element in result)
+
+
+def test_queries_are_routed_by_id_and_kind():
+    llm = LlmMock(query_return="80")
+    queries = PredefinedQueries(llm)
+    unary = PredefinedQuery(QueryKind.BINARY, QueryArity.UNARY, "check", "{0} {1}")
+    nary = PredefinedQuery(QueryKind.BINARY, QueryArity.NARY, "multi", "{0} {1}")
+    queries.register(unary)
+    requirements = [
+        create_requirement("REQ-10", "Description A"),
+        create_requirement("REQ-20", "Description B"),
+    ]
+    queries.process("check", requirements[0])
+    batch = queries.initialize_batch_response(requirements)
+    queries.process_batch_response(nary, batch)
+    assert ["check", "binary-query"] == llm.routes[0]
+    assert ["multi", "batch-pair"] == llm.routes[1]
+
+
+def test_process_scores_binary_query_with_constrained_generation():
+    llm = LlmMock(query_return='{"score": 80}')
+    queries = PredefinedQueries(llm)
+    queries.binary_scoring_config.enabled = True
+    query = PredefinedQuery(QueryKind.BINARY, QueryArity.UNARY, "id", "{0} {1}")
+    query.threshold = 75
+    queries.register(query)
+    requirement = create_requirement("REQ-10", "Description A")
+    result = queries.process("id", requirement)
+    assert "true" == result.lower()
+    constraints = llm.constraints[0]
+    assert "score" in constraints["format"]["properties"]
+    assert 16 == constraints["options"]["num_predict"]
+    assert not constraints["think"]
+
+
+def test_process_batch_response_scores_binary_query_with_constrained_generation():
+    llm = LlmMock(query_return='{"score": 60.5}')
+    queries = PredefinedQueries(llm)
+    queries.binary_scoring_config.enabled = True
+    query = PredefinedQuery(QueryKind.BINARY, QueryArity.NARY, "id", "{0} {1}")
+    query.threshold = 50
+    requirements = [
+        create_requirement("REQ-10", "Description A"),
+        create_requirement("REQ-20", "Description B"),
+    ]
+    batch = queries.initialize_batch_response(requirements)
+    result = queries.process_batch_response(query, batch)
+    assert 1 == len(result[0].applied_requirements)
+    assert "Estimate: 60.5%" == result[0].message
+    assert llm.constraints[0] is not None
+
+
+def test_process_scores_binary_query_from_pretty_printed_reply():
+    llm = LlmMock(query_return='{\n  "score": 80\n}')
+    queries = PredefinedQueries(llm)
+    queries.binary_scoring_config.enabled = True
+    query = PredefinedQuery(QueryKind.BINARY, QueryArity.UNARY, "id", "{0} {1}")
+    query.threshold = 75
+    queries.register(query)
+    requirement = create_requirement("REQ-10", "Description A")
+    result = queries.process("id", requirement)
+    assert "true" == result.lower()
+    assert "stop" not in llm.constraints[0]["options"]
+
+
+def test_truncated_score_falls_back_to_number_extraction():
+    queries = PredefinedQueries(LlmMock())
+    assert 42.0 == queries.extract_score('{"score": 42')
+    assert 7.0 == queries.extract_score('{"score": 7}')
+
+
 def test_process_batch_handles_wrong_id():
     llm = LlmMock()
     queries = PredefinedQueries(llm)
@@ -0,0 +1,144 @@
+from typing import List
+from vareq.vallminterface import Llm, LlmConfig
+from vareq.vareplay import ReplayMode
+import asyncio
+import logging
+import os
+import pytest
+import tempfile
+import time
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class ServerMock:
+    prompts: List[str]
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, stream: bool = False, **request):
+        self.prompts.append(request["prompt"])
+        response = {
+            "response": f"Reply to {request['prompt']}",
+            "done": True,
+            "eval_count": 3,
+            "context": [1, 2, 3],
+        }
+        if stream:
+            return iter(
+                [
+                    {"response": "Reply ", "done": False},
+                    {**response, "response": f"to {request['prompt']}"},
+                ]
+            )
+        return response
+
+    def embed(self, **request):
+        return {"embeddings": [[float(len(text)), 1.0] for text in request["input"]]}
+
+
+def create_llm(mode: str, path: str, **replay_options) -> Llm:
+    config = LlmConfig()
+    config.embedding_cache.enabled = False
+    config.replay_config.mode = mode
+    config.replay_config.path = path
+    for key, value in replay_options.items():
+        setattr(config.replay_config, key, value)
+    return Llm(config)
+
+
+def record(path: str) -> ServerMock:
+    llm = create_llm(ReplayMode.RECORD, path)
+    server = ServerMock()
+    llm.endpoints[0].client.client = server
+    llm.query("What are you", task="chat")
+    list(llm.stream_query("Who are you"))
+    llm.embeddings(["a", "bb"])
+    return server
+
+
+def test_recorded_calls_are_replayed():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    server = record(path)
+    llm = create_llm(ReplayMode.REPLAY, path)
+
+    reply = llm.query("What are you", task="chat")
+    streamed = "".join(llm.stream_query("Who are you"))
+    embeddings = llm.embeddings(["bb", "a"])
+
+    assert ["What are you", "Who are you"] == server.prompts
+    assert "Reply to What are you" == reply
+    assert "Reply to Who are you" == streamed
+    assert [[2.0, 1.0], [1.0, 1.0]] == embeddings
+    assert 3 == llm.usage.get("chat").eval_count
+
+
+def test_recording_does_not_store_token_context():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    record(path)
+
+    with open(path, "r") as file:
+        content = file.read()
+
+    assert "context" not in content
+    assert '"prompt"' not in content
+
+
+def test_replay_fails_for_unknown_prompt():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    record(path)
+    llm = create_llm(ReplayMode.REPLAY, path)
+
+    with pytest.raises(LookupError):
+        llm.query("Something else")
+
+
+def test_replay_synthesizes_missing_calls():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    llm = create_llm(
+        ReplayMode.REPLAY, path, synthesize_missing=True, embedding_dimension=16
+    )
+
+    reply = llm.query("Something else")
+    first = llm.embedding("text")
+    second = llm.embedding("text")
+
+    assert "" == reply
+    assert 16 == len(first)
+    assert first == second
+    assert pytest.approx(1.0) == sum(value * value for value in first)
+
+
+def test_replay_adds_synthetic_latency():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    record(path)
+    llm = create_llm(ReplayMode.REPLAY, path, latency=0.05, token_latency=0.05)
+
+    started = time.monotonic()
+    llm.query("What are you")
+    elapsed = time.monotonic() - started
+
+    # 0.05s per call and 3 generated tokens
+    assert 0.2 <= elapsed
+
+
+def test_async_calls_are_replayed():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    record(path)
+    llm = create_llm(ReplayMode.REPLAY, path)
+
+    reply = asyncio.run(llm.aquery("What are you"))
+    embedding = asyncio.run(llm.aembedding("a"))
+
+    assert "Reply to What are you" == reply
+    assert [1.0, 1.0] == embedding
+
+
+def test_replaying_llm_needs_no_server():
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    llm = create_llm(ReplayMode.REPLAY, path)
+    llm.set_url("127.0.0.1:9")
+
+    assert llm.is_available()
+    assert llm.warm_up()
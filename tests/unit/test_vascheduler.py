@@ -0,0 +1,189 @@
+from vareq.vascheduler import SchedulerConfig, LlmScheduler, SingleFlight
+import asyncio
+import logging
+import pytest
+import threading
+import time
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def create_scheduler(
+    max_in_flight: int = 2,
+    queue_size: int = 8,
+    queue_timeout: float = 0,
+    request_timeout: float = 0,
+) -> LlmScheduler:
+    config = SchedulerConfig()
+    config.max_in_flight = max_in_flight
+    config.queue_size = queue_size
+    config.queue_timeout = queue_timeout
+    config.request_timeout = request_timeout
+    return LlmScheduler(config)
+
+
+def test_scheduler_returns_results():
+    scheduler = create_scheduler()
+
+    result = scheduler.run(lambda a, b: a + b, 2, b=3)
+
+    assert 5 == result
+    assert 1 == scheduler.stats.completed
+    assert 0 == scheduler.stats.queue_depth
+    assert 0 == scheduler.stats.in_flight
+
+
+def test_scheduler_limits_requests_in_flight():
+    scheduler = create_scheduler(max_in_flight=2)
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def work():
+        with lock:
+            active[0] = active[0] + 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] = active[0] - 1
+
+    futures = [scheduler.submit(work) for _ in range(6)]
+    for future in futures:
+        scheduler.result(future)
+
+    assert 2 == active[1]
+    assert 2 == scheduler.stats.max_in_flight
+    assert 6 == scheduler.stats.completed
+
+
+def test_scheduler_rejects_requests_when_queue_is_full():
+    scheduler = create_scheduler(max_in_flight=1, queue_size=0, queue_timeout=0.05)
+    release = threading.Event()
+    future = scheduler.submit(release.wait)
+
+    with pytest.raises(TimeoutError):
+        scheduler.submit(release.wait)
+
+    release.set()
+    scheduler.result(future)
+    assert 1 == scheduler.stats.rejected
+
+
+def test_scheduler_times_out_requests():
+    scheduler = create_scheduler(request_timeout=0.05)
+    release = threading.Event()
+
+    with pytest.raises(TimeoutError):
+        scheduler.run(release.wait)
+
+    release.set()
+    assert 1 == scheduler.stats.timed_out
+
+
+def test_scheduler_propagates_errors():
+    scheduler = create_scheduler()
+
+    def fail():
+        raise ValueError("Failed")
+
+    with pytest.raises(ValueError):
+        scheduler.run(fail)
+
+    assert 1 == scheduler.stats.failed
+    assert 0 == scheduler.stats.in_flight
+
+
+def test_scheduler_streams_results():
+    scheduler = create_scheduler()
+
+    def generate(count: int):
+        for i in range(count):
+            assert 1 == scheduler.stats.in_flight
+            yield i
+
+    result = list(scheduler.stream(generate, 3))
+
+    assert [0, 1, 2] == result
+    assert 1 == scheduler.stats.completed
+    assert 0 == scheduler.stats.in_flight
+
+
+def test_scheduler_runs_coroutines():
+    scheduler = create_scheduler()
+
+    async def work(value: int) -> int:
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def run_all():
+        return await asyncio.gather(*[scheduler.arun(work, i) for i in range(4)])
+
+    result = asyncio.run(run_all())
+
+    assert [0, 2, 4, 6] == result
+    assert 4 == scheduler.stats.completed
+    assert 2 >= scheduler.stats.max_in_flight
+
+
+def test_single_flight_shares_result_of_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_call(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        return value * 2
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(single_flight.run("key", slow_call, 21))
+    )
+    leader.start()
+    started.wait()
+    follower = threading.Thread(
+        target=lambda: results.append(single_flight.run("key", slow_call, 21))
+    )
+    follower.start()
+    while single_flight.coalesced == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert [42, 42] == results
+    assert [21] == calls
+    assert 0 == single_flight.in_flight()
+
+
+def test_single_flight_propagates_errors_and_forgets_failed_calls():
+    single_flight = SingleFlight()
+
+    def failing_call():
+        raise ConnectionError("Server down")
+
+    with pytest.raises(ConnectionError):
+        single_flight.run("key", failing_call)
+
+    assert 5 == single_flight.run("key", lambda: 5)
+
+
+def test_single_flight_shares_result_of_concurrent_coroutines():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def slow_call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run_both():
+        return await asyncio.gather(
+            single_flight.arun("key", slow_call), single_flight.arun("key", slow_call)
+        )
+
+    results = asyncio.run(run_both())
+
+    assert ["result", "result"] == results
+    assert 1 == len(calls)
@@ -0,0 +1,141 @@
+from vareq.vallminterface import Chat, ChatConfig, MemoryStrategy
+from vareq.vasessions import SessionConfig, SessionStore
+import json
+import logging
+import os
+import tempfile
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class AugmentedChatMock:
+    llm_chat: Chat
+
+    def __init__(self):
+        self.llm_chat = Chat(None, ChatConfig())
+
+
+def create_store(**options) -> SessionStore:
+    config = SessionConfig()
+    for key, value in options.items():
+        setattr(config, key, value)
+    return SessionStore(config, AugmentedChatMock)
+
+
+def test_session_is_reused():
+    store = create_store()
+
+    first = store.get("alice")
+    second = store.get("alice")
+
+    assert first is second
+    assert first is not store.get("bob")
+    assert 2 == store.size()
+
+
+def test_least_recently_used_session_is_evicted():
+    store = create_store(max_sessions=2)
+    alice = store.get("alice")
+    store.get("bob")
+    store.get("alice")
+
+    store.get("carol")
+
+    assert 2 == store.size()
+    assert 1 == store.evictions
+    assert alice is store.get("alice")
+    assert "bob" not in store.sessions
+
+
+def test_busy_session_is_not_evicted():
+    store = create_store(max_sessions=2, idle_timeout=10)
+    alice = store.get("alice")
+    store.get("bob")
+    alice.last_used = alice.last_used - 60
+
+    with alice.lock:
+        store.get("carol")
+        assert alice is store.get("alice")
+
+    assert "bob" not in store.sessions
+    assert 2 == store.size()
+
+
+def test_idle_session_is_evicted():
+    store = create_store(idle_timeout=10)
+    alice = store.get("alice")
+    alice.last_used = alice.last_used - 60
+
+    store.get("bob")
+
+    assert ["bob"] == list(store.sessions.keys())
+    assert alice is not store.get("alice")
+
+
+def test_evicted_session_is_restored_from_disk():
+    spill_directory = os.path.join(tempfile.mkdtemp(), "sessions")
+    store = create_store(max_sessions=1, spill_directory=spill_directory)
+    alice = store.get("alice")
+    alice.chat.llm_chat.history = "User: Hi\nSystem: Hello"
+    alice.chat.llm_chat.pending_exchanges = [("How are you", "Fine")]
+
+    store.get("bob")
+    assert 1 == len(os.listdir(spill_directory))
+    restored = store.get("alice")
+
+    assert alice is not restored
+    assert restored.chat.llm_chat.history.startswith("User: Hi\nSystem: Hello")
+    assert "How are you" in restored.chat.llm_chat.history
+    assert [] == restored.chat.llm_chat.pending_exchanges
+    # Only the evicted bob remains on disk
+    assert 1 == len(os.listdir(spill_directory))
+
+
+def test_rolling_memory_keeps_restored_exchanges_verbatim():
+    spill_directory = tempfile.mkdtemp()
+    store = create_store(max_sessions=1, spill_directory=spill_directory)
+    alice = store.get("alice")
+    alice.chat.llm_chat.config.memory_strategy = MemoryStrategy.ROLLING
+    alice.chat.llm_chat.pending_exchanges = [("How are you", "Fine")]
+    store.get("bob")
+
+    chat = Chat(None, ChatConfig())
+    chat.config.memory_strategy = MemoryStrategy.ROLLING
+    with open(store.get_spill_path("alice"), "r") as file:
+        chat.set_state(json.load(file))
+
+    assert "" == chat.history
+    assert [("How are you", "Fine")] == chat.pending_exchanges
+
+
+def test_all_sessions_are_spilled():
+    spill_directory = tempfile.mkdtemp()
+    store = create_store(spill_directory=spill_directory)
+    store.get("alice").chat.llm_chat.history = "User: Hi\nSystem: Hello"
+    store.get("bob")
+
+    store.spill_all()
+    restored = create_store(spill_directory=spill_directory).get("alice")
+
+    assert 0 == store.size()
+    assert "User: Hi\nSystem: Hello" == restored.chat.llm_chat.history
+
+
+def test_evicted_session_is_discarded_without_spill_directory():
+    store = create_store(max_sessions=1)
+    store.get("alice").chat.llm_chat.history = "User: Hi\nSystem: Hello"
+
+    store.get("bob")
+
+    assert "" == store.get("alice").chat.llm_chat.history
+
+
+def test_removed_session_is_not_restored():
+    spill_directory = tempfile.mkdtemp()
+    store = create_store(max_sessions=1, spill_directory=spill_directory)
+    store.get("alice").chat.llm_chat.history = "User: Hi\nSystem: Hello"
+    store.get("bob")
+
+    store.remove("alice")
+
+    assert "" == store.get("alice").chat.llm_chat.history
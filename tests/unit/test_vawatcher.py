@@ -0,0 +1,112 @@
+from vareq import vaknowledgelibrary
+from vareq import vallminterface
+from vareq.vawatcher import LibraryWatcher, WatcherConfig
+from typing import List
+import logging
+import os
+import tempfile
+import time
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeLlm(vallminterface.Llm):
+    embeddings_calls: int
+
+    def __init__(self):
+        self.embeddings_calls = 0
+
+    def embeddings(
+        self, texts: List[str], batch_size: int = None, task: str = None
+    ) -> List[List[float]]:
+        self.embeddings_calls = self.embeddings_calls + 1
+        return [[len(text), 2, 3, 4] for text in texts]
+
+
+def create_watched_library(directory: str, debounce: float = 0):
+    llm = FakeLlm()
+    config = vaknowledgelibrary.KnowledgeLibraryConfig()
+    config.persistent_storage_path = os.path.join(tempfile.mkdtemp(), "db")
+    config.ingestion_config.workers = 0
+    library = vaknowledgelibrary.KnowledgeLibrary(llm, config)
+    library.add_directory(directory)
+    watcher_config = WatcherConfig()
+    watcher_config.debounce = debounce
+    return library, LibraryWatcher(library, watcher_config, [directory])
+
+
+def write_file(path: str, content: str, timestamp: float = None):
+    with open(path, "w") as file:
+        file.write(content)
+    if timestamp is not None:
+        os.utime(path, (timestamp, timestamp))
+
+
+def test_watcher_adds_new_and_modified_documents():
+    directory = tempfile.mkdtemp()
+    write_file(os.path.join(directory, "a.txt"), "Cats", 1000)
+    library, watcher = create_watched_library(directory)
+    write_file(os.path.join(directory, "a.txt"), "Dogs", 2000)
+    write_file(os.path.join(directory, "b.txt"), "Birds")
+
+    updated = watcher.poll()
+
+    assert 2 == len(updated)
+    assert [
+        "### Document a part 0\nDogs",
+        "### Document b part 0\nBirds",
+    ] == sorted(library.get_all_documents())
+
+
+def test_watcher_removes_deleted_documents():
+    directory = tempfile.mkdtemp()
+    write_file(os.path.join(directory, "a.txt"), "Cats")
+    write_file(os.path.join(directory, "b.txt"), "Birds")
+    library, watcher = create_watched_library(directory)
+    os.remove(os.path.join(directory, "a.txt"))
+
+    watcher.poll()
+
+    assert ["### Document b part 0\nBirds"] == library.get_all_documents()
+    assert library.manifest.get_document(os.path.join(directory, "a.txt")) is None
+
+
+def test_watcher_debounces_changes():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "a.txt")
+    write_file(path, "Cats", 1000)
+    library, watcher = create_watched_library(directory, debounce=10)
+
+    write_file(path, "Dogs", 2000)
+    assert [] == watcher.poll(now=100)
+    write_file(path, "Birds", 3000)
+    assert [] == watcher.poll(now=105)
+    assert [] == watcher.poll(now=110)
+    assert [path] == watcher.poll(now=115)
+
+    assert ["### Document a part 0\nBirds"] == library.get_all_documents()
+
+
+def test_watcher_ignores_unchanged_files():
+    directory = tempfile.mkdtemp()
+    write_file(os.path.join(directory, "a.txt"), "Cats")
+    library, watcher = create_watched_library(directory)
+    embeddings_calls = library.llm.embeddings_calls
+
+    assert [] == watcher.poll()
+    assert embeddings_calls == library.llm.embeddings_calls
+
+
+def test_watcher_runs_in_background():
+    directory = tempfile.mkdtemp()
+    library, watcher = create_watched_library(directory)
+    watcher.config.interval = 0.01
+    watcher.start()
+
+    write_file(os.path.join(directory, "a.txt"), "Cats")
+    deadline = time.monotonic() + 5
+    while len(library.get_all_documents()) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    watcher.stop()
+
+    assert ["### Document a part 0\nCats"] == library.get_all_documents()
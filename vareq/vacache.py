@@ -0,0 +1,264 @@
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+
+class CacheConfig:
+    enabled: bool
+    path: str
+    max_entries: int
+    max_bytes: int
+    ttl_seconds: float
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        path: str = None,
+        max_entries: int = 0,
+        ttl_seconds: float = 0,
+        max_bytes: int = 0,
+    ):
+        self.enabled = enabled
+        self.path = path
+        self.max_entries = max_entries
+        # Total size of the stored values, bounds the persistent caches only
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def to_dict(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PersistentCache:
+    config: CacheConfig
+    stats: CacheStats
+    _connection: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self.stats = CacheStats()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # The database is opened on the first use only, so that unused caches
+        # do not leave files behind
+        if self._connection is None:
+            logging.debug(f"Opening cache at {self.config.path}")
+            self._connection = sqlite3.connect(
+                self.config.path, check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value BLOB, accessed REAL, created REAL)"
+            )
+            columns = [
+                row[1] for row in self._connection.execute("PRAGMA table_info(entries)")
+            ]
+            if "created" not in columns:
+                # Databases created before expiration support
+                self._connection.execute(
+                    "ALTER TABLE entries ADD COLUMN created REAL DEFAULT 0"
+                )
+            if "size" not in columns:
+                # Databases created before the size bound
+                self._connection.execute(
+                    "ALTER TABLE entries ADD COLUMN size INTEGER DEFAULT 0"
+                )
+                self._connection.execute("UPDATE entries SET size = LENGTH(value)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+            # The total size is summed up from the index, without reading the values
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_size ON entries (size)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        result = {}
+        if len(keys) == 0:
+            return result
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            connection = self._connect()
+            self._expire(connection)
+            # Stay well below the SQLite limit of host parameters
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                result.update(rows)
+            now = time.time()
+            connection.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                [(now, key) for key in result.keys()],
+            )
+            connection.commit()
+            self.stats.hits = self.stats.hits + len(result)
+            self.stats.misses = self.stats.misses + len(unique_keys) - len(result)
+        return result
+
+    def put(self, key: str, value: bytes):
+        self.put_many([(key, value)])
+
+    def put_many(self, items: List[Tuple[str, bytes]]):
+        if len(items) == 0:
+            return
+        with self._lock:
+            connection = self._connect()
+            now = time.time()
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, accessed, created, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, value, now, now, len(value)) for key, value in items],
+            )
+            self._evict(connection)
+            connection.commit()
+
+    def _expire(self, connection: sqlite3.Connection):
+        if self.config.ttl_seconds <= 0:
+            return
+        deadline = time.time() - self.config.ttl_seconds
+        expired = connection.execute(
+            "DELETE FROM entries WHERE created < ?", (deadline,)
+        ).rowcount
+        if expired > 0:
+            logging.debug(f"Expired {expired} cache entries")
+            self.stats.expirations = self.stats.expirations + expired
+
+    def _evict(self, connection: sqlite3.Connection):
+        excess_entries = 0
+        excess_bytes = 0
+        if self.config.max_entries > 0:
+            count = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            excess_entries = count - self.config.max_entries
+        if self.config.max_bytes > 0:
+            total = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+            excess_bytes = total - self.config.max_bytes
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+        keys = []
+        freed = 0
+        for key, size in connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed ASC"
+        ):
+            if len(keys) >= excess_entries and freed >= excess_bytes:
+                break
+            keys.append(key)
+            freed = freed + size
+        logging.debug(
+            f"Evicting {len(keys)} least recently used cache entries of {freed} bytes"
+        )
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            connection.execute(
+                f"DELETE FROM entries WHERE key IN ({placeholders})", chunk
+            )
+        self.stats.evictions = self.stats.evictions + len(keys)
+
+    def size(self) -> int:
+        with self._lock:
+            connection = self._connect()
+            return connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM entries")
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class LruCache:
+    config: CacheConfig
+    stats: CacheStats
+    entries: OrderedDict
+    _lock: threading.Lock
+
+    def __init__(self, config: CacheConfig):
+        # Kept in memory only, so the path is not used
+        self.config = config
+        self.stats = CacheStats()
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.config.ttl_seconds > 0:
+                if time.time() - entry[0] > self.config.ttl_seconds:
+                    del self.entries[key]
+                    self.stats.expirations = self.stats.expirations + 1
+                    entry = None
+            if entry is None:
+                self.stats.misses = self.stats.misses + 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hits = self.stats.hits + 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while 0 < self.config.max_entries < len(self.entries):
+                self.entries.popitem(last=False)
+                self.stats.evictions = self.stats.evictions + 1
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self.entries)
+
+    def clear(self):
+        with self._lock:
+            self.entries = OrderedDict()
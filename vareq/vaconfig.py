@@ -29,7 +29,10 @@ def update_nested_object_attribute_from_json(
         parent = find_parent_for_attribute(obj, path_elements)
 
         if hasattr(parent, key):
-            if isinstance(value, dict):
+            if isinstance(value, dict) and isinstance(getattr(parent, key), dict):
+                # Mappings keyed by arbitrary names are updated entry by entry
+                getattr(parent, key).update(value)
+            elif isinstance(value, dict):
                 update_nested_object_attribute_from_json(
                     getattr(parent, key), value, ""
                 )
@@ -1,6 +1,7 @@
 import logging
 import os.path
-from typing import List, Dict, Tuple
+import threading
+from typing import List, Dict, Tuple, Iterator, Optional
 from .varequirementreader import Requirement
 from .vallminterface import Llm, Chat, LlmConfig, ChatConfig
 from .vaknowledgelibrary import KnowledgeLibrary, KnowledgeLibraryConfig, ItemKind
@@ -8,8 +9,15 @@ from .vaqueries import (
     PredefinedQueries,
     PredefinedQuery,
     BatchResponseElement,
+    BinaryScoringConfig,
     QueryArity,
 )
+from .vawatcher import LibraryWatcher, WatcherConfig
+
+
+# Seconds between the warm-up attempts in the background, doubled after each attempt
+WARM_UP_RETRY_DELAY = 1.0
+MAX_WARM_UP_RETRY_DELAY = 60.0
 
 
 class AugmentedChatConfig:
@@ -17,12 +25,14 @@ class AugmentedChatConfig:
     max_knowledge_items: int
     use_requirements: bool
     use_documents: bool
+    pin_mentioned_requirements: bool
 
     def __init__(self):
         self.max_knowledge_items = 64
         self.max_knowledge_size = 16384
         self.use_requirements = True
         self.use_documents = True
+        self.pin_mentioned_requirements = True
 
 
 class AugmentedChatReply:
@@ -42,31 +52,46 @@ class AugmentedChat:
         self.llm_chat = chat
         self.lib = lib
 
+    def get_knowledge_kinds(self) -> List[ItemKind]:
+        kinds = []
+        if self.config.use_documents:
+            kinds.append(ItemKind.DOCUMENT)
+        if self.config.use_requirements:
+            kinds.append(ItemKind.REQUIREMENT)
+        return kinds
+
     def get_relevant_documents(self, query: str) -> List[Tuple[str, ItemKind, str]]:
-        documents = self.lib.get_relevant_documents(
-            query, self.config.max_knowledge_items
-        )
+        documents = []
+        if self.config.use_requirements and self.config.pin_mentioned_requirements:
+            documents = self.lib.find_mentioned_requirements(query)
+            documents = documents[0 : self.config.max_knowledge_items]
+            if len(documents) > 0:
+                logging.debug(f"Query mentions {len(documents)} known requirements")
+        # The search only fills the remaining budget
+        count = self.config.max_knowledge_items - len(documents)
+        if count > 0:
+            pinned = [name for name, _, _ in documents]
+            found = self.lib.get_relevant_documents(
+                query, count + len(pinned), kinds=self.get_knowledge_kinds()
+            )
+            found = [
+                document
+                for document in found
+                if document[1] != ItemKind.REQUIREMENT or document[0] not in pinned
+            ]
+            documents = documents + found[0:count]
         if len(documents) == 0:
             logging.debug(f"Found no relevant documents")
             return []
         logging.debug(f"Found {len(documents)} relevant documents")
         total_size = 0
         total_count = 0
-        for _, item_kind, document in documents:
-            if item_kind == ItemKind.DOCUMENT and not self.config.use_documents:
-                continue
-            if item_kind == ItemKind.REQUIREMENT and not self.config.use_requirements:
-                continue
-            size = len(document)
-            total_size = total_size + size
+        for _, _, document in documents:
+            total_size = total_size + len(document)
             total_count = total_count + 1
-            if (
-                total_size >= self.config.max_knowledge_size
-                or total_count >= self.config.max_knowledge_items
-            ):
+            if total_size >= self.config.max_knowledge_size:
                 break
-        count = max(total_count, 1)  # return at least one document
-        return documents[0:count]
+        return documents[0:total_count]
 
     def extract_reference_name(self, reference: str) -> str:
         if reference is None:
@@ -76,8 +101,7 @@ class AugmentedChat:
             return ""
         return lines[0].strip()
 
-    def chat(self, query: str) -> AugmentedChatReply:
-        reply = AugmentedChatReply()
+    def prepare_reply(self, reply: AugmentedChatReply, query: str) -> str:
         reply.query = query
         documents = self.get_relevant_documents(query)
         documents_count = len(documents)
@@ -89,10 +113,28 @@ class AugmentedChat:
             if documents_count > 0
             else ""
         )
+        return context
+
+    def chat(self, query: str) -> AugmentedChatReply:
+        reply = AugmentedChatReply()
+        context = self.prepare_reply(reply, query)
         answer = self.llm_chat.chat(context, query)
         reply.answer = answer
         return reply
 
+    def chat_stream(
+        self, query: str, reply: AugmentedChatReply = None
+    ) -> Iterator[str]:
+        # References are available in the provided reply once the first text arrives,
+        # and the full answer once the iteration is finished
+        reply = reply if reply is not None else AugmentedChatReply()
+        context = self.prepare_reply(reply, query)
+        parts = []
+        for text in self.llm_chat.chat_stream(context, query):
+            parts.append(text)
+            yield text
+        reply.answer = "".join(parts)
+
 
 class EngineConfig:
     llm_config: LlmConfig
@@ -100,9 +142,12 @@ class EngineConfig:
     augmented_chat_config: AugmentedChatConfig
     lib_config: KnowledgeLibraryConfig
     batch_query_context_size: int
+    binary_scoring_config: BinaryScoringConfig
     requirements_file_path: str
     document_directories: List[str]
     predefined_queries: List[PredefinedQuery]
+    warm_up: bool
+    watcher_config: WatcherConfig
 
     def __init__(self):
         self.predefined_queries = []
@@ -113,6 +158,9 @@ class EngineConfig:
         self.chat_config = ChatConfig()
         self.augmented_chat_config = AugmentedChatConfig()
         self.batch_query_context_size = 3
+        self.binary_scoring_config = BinaryScoringConfig()
+        self.warm_up = True
+        self.watcher_config = WatcherConfig()
 
 
 class Engine:
@@ -121,14 +169,24 @@ class Engine:
     lib: KnowledgeLibrary
     config: EngineConfig
     queries: PredefinedQueries
+    ready: bool
+    watcher: Optional[LibraryWatcher]
+    _stop: threading.Event
 
-    def __init__(self, config: EngineConfig):
+    def __init__(self, config: EngineConfig, warm_up_in_background: bool = False):
         self.config = config
+        self.ready = False
+        self._stop = threading.Event()
         self.llm = Llm(config.llm_config)
         self.chat = Chat(self.llm, config.chat_config)
         self.lib = KnowledgeLibrary(self.llm, self.config.lib_config)
         self.queries = PredefinedQueries(self.llm)
         self.queries.batch_query_context_size = config.batch_query_context_size
+        # Enough concurrent pairs to use every execution slot of the scheduler
+        self.queries.batch_query_workers = (
+            config.llm_config.scheduler_config.max_in_flight
+        )
+        self.queries.binary_scoring_config = config.binary_scoring_config
         for query in self.config.predefined_queries:
             self.queries.register(query)
         for directory in self.config.document_directories:
@@ -137,18 +195,70 @@ class Engine:
             self.config.requirements_file_path
         ):
             self.lib.set_requirements_document(self.config.requirements_file_path)
+        self.watcher = None
+        if self.config.watcher_config.enabled:
+            # Keeps the library in sync without reinitializing the engine
+            self.watcher = LibraryWatcher(
+                self.lib,
+                self.config.watcher_config,
+                self.config.document_directories,
+                self.config.requirements_file_path,
+            )
+            self.watcher.start()
+        if not self.config.warm_up:
+            self.ready = True
+        elif warm_up_in_background:
+            threading.Thread(target=self.warm_up_until_ready, daemon=True).start()
+        else:
+            self.warm_up()
+
+    def warm_up(self) -> bool:
+        logging.info("Warming up the models")
+        if not self.llm.is_available():
+            logging.warning("Ollama not available, skipping warm-up")
+            self.ready = False
+            return False
+        self.ready = self.llm.warm_up()
+        logging.info(f"Warm-up finished, ready: {self.ready}")
+        return self.ready
+
+    def warm_up_until_ready(self):
+        # Ollama may be started after the server
+        delay = WARM_UP_RETRY_DELAY
+        while not self.warm_up():
+            logging.info(f"Retrying the warm-up in {delay:g}s")
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, MAX_WARM_UP_RETRY_DELAY)
+
+    def is_ready(self) -> bool:
+        return self.ready
+
+    def stop(self):
+        self._stop.set()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.llm.close()
 
     def get_chat(self) -> AugmentedChat:
         chat = AugmentedChat(self.chat, self.lib, self.config.augmented_chat_config)
         return chat
 
-    def process_query(self, id: str, requirement: Requirement) -> str:
-        return self.queries.process(id, requirement)
+    def create_chat(self) -> AugmentedChat:
+        # Unlike get_chat, the returned chat has its own history
+        chat = Chat(self.llm, self.config.chat_config)
+        return AugmentedChat(chat, self.lib, self.config.augmented_chat_config)
+
+    def process_query(
+        self, id: str, requirement: Requirement, use_cache: bool = True
+    ) -> str:
+        return self.queries.process(id, requirement, use_cache)
 
     def process_batch_query(
-        self, id: str, requirements: List[Requirement]
+        self, id: str, requirements: List[Requirement], use_cache: bool = True
     ) -> List[BatchResponseElement]:
-        return self.queries.process_batch(id, requirements)
+        return self.queries.process_batch(id, requirements, use_cache)
 
     def get_query_arity(self, id: str) -> QueryArity:
         return self.queries.arity(id)
@@ -158,3 +268,40 @@ class Engine:
 
     def get_config(self) -> EngineConfig:
         return self.config
+
+    def get_usage_stats(self) -> Dict:
+        caches = {
+            "embedding_cache": self.llm.embedding_cache,
+            "response_cache": self.llm.response_cache,
+        }
+        return {
+            "llm": self.llm.usage.to_dict(),
+            "scheduler": self.llm.scheduler.stats.to_dict(),
+            "coalesced": {
+                "responses": self.llm.pending_responses.coalesced,
+                "embeddings": self.llm.pending_embeddings.coalesced,
+            },
+            "caches": {
+                **{
+                    name: cache.stats.to_dict()
+                    for name, cache in caches.items()
+                    if cache is not None
+                },
+                **self.lib.get_cache_stats(),
+            },
+        }
+
+    def log_usage_stats(self):
+        for line in self.llm.usage.summary():
+            logging.info(f"LLM usage by {line}")
+        scheduler = self.llm.scheduler.stats
+        logging.info(
+            f"LLM scheduler: {scheduler.completed} completed, {scheduler.failed} failed, "
+            f"average wait {scheduler.average_wait_time():.2f}s, "
+            f"average run {scheduler.average_run_time():.2f}s"
+        )
+        for name, stats in self.lib.get_cache_stats().items():
+            logging.info(
+                f"Knowledge library {name}: {stats['hits']} hits, {stats['misses']} misses, "
+                f"hit rate {stats['hit_rate']:.2f}"
+            )
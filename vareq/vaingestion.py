@@ -0,0 +1,283 @@
+from typing import Callable, Deque, Iterator, List, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os.path
+import pathlib
+import queue
+import threading
+import docx
+import pdfplumber
+import langchain_text_splitters
+from .vamanifest import ManifestEntry, hash_file
+
+
+class IngestionConfig:
+    workers: int
+    min_worker_documents: int
+    queue_size: int
+    batch_size: int
+
+    def __init__(self):
+        # Processes parsing the documents, 0 parses them in the calling thread
+        self.workers = 4
+        # Fewer documents are parsed in the calling thread, as starting the workers
+        # would take longer, e.g. for the few files changed in a watched directory
+        self.min_worker_documents = 8
+        # Maximum number of parsed documents and chunk batches waiting for the next stage
+        self.queue_size = 16
+        # Number of chunks embedded and stored at once
+        self.batch_size = 64
+
+
+class DocumentChunk:
+    path: str
+    name: str
+    timestamp: float
+    index: int
+    # Number of chunks of the whole document
+    count: int
+    text: str
+
+    def __init__(
+        self, path: str, name: str, timestamp: float, index: int, count: int, text: str
+    ):
+        self.path = path
+        self.name = name
+        self.timestamp = timestamp
+        self.index = index
+        self.count = count
+        self.text = text
+
+    def is_last(self) -> bool:
+        return self.index == self.count - 1
+
+
+class ParsedDocument:
+    path: str
+    name: str
+    timestamp: float
+    chunks: List[str]
+    size: int
+    hash: str
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        timestamp: float,
+        chunks: List[str],
+        size: int = None,
+        hash: str = None,
+    ):
+        self.path = path
+        self.name = name
+        self.timestamp = timestamp
+        self.chunks = chunks
+        self.size = size
+        self.hash = hash
+
+    def get_entry(self) -> ManifestEntry:
+        return ManifestEntry(
+            self.path, self.timestamp, self.size, self.hash, len(self.chunks)
+        )
+
+    def get_chunks(self) -> List[DocumentChunk]:
+        return [
+            DocumentChunk(
+                self.path, self.name, self.timestamp, index, len(self.chunks), text
+            )
+            for index, text in enumerate(self.chunks)
+        ]
+
+
+def read_docx(file_path: str) -> str:
+    lines = []
+    document = docx.Document(file_path)
+    for paragraph in document.paragraphs:
+        paragrapth_text = paragraph.text
+        lines.append(paragrapth_text)
+        logging.debug(f"Retrieved paragraph: {paragrapth_text}")
+    return "\n".join(lines)
+
+
+def read_txt(file_path: str) -> str:
+    with open(file_path, mode="rt", encoding="utf-8") as file:
+        content = file.read()
+        logging.debug(f"Retrieved content: {content}")
+        return content
+
+
+def read_pdf(file_path: str) -> str:
+    lines = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text_simple()
+            lines.append(page_text)
+            logging.debug(f"Retrieved page: {page_text}")
+    return "\n".join(lines)
+
+
+def read_document(file_path: str) -> str:
+    extension = pathlib.Path(file_path).suffix.lower()
+    if extension == ".docx":
+        return read_docx(file_path)
+    elif extension == ".pdf":
+        return read_pdf(file_path)
+    else:
+        return read_txt(file_path)
+
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    splitter = langchain_text_splitters.RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    chunks = splitter.split_text(text)
+    logging.debug(f"Text split into {len(chunks)} chunks")
+    for chunk in chunks:
+        logging.debug(f"Chunk: {chunk}")
+    return chunks
+
+
+def parse_document(path: str, chunk_size: int, chunk_overlap: int) -> ParsedDocument:
+    # Executed in the worker processes, so it must not depend on the library
+    stat = os.stat(path)
+    file_hash = hash_file(path)
+    name = pathlib.Path(path).stem
+    text = read_document(path)
+    chunks = split_text(text, chunk_size, chunk_overlap)
+    return ParsedDocument(path, name, stat.st_mtime, chunks, stat.st_size, file_hash)
+
+
+class DocumentIngestor:
+    config: IngestionConfig
+    chunk_size: int
+    chunk_overlap: int
+    store: Callable[[List[DocumentChunk]], None]
+    documents: int
+    chunks: int
+    failures: int
+    empty_paths: List[str]
+    failed_paths: Set[str]
+    entries: List[ManifestEntry]
+
+    def __init__(
+        self,
+        config: IngestionConfig,
+        chunk_size: int,
+        chunk_overlap: int,
+        store: Callable[[List[DocumentChunk]], None],
+    ):
+        self.config = config
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.store = store
+        self.documents = 0
+        self.chunks = 0
+        self.failures = 0
+        self.empty_paths = []
+        self.failed_paths = set()
+        self.entries = []
+
+    def ingest(self, paths: List[str]) -> int:
+        # Parsing, embedding and storing overlap: the documents are parsed in worker processes,
+        # while the chunks of the already parsed ones are embedded and stored by a writer thread
+        batches = queue.Queue(maxsize=max(self.config.queue_size, 1))
+        writer = threading.Thread(target=self.write_batches, args=(batches,))
+        writer.start()
+        documents = 0
+        try:
+            batch = []
+            for document in self.parse_documents(paths):
+                logging.info(
+                    f'Ingesting document "{document.name}" from path "{document.path}" of timestamp {document.timestamp}'
+                )
+                documents = documents + 1
+                self.entries.append(document.get_entry())
+                if len(document.chunks) == 0:
+                    self.empty_paths.append(document.path)
+                for chunk in document.get_chunks():
+                    batch.append(chunk)
+                    if len(batch) >= max(self.config.batch_size, 1):
+                        batches.put(batch)
+                        batch = []
+            if len(batch) > 0:
+                batches.put(batch)
+        finally:
+            batches.put(None)
+            writer.join()
+        self.documents = self.documents + documents
+        return documents
+
+    def parse_documents(self, paths: List[str]) -> Iterator[ParsedDocument]:
+        parsed = 0
+        if self.config.workers > 0 and len(paths) >= max(
+            self.config.min_worker_documents, 2
+        ):
+            try:
+                for document in self.parse_in_workers(paths):
+                    parsed = parsed + 1
+                    if document is not None:
+                        yield document
+            except (BrokenProcessPool, OSError) as e:
+                # E.g. the main module of the application cannot be imported by the spawned workers
+                logging.warning(
+                    f"Parsing documents in worker processes failed ({str(e)}), parsing them in the calling thread"
+                )
+        for path in paths[parsed:]:
+            document = self.parse(path)
+            if document is not None:
+                yield document
+
+    def parse_in_workers(self, paths: List[str]) -> Iterator[Optional[ParsedDocument]]:
+        # Forked workers would inherit the locks and threads of the library and the server
+        with ProcessPoolExecutor(
+            max_workers=self.config.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            # Limit the parsed documents held in memory, results are consumed in order
+            pending: Deque[Tuple[str, Future]] = deque()
+            for path in paths:
+                future = pool.submit(
+                    parse_document, path, self.chunk_size, self.chunk_overlap
+                )
+                pending.append((path, future))
+                if len(pending) >= max(self.config.queue_size, 1):
+                    yield self.collect(*pending.popleft())
+            while len(pending) > 0:
+                yield self.collect(*pending.popleft())
+
+    def parse(self, path: str) -> Optional[ParsedDocument]:
+        try:
+            return parse_document(path, self.chunk_size, self.chunk_overlap)
+        except Exception as e:
+            self.failures = self.failures + 1
+            logging.error(f'Reading document "{path}" failed: {str(e)}')
+            return None
+
+    def collect(self, path: str, future: Future) -> Optional[ParsedDocument]:
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # Not a failure of the document, the remaining ones are parsed otherwise
+            raise
+        except Exception as e:
+            self.failures = self.failures + 1
+            logging.error(f'Reading document "{path}" failed: {str(e)}')
+            return None
+
+    def write_batches(self, batches: queue.Queue):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            try:
+                self.store(batch)
+                self.chunks = self.chunks + len(batch)
+            except Exception as e:
+                # The producer must not be blocked by a failed writer
+                self.failures = self.failures + 1
+                self.failed_paths.update(chunk.path for chunk in batch)
+                logging.error(f"Storing {len(batch)} chunks failed: {str(e)}")
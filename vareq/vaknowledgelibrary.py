@@ -1,13 +1,26 @@
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from enum import Enum
 import logging
 import os.path
-import docx
 import pathlib
-import pdfplumber
+import re
+import threading
 import chromadb
-import langchain_text_splitters
+from .vaingestion import (
+    DocumentChunk,
+    DocumentIngestor,
+    IngestionConfig,
+    ParsedDocument,
+    read_docx,
+    read_document,
+    read_pdf,
+    read_txt,
+    split_text,
+)
+from .vacache import CacheConfig, LruCache, hash_text
+from .valexical import HybridRetrievalConfig, LexicalIndex, fuse_rankings
 from .vallminterface import Llm
+from .vamanifest import IndexManifest, ManifestEntry, create_entry
 from .varequirementreader import Requirement, RequirementReader, Mappings
 
 
@@ -21,12 +34,93 @@ class KnowledgeLibraryConfig:
     chunk_overlap: int
     persistent_storage_path: str
     requirement_document_mappings: Mappings
+    ingestion_config: IngestionConfig
+    hybrid_retrieval_config: HybridRetrievalConfig
+    query_embedding_cache: CacheConfig
+    retrieval_cache: CacheConfig
 
     def __init__(self):
         self.chunk_size = 8000
         self.chunk_overlap = 2000
         self.persistent_storage_path = "knowledge_library.db"
         self.requirement_document_mappings = Mappings()
+        self.ingestion_config = IngestionConfig()
+        self.hybrid_retrieval_config = HybridRetrievalConfig()
+        # In-memory caches of the chat context retrieval
+        self.query_embedding_cache = CacheConfig(enabled=True, max_entries=1024)
+        self.retrieval_cache = CacheConfig(enabled=True, max_entries=256)
+
+
+class RequirementsSync:
+    added: int
+    changed: int
+    removed: int
+    unchanged: int
+
+    def __init__(self):
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.unchanged = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "unchanged": self.unchanged,
+        }
+
+
+class RequirementIdIndex:
+    documents: Dict[str, Tuple[str, str]]
+    pattern: Optional[re.Pattern]
+    _lock: threading.Lock
+
+    def __init__(self):
+        # Keyed by the lowercase ID, as mentions do not need to match the case
+        self.documents = dict()
+        self.pattern = None
+        self._lock = threading.Lock()
+
+    def add(self, ids: List[str], documents: List[str]):
+        with self._lock:
+            for id, document in zip(ids, documents):
+                self.documents[id.lower()] = (id, document)
+            self.pattern = None
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for id in ids:
+                self.documents.pop(id.lower(), None)
+            self.pattern = None
+
+    def clear(self):
+        with self._lock:
+            self.documents = dict()
+            self.pattern = None
+
+    def get_pattern(self) -> Optional[re.Pattern]:
+        if self.pattern is None and len(self.documents) > 0:
+            # The longest IDs first, so that e.g. REQ-10 is not matched as REQ-1
+            ids = sorted(self.documents.keys(), key=len, reverse=True)
+            alternatives = "|".join(re.escape(id) for id in ids)
+            self.pattern = re.compile(
+                rf"(?<![\w-])(?:{alternatives})(?![\w-])", re.IGNORECASE
+            )
+        return self.pattern
+
+    def find(self, text: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            pattern = self.get_pattern()
+            if pattern is None:
+                return []
+            found = dict()
+            for match in pattern.finditer(text):
+                id = match.group(0).lower()
+                if id not in found:
+                    found[id] = self.documents[id]
+            return list(found.values())
 
 
 class KnowledgeLibrary:
@@ -34,6 +128,14 @@ class KnowledgeLibrary:
     documents: chromadb.Collection
     llm: Llm
     config: KnowledgeLibraryConfig
+    manifest: IndexManifest
+    lexical_index: Optional[LexicalIndex]
+    requirement_index: Optional[RequirementIdIndex]
+    query_embedding_cache: Optional[LruCache]
+    retrieval_cache: Optional[LruCache]
+    version: int
+    _lexical_lock: threading.Lock
+    _version_lock: threading.Lock
 
     def __init__(self, llm: Llm, config: KnowledgeLibraryConfig):
         self.llm = llm
@@ -45,148 +147,336 @@ class KnowledgeLibrary:
         self.documents = self.persistent_db.get_or_create_collection(
             name="documents", metadata={"hnsw:space": "cosine"}
         )
+        # Freshness of the indexed files is decided without querying the collection
+        self.manifest = IndexManifest(
+            os.path.join(config.persistent_storage_path, "manifest.json")
+        )
+        if self.manifest.exists():
+            self.manifest.load()
+        else:
+            self.rebuild_manifest()
+        # Built on the first hybrid search, and then kept in sync with the collection
+        self.lexical_index = None
+        self.requirement_index = None
+        self._lexical_lock = threading.Lock()
+        # Bumped on every change of the stored items, which invalidates the cached results
+        self.version = 0
+        self._version_lock = threading.Lock()
+        self.query_embedding_cache = (
+            LruCache(config.query_embedding_cache)
+            if config.query_embedding_cache.enabled
+            else None
+        )
+        self.retrieval_cache = (
+            LruCache(config.retrieval_cache) if config.retrieval_cache.enabled else None
+        )
+
+    def bump_version(self):
+        with self._version_lock:
+            self.version = self.version + 1
+
+    def rebuild_manifest(self):
+        # Stores indexed before the manifest was introduced
+        if self.documents.count() == 0:
+            self.manifest.save()
+            return
+        logging.info("Rebuilding index manifest from the stored metadata")
+        results = self.documents.get(include=["metadatas"])
+        requirements = None
+        for metadata in results["metadatas"]:
+            if metadata.get("type") == ItemKind.REQUIREMENT.value:
+                if requirements is None:
+                    requirements = ManifestEntry(None, metadata["timestamp"])
+                requirements.mtime = min(requirements.mtime, metadata["timestamp"])
+                requirements.count = requirements.count + 1
+                continue
+            entry = self.manifest.get_document(metadata["path"])
+            if entry is None:
+                entry = ManifestEntry(metadata["path"], metadata["timestamp"])
+                self.manifest.set_document(entry)
+            entry.mtime = min(entry.mtime, metadata["timestamp"])
+            entry.count = entry.count + 1
+        self.manifest.set_requirements(requirements)
+        self.manifest.save()
 
     def read_docx(self, file_path: str) -> str:
-        lines = []
-        document = docx.Document(file_path)
-        for paragraph in document.paragraphs:
-            paragrapth_text = paragraph.text
-            lines.append(paragrapth_text)
-            logging.debug(f"Retrieved paragraph: {paragrapth_text}")
-        return "\n".join(lines)
+        return read_docx(file_path)
 
     def read_txt(self, file_path: str) -> str:
-        with open(file_path, mode="rt", encoding="utf-8") as file:
-            content = file.read()
-            logging.debug(f"Retrieved content: {content}")
-            return content
+        return read_txt(file_path)
 
     def read_pdf(self, file_path: str) -> str:
-        lines = []
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text_simple()
-                lines.append(page_text)
-                logging.debug(f"Retrieved page: {page_text}")
-        return "\n".join(lines)
+        return read_pdf(file_path)
 
     def read_document(self, file_path: str) -> str:
-        extension = pathlib.Path(file_path).suffix.lower()
-        if extension == ".docx":
-            return self.read_docx(file_path)
-        elif extension == ".pdf":
-            return self.read_pdf(file_path)
-        else:
-            return self.read_txt(file_path)
+        return read_document(file_path)
 
     def split_text(self, text: str) -> List[str]:
-        splitter = langchain_text_splitters.RecursiveCharacterTextSplitter(
-            chunk_size=self.config.chunk_size, chunk_overlap=self.config.chunk_overlap
-        )
-        chunks = splitter.split_text(text)
-        logging.debug(f"Text split into {len(chunks)} chunks")
-        for chunk in chunks:
-            logging.debug(f"Chunk: {chunk}")
-        return chunks
+        return split_text(text, self.config.chunk_size, self.config.chunk_overlap)
 
     def register_document(self, name: str, path: str, timestamp: float, text: str):
         logging.info(
             f'Registering document "{name}" from path "{path}" of timestamp {timestamp}'
         )
         chunks = self.split_text(text)
-        for index, chunk in enumerate(chunks):
-            embedding = self.llm.embedding(chunk)
-            self.documents.add(
-                ids=[f"{path}:{index}"],
-                metadatas=[
-                    {
-                        "path": path,
-                        "name": name,
-                        "index": index,
-                        "timestamp": timestamp,
-                        "type": ItemKind.DOCUMENT.value,
-                    }
-                ],
-                documents=[f"### Document {name} part {index}\n" + chunk],
-                embeddings=embedding,
+        self.add_chunks(ParsedDocument(path, name, timestamp, chunks).get_chunks())
+        if len(chunks) == 0:
+            self.delete_stale_chunks(path, 0)
+
+    def get_chunk_metadata(self, chunk: DocumentChunk) -> Dict:
+        return {
+            "path": chunk.path,
+            "name": chunk.name,
+            "index": chunk.index,
+            "timestamp": chunk.timestamp,
+            "type": ItemKind.DOCUMENT.value,
+            "hash": hash_text(chunk.text),
+        }
+
+    def get_chunk_document(self, chunk: DocumentChunk) -> str:
+        return f"### Document {chunk.name} part {chunk.index}\n" + chunk.text
+
+    def add_chunks(self, chunks: List[DocumentChunk]):
+        if len(chunks) == 0:
+            return
+        # Only chunks of changed content are embedded, the unchanged ones are reused
+        # even if they moved within the document
+        paths = list(set(chunk.path for chunk in chunks))
+        stored = self.documents.get(
+            where={"path": {"$in": paths}}, include=["metadatas"]
+        )
+        stored_hashes = {
+            id: metadata.get("hash")
+            for id, metadata in zip(stored["ids"], stored["metadatas"])
+        }
+        hash_ids = {
+            (id.rsplit(":", 1)[0], hash): id for id, hash in stored_hashes.items()
+        }
+        unchanged = []
+        moved = []
+        changed = []
+        for chunk in chunks:
+            id = f"{chunk.path}:{chunk.index}"
+            hash = hash_text(chunk.text)
+            if stored_hashes.get(id) == hash:
+                unchanged.append(chunk)
+            elif (chunk.path, hash) in hash_ids:
+                moved.append((chunk, hash_ids[(chunk.path, hash)]))
+            else:
+                changed.append(chunk)
+        logging.debug(
+            f"Storing {len(chunks)} chunks: {len(unchanged)} unchanged, {len(moved)} moved, {len(changed)} changed"
+        )
+        if len(unchanged) > 0:
+            # Refresh the timestamps
+            self.documents.update(
+                ids=[f"{chunk.path}:{chunk.index}" for chunk in unchanged],
+                metadatas=[self.get_chunk_metadata(chunk) for chunk in unchanged],
+            )
+        embeddings = []
+        if len(moved) > 0:
+            moved_ids = list(set(id for _, id in moved))
+            results = self.documents.get(ids=moved_ids, include=["embeddings"])
+            moved_embeddings = dict(zip(results["ids"], results["embeddings"]))
+            embeddings.extend(list(moved_embeddings[id]) for _, id in moved)
+        if len(changed) > 0:
+            embeddings.extend(
+                self.llm.embeddings([chunk.text for chunk in changed], task="ingestion")
+            )
+        upserted = [chunk for chunk, _ in moved] + changed
+        if len(upserted) > 0:
+            ids = [f"{chunk.path}:{chunk.index}" for chunk in upserted]
+            metadatas = [self.get_chunk_metadata(chunk) for chunk in upserted]
+            documents = [self.get_chunk_document(chunk) for chunk in upserted]
+            self.documents.upsert(
+                ids=ids,
+                metadatas=metadatas,
+                documents=documents,
+                embeddings=embeddings,
             )
+            self.index_lexically(ids, metadatas, documents)
+            self.bump_version()
+        for chunk in chunks:
+            if chunk.is_last():
+                self.delete_stale_chunks(chunk.path, chunk.count)
+
+    def delete_stale_chunks(self, path: str, count: int):
+        # Chunks beyond the end of a shrunk document
+        self.documents.delete(
+            where={"$and": [{"path": path}, {"index": {"$gte": count}}]}
+        )
+        self.unindex_lexically_where(
+            lambda metadata: metadata["path"] == path and metadata["index"] >= count
+        )
+        self.bump_version()
 
     def is_document_up_to_date(self, path: str) -> bool:
-        registered_timestamp = self.get_document_timestamp(path)
-        if registered_timestamp < 0:
-            # Document is not registered, so not up to date
-            return False
-        actual_timestamp = os.path.getmtime(path)
-        if actual_timestamp > registered_timestamp:
-            logging.info(
-                f'Document "{path}" timestamp changed from {registered_timestamp} to {actual_timestamp}'
-            )
-            return False
-        # Document is registered, and the timestamp is not in the past
-        return True
+        return self.manifest.is_up_to_date(self.manifest.get_document(path), path)
 
     def add_document(self, path: str, override: bool = False) -> bool:
         if not override:
             if self.is_document_up_to_date(path):
                 logging.info(f"Document {path} not added, as up-to-date")
+                self.manifest.save_if_dirty()
                 return False
-        timestamp = os.path.getmtime(path)
-        name = pathlib.Path(path).stem
-        text = self.read_document(path)
-        self.register_document(name, path, timestamp, text)
-        return True
+        return self.add_documents([path]) > 0
 
     def is_requirements_document_up_to_date(self, path: str) -> bool:
-        registered_timestamp = self.get_requirements_timestamp()
-        if registered_timestamp < 0:
-            # Document is not registered, so not up to date
-            return False
-        actual_timestamp = os.path.getmtime(path)
-        if actual_timestamp > registered_timestamp:
-            logging.info(
-                f'Document "{path}" timestamp changed from {registered_timestamp} to {actual_timestamp}'
-            )
+        entry = self.manifest.requirements
+        if entry is not None and entry.path not in [None, path]:
+            logging.info(f"Requirements source changed from {entry.path} to {path}")
             return False
-        # Document is registered, and the timestamp is not in the past
-        return True
+        return self.manifest.is_up_to_date(entry, path)
 
     def set_requirements_document(self, path: str, override: bool = False) -> bool:
         if not override:
             if self.is_requirements_document_up_to_date(path):
                 logging.info(f"Requirements {path} not added, as up-to-date")
+                self.manifest.save_if_dirty()
                 return False
-        # Only one source of requirements is supported
-        self.delete_all_requirements()
-        timestamp = os.path.getmtime(path)
+        # Stamped before reading, so that a concurrent modification is not missed
+        entry = create_entry(path)
         reader = RequirementReader(self.config.requirement_document_mappings)
         requirements = reader.read_requirements(path)
-        self.add_requirements(requirements, timestamp)
+        sync = self.sync_requirements(requirements, entry.mtime)
+        entry.count = len(requirements)
+        self.manifest.set_requirements(entry)
+        self.manifest.save()
+        logging.info(
+            f"Requirements {path} synchronized: {sync.added} added, {sync.changed} changed, "
+            f"{sync.removed} removed, {sync.unchanged} unchanged"
+        )
         return True
 
-    def add_directory(self, path: str, override: bool = False) -> int:
+    def sync_requirements(
+        self, requirements: List[Requirement], timestamp: float = -1
+    ) -> RequirementsSync:
+        # Only one source of requirements is supported, so the stored ones which are not
+        # provided anymore are deleted, and only the new or modified ones are embedded
+        sync = RequirementsSync()
+        requirements = {requirement.id: requirement for requirement in requirements}
+        stored = self.documents.get(
+            where={"type": ItemKind.REQUIREMENT.value}, include=["metadatas"]
+        )
+        stored_hashes = {
+            id: metadata.get("hash")
+            for id, metadata in zip(stored["ids"], stored["metadatas"])
+        }
+        unchanged = []
+        updated = []
+        for requirement in requirements.values():
+            id = f"REQ:{requirement.id}"
+            if id not in stored_hashes:
+                sync.added = sync.added + 1
+                updated.append(requirement)
+            elif stored_hashes[id] != self.get_requirement_hash(requirement):
+                sync.changed = sync.changed + 1
+                updated.append(requirement)
+            else:
+                sync.unchanged = sync.unchanged + 1
+                unchanged.append(requirement)
+        removed = [id for id in stored_hashes if id[len("REQ:") :] not in requirements]
+        sync.removed = len(removed)
+        if len(removed) > 0:
+            logging.debug(f"Deleting requirements {removed}")
+            self.documents.delete(ids=removed)
+            self.unindex_lexically(removed)
+            self.bump_version()
+            with self._lexical_lock:
+                if self.requirement_index is not None:
+                    self.requirement_index.remove([id[len("REQ:") :] for id in removed])
+        if len(unchanged) > 0:
+            # Refresh the timestamps
+            self.documents.update(
+                ids=[f"REQ:{requirement.id}" for requirement in unchanged],
+                metadatas=[
+                    self.get_requirement_metadata(requirement, timestamp)
+                    for requirement in unchanged
+                ],
+            )
+        self.store_requirements(updated, timestamp, upsert=True)
+        return sync
+
+    def list_documents(self, path: str) -> List[str]:
         root = pathlib.Path(path)
         extensions = [".txt", ".docx", ".pdf"]
-        for file in root.rglob("*"):
+        paths = []
+        for file in sorted(root.rglob("*")):
             path = pathlib.Path(file)
             extension = path.suffix.lower()
             file_path = str(path)
             logging.debug(
-                f'Adding directory "{path}": found file "{file_path}" with extension "{extension}"'
+                f'Listing directory "{root}": found file "{file_path}" with extension "{extension}"'
             )
             if extension in extensions:
-                logging.info(f'Adding file "{file_path}" from directory "{path}"')
-                self.add_document(file_path, override)
+                paths.append(file_path)
+        return paths
+
+    def add_directory(self, path: str, override: bool = False) -> int:
+        paths = []
+        for file_path in self.list_documents(path):
+            if not override and self.is_document_up_to_date(file_path):
+                logging.info(f"Document {file_path} not added, as up-to-date")
+                continue
+            logging.info(f'Adding file "{file_path}" from directory "{path}"')
+            paths.append(file_path)
+        return self.add_documents(paths)
+
+    def remove_document(self, path: str):
+        logging.info(f'Removing document "{path}"')
+        self.documents.delete(where={"path": path})
+        self.unindex_lexically_where(lambda metadata: metadata["path"] == path)
+        self.bump_version()
+        self.manifest.remove_document(path)
+        self.manifest.save()
+
+    def add_documents(self, paths: List[str]) -> int:
+        if len(paths) == 0:
+            # Touched, but unchanged documents may have been checked
+            self.manifest.save_if_dirty()
+            return 0
+        ingestor = DocumentIngestor(
+            self.config.ingestion_config,
+            self.config.chunk_size,
+            self.config.chunk_overlap,
+            self.add_chunks,
+        )
+        added = ingestor.ingest(paths)
+        for path in ingestor.empty_paths:
+            self.delete_stale_chunks(path, 0)
+        for entry in ingestor.entries:
+            if entry.path not in ingestor.failed_paths:
+                self.manifest.set_document(entry)
+        self.manifest.save()
+        logging.info(
+            f"Ingested {added} documents in {ingestor.chunks} chunks, {ingestor.failures} failures"
+        )
+        return added
 
     def delete_all_documents(self):
         logging.debug(f"Deleting all documents")
         self.documents.delete(where={"type": ItemKind.DOCUMENT.value})
+        self.unindex_lexically_where(
+            lambda metadata: metadata["type"] == ItemKind.DOCUMENT.value
+        )
+        self.bump_version()
+        self.manifest.clear_documents()
+        self.manifest.save()
 
     def delete_all_requirements(self):
         logging.debug(f"Deleting all requirements")
         self.documents.delete(where={"type": ItemKind.REQUIREMENT.value})
+        self.unindex_lexically_where(
+            lambda metadata: metadata["type"] == ItemKind.REQUIREMENT.value
+        )
+        self.bump_version()
+        with self._lexical_lock:
+            if self.requirement_index is not None:
+                self.requirement_index.clear()
+        self.manifest.set_requirements(None)
+        self.manifest.save()
 
-    def add_requirement(self, requirement: Requirement, timestamp: float = -1):
-        logging.info(f"Adding requirement {requirement.id}: {requirement.description}")
+    def get_requirement_text(self, requirement: Requirement) -> str:
         text = (
             f"### Requirement {requirement.id}\nDescription: {requirement.description}"
         )
@@ -194,62 +484,239 @@ class KnowledgeLibrary:
             text = f"{text}\nNote: {requirement.note}\n"
         if requirement.justification is not None and len(requirement.justification) > 0:
             text = f"{text}\nJustification: {requirement.justification}\n"
+        return text
 
-        embedding = self.llm.embedding(text)
-        self.documents.add(
-            ids=[f"REQ:{requirement.id}"],
-            metadatas=[
-                {
-                    "path": "",
-                    "name": requirement.id,
-                    "index": 0,
-                    "timestamp": timestamp,
-                    "type": ItemKind.REQUIREMENT.value,
-                }
-            ],
-            documents=[text],
-            embeddings=embedding,
-        )
+    def get_requirement_hash(self, requirement: Requirement) -> str:
+        return hash_text(self.get_requirement_text(requirement))
+
+    def get_requirement_metadata(self, requirement: Requirement, timestamp: float):
+        return {
+            "path": "",
+            "name": requirement.id,
+            "index": 0,
+            "timestamp": timestamp,
+            "type": ItemKind.REQUIREMENT.value,
+            "hash": self.get_requirement_hash(requirement),
+        }
+
+    def add_requirement(self, requirement: Requirement, timestamp: float = -1):
+        self.add_requirements([requirement], timestamp)
 
     def add_requirements(self, requirements: List[Requirement], timestamp: float = -1):
+        self.store_requirements(requirements, timestamp)
+
+    def store_requirements(
+        self, requirements: List[Requirement], timestamp: float, upsert: bool = False
+    ):
+        if len(requirements) == 0:
+            return
         for requirement in requirements:
-            self.add_requirement(requirement, timestamp)
-
-    def get_document_timestamp(self, path) -> float:
-        results = self.documents.get(where={"path": path}, include=["metadatas"])
-        metadatas = results["metadatas"]
-        if len(metadatas) == 0:
-            return -1
-        timestamp = metadatas[0]["timestamp"]
-        for meta in metadatas:
-            timestamp = min(timestamp, meta["timestamp"])
-        return timestamp
-
-    def get_requirements_timestamp(self) -> float:
-        results = self.documents.get(
-            where={"type": ItemKind.REQUIREMENT.value}, include=["metadatas"]
+            logging.info(
+                f"Adding requirement {requirement.id}: {requirement.description}"
+            )
+        texts = [self.get_requirement_text(requirement) for requirement in requirements]
+        embeddings = self.llm.embeddings(texts, task="ingestion")
+        ids = [f"REQ:{requirement.id}" for requirement in requirements]
+        metadatas = [
+            self.get_requirement_metadata(requirement, timestamp)
+            for requirement in requirements
+        ]
+        store = self.documents.upsert if upsert else self.documents.add
+        store(ids=ids, metadatas=metadatas, documents=texts, embeddings=embeddings)
+        self.index_lexically(ids, metadatas, texts)
+        self.bump_version()
+        self.index_requirement_ids(
+            [requirement.id for requirement in requirements], texts
         )
-        metadatas = results["metadatas"]
-        if len(metadatas) == 0:
-            return -1
-        timestamp = metadatas[0]["timestamp"]
-        for meta in metadatas:
-            timestamp = min(timestamp, meta["timestamp"])
-        return timestamp
+
+    def index_requirement_ids(self, ids: List[str], documents: List[str]):
+        # An index being built may have read the collection before the change
+        with self._lexical_lock:
+            if self.requirement_index is not None:
+                self.requirement_index.add(ids, documents)
+
+    def get_filter(
+        self,
+        kinds: List[ItemKind] = None,
+        paths: List[str] = None,
+        names: List[str] = None,
+    ) -> Optional[Dict]:
+        conditions = []
+        if kinds is not None:
+            conditions.append({"type": {"$in": [kind.value for kind in kinds]}})
+        if paths is not None:
+            conditions.append({"path": {"$in": paths}})
+        if names is not None:
+            conditions.append({"name": {"$in": names}})
+        if len(conditions) == 0:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+
+    def get_lexical_index(self) -> LexicalIndex:
+        with self._lexical_lock:
+            if self.lexical_index is None:
+                results = self.documents.get(include=["metadatas", "documents"])
+                logging.info(f"Building lexical index of {len(results['ids'])} items")
+                index = LexicalIndex(self.config.hybrid_retrieval_config)
+                index.add(results["ids"], results["metadatas"], results["documents"])
+                self.lexical_index = index
+            return self.lexical_index
+
+    def get_requirement_index(self) -> RequirementIdIndex:
+        with self._lexical_lock:
+            if self.requirement_index is None:
+                results = self.documents.get(
+                    where={"type": ItemKind.REQUIREMENT.value},
+                    include=["metadatas", "documents"],
+                )
+                index = RequirementIdIndex()
+                index.add(
+                    [metadata["name"] for metadata in results["metadatas"]],
+                    results["documents"],
+                )
+                self.requirement_index = index
+            return self.requirement_index
+
+    def find_mentioned_requirements(self, text: str) -> List[Tuple[str, ItemKind, str]]:
+        # Requirements referenced by their IDs are found without embedding the text
+        return [
+            (id, ItemKind.REQUIREMENT, document)
+            for id, document in self.get_requirement_index().find(text)
+        ]
+
+    def index_lexically(
+        self, ids: List[str], metadatas: List[Dict], documents: List[str]
+    ):
+        # Nothing to do before the index is built, it then reads the whole collection,
+        # but an index being built may have read the collection before the change
+        with self._lexical_lock:
+            if self.lexical_index is not None:
+                self.lexical_index.add(ids, metadatas, documents)
+
+    def unindex_lexically(self, ids: List[str]):
+        with self._lexical_lock:
+            if self.lexical_index is not None:
+                self.lexical_index.remove(ids)
+
+    def unindex_lexically_where(self, predicate: Callable[[Dict], bool]):
+        with self._lexical_lock:
+            if self.lexical_index is not None:
+                self.lexical_index.remove_where(predicate)
+
+    def matches_filter(
+        self,
+        metadata: Dict,
+        kinds: List[ItemKind] = None,
+        paths: List[str] = None,
+        names: List[str] = None,
+    ) -> bool:
+        if kinds is not None and metadata.get("type") not in [k.value for k in kinds]:
+            return False
+        if paths is not None and metadata.get("path") not in paths:
+            return False
+        if names is not None and metadata.get("name") not in names:
+            return False
+        return True
 
     def get_relevant_documents(
-        self, text: str, count: int
+        self,
+        text: str,
+        count: int,
+        kinds: List[ItemKind] = None,
+        paths: List[str] = None,
+        names: List[str] = None,
+    ) -> List[Tuple[str, ItemKind, str]]:
+        # Filters are applied by the collection, so the excluded items take no results
+        if any(
+            len(values) == 0 for values in [kinds, paths, names] if values is not None
+        ):
+            return []
+        # Results depend on the embedding model and the lexical ranking too
+        hybrid = self.config.hybrid_retrieval_config
+        key = (
+            self.version,
+            self.llm.embeddings_model_name,
+            (hybrid.enabled, hybrid.k1, hybrid.b, hybrid.rrf_k),
+            text,
+            count,
+            tuple(kind.value for kind in kinds) if kinds is not None else None,
+            tuple(paths) if paths is not None else None,
+            tuple(names) if names is not None else None,
+        )
+        if self.retrieval_cache is not None:
+            docs = self.retrieval_cache.get(key)
+            if docs is not None:
+                return list(docs)
+        docs = self.search_documents(text, count, kinds, paths, names)
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.put(key, list(docs))
+        return docs
+
+    def get_query_embedding(self, text: str) -> List[float]:
+        if self.query_embedding_cache is None:
+            return self.llm.embedding(text, task="retrieval")
+        # Embeddings of another model are not comparable
+        key = (self.llm.embeddings_model_name, text)
+        embedding = self.query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.llm.embedding(text, task="retrieval")
+            self.query_embedding_cache.put(key, embedding)
+        return embedding
+
+    def search_documents(
+        self,
+        text: str,
+        count: int,
+        kinds: List[ItemKind] = None,
+        paths: List[str] = None,
+        names: List[str] = None,
     ) -> List[Tuple[str, ItemKind, str]]:
-        embedding = self.llm.embedding(text)
-        results = self.documents.query(query_embeddings=[embedding], n_results=count)
+        embedding = self.get_query_embedding(text)
+        results = self.documents.query(
+            query_embeddings=[embedding],
+            n_results=count,
+            where=self.get_filter(kinds, paths, names),
+        )
+        items = {
+            id: (metadata, document)
+            for id, metadata, document in zip(
+                results["ids"][0], results["metadatas"][0], results["documents"][0]
+            )
+        }
+        ranking = list(items.keys())
+        if self.config.hybrid_retrieval_config.enabled:
+            matches = self.get_lexical_index().search(
+                text,
+                count,
+                lambda metadata: self.matches_filter(metadata, kinds, paths, names),
+            )
+            for id, metadata, document in matches:
+                items[id] = (metadata, document)
+            ranking = fuse_rankings(
+                [ranking, [id for id, _, _ in matches]],
+                self.config.hybrid_retrieval_config.rrf_k,
+            )[0:count]
         docs = []
-        for i, document in enumerate(results["documents"][0]):
-            metadata = results["metadatas"][0][i]
+        for id in ranking:
+            metadata, document = items[id]
             name = metadata.get("name", "")
             item_kind = ItemKind(metadata.get("type", ItemKind.DOCUMENT.value))
             docs.append((name, item_kind, document))
         return docs
 
+    def get_cache_stats(self) -> Dict:
+        caches = {
+            "query_embedding_cache": self.query_embedding_cache,
+            "retrieval_cache": self.retrieval_cache,
+        }
+        return {
+            name: cache.stats.to_dict()
+            for name, cache in caches.items()
+            if cache is not None
+        }
+
     def get_all_documents(self) -> List[str]:
         results = self.documents.get()
         docs = []
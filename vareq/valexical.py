@@ -0,0 +1,181 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import Counter
+import heapq
+import math
+import re
+import threading
+
+
+class HybridRetrievalConfig:
+    enabled: bool
+    k1: float
+    b: float
+    rrf_k: int
+
+    def __init__(self):
+        # Fuse the vector search with a lexical search, which ranks exact terms better
+        self.enabled = False
+        # BM25 term frequency saturation and document length normalization
+        self.k1 = 1.2
+        self.b = 0.75
+        # Reciprocal rank fusion constant, higher values flatten the rank differences
+        self.rrf_k = 60
+
+
+# Words may contain punctuation, e.g. TC(17,1) or ECSS-E-ST-40C
+WORD_PATTERN = re.compile(r"[\w()\[\],.:/-]*\w[\w()\[\],.:/-]*")
+PART_PATTERN = re.compile(r"\w+")
+TRAILING_PUNCTUATION = ".,:/-"
+OPENING_BRACKETS = "(["
+CLOSING_BRACKETS = ")]"
+
+
+def find_closing_bracket(word: str) -> int:
+    opening = word[0]
+    closing = CLOSING_BRACKETS[OPENING_BRACKETS.index(opening)]
+    depth = 0
+    for index, character in enumerate(word):
+        if character == opening:
+            depth = depth + 1
+        elif character == closing:
+            depth = depth - 1
+            if depth == 0:
+                return index
+    return -1
+
+
+def strip_word(word: str) -> str:
+    # Brackets enclosing the word, or left unbalanced by the punctuation around it,
+    # are not part of it, but balanced ones within the word are, e.g. TC(17,1)
+    while True:
+        stripped = word.strip(TRAILING_PUNCTUATION)
+        if len(stripped) > 0 and stripped[0] in OPENING_BRACKETS:
+            closing_index = find_closing_bracket(stripped)
+            if closing_index == -1:
+                stripped = stripped[1:]
+            elif closing_index == len(stripped) - 1:
+                stripped = stripped[1:-1]
+        if len(stripped) > 0 and stripped[-1] in CLOSING_BRACKETS:
+            closing = stripped[-1]
+            opening = OPENING_BRACKETS[CLOSING_BRACKETS.index(closing)]
+            if stripped.count(closing) > stripped.count(opening):
+                stripped = stripped[:-1]
+        if stripped == word:
+            return word
+        word = stripped
+
+
+def tokenize(text: str) -> List[str]:
+    # Every word is indexed as a whole, and by its alphanumeric parts
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        word = strip_word(word)
+        parts = PART_PATTERN.findall(word)
+        if len(parts) != 1 or parts[0] != word:
+            tokens.append(word)
+        tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    config: HybridRetrievalConfig
+    postings: Dict[str, Dict[str, int]]
+    terms: Dict[str, Counter]
+    items: Dict[str, Tuple[Dict, str]]
+    lengths: Dict[str, int]
+    total_length: int
+    _lock: threading.Lock
+
+    def __init__(self, config: HybridRetrievalConfig):
+        self.config = config
+        self.postings = dict()
+        self.terms = dict()
+        self.items = dict()
+        self.lengths = dict()
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, ids: List[str], metadatas: List[Dict], documents: List[str]):
+        with self._lock:
+            for id, metadata, document in zip(ids, metadatas, documents):
+                self.remove_item(id)
+                terms = Counter(tokenize(document))
+                self.terms[id] = terms
+                self.items[id] = (metadata, document)
+                self.lengths[id] = sum(terms.values())
+                self.total_length = self.total_length + self.lengths[id]
+                for term, frequency in terms.items():
+                    self.postings.setdefault(term, dict())[id] = frequency
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for id in ids:
+                self.remove_item(id)
+
+    def remove_where(self, predicate: Callable[[Dict], bool]):
+        with self._lock:
+            ids = [
+                id for id, (metadata, _) in self.items.items() if predicate(metadata)
+            ]
+            for id in ids:
+                self.remove_item(id)
+
+    def remove_item(self, id: str):
+        terms = self.terms.pop(id, None)
+        if terms is None:
+            return
+        del self.items[id]
+        self.total_length = self.total_length - self.lengths.pop(id)
+        for term in terms:
+            postings = self.postings[term]
+            del postings[id]
+            if len(postings) == 0:
+                del self.postings[term]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self.items)
+
+    def search(
+        self,
+        text: str,
+        count: int,
+        predicate: Optional[Callable[[Dict], bool]] = None,
+    ) -> List[Tuple[str, Dict, str]]:
+        with self._lock:
+            if len(self.items) == 0:
+                return []
+            item_count = len(self.items)
+            average_length = max(self.total_length / item_count, 1)
+            scores = dict()
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                frequency = len(postings)
+                idf = math.log(1 + (item_count - frequency + 0.5) / (frequency + 0.5))
+                for id, term_frequency in postings.items():
+                    norm = self.config.k1 * (
+                        1
+                        - self.config.b
+                        + self.config.b * self.lengths[id] / average_length
+                    )
+                    score = idf * term_frequency * (self.config.k1 + 1)
+                    scores[id] = scores.get(id, 0.0) + score / (term_frequency + norm)
+            if predicate is not None:
+                scores = {
+                    id: score
+                    for id, score in scores.items()
+                    if predicate(self.items[id][0])
+                }
+            best = heapq.nlargest(count, scores.items(), key=lambda item: item[1])
+            return [(id, *self.items[id]) for id, _ in best]
+
+
+def fuse_rankings(rankings: List[List[str]], k: int) -> List[str]:
+    # Reciprocal rank fusion, ties keep the order of the first ranking
+    scores = dict()
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.keys(), key=lambda id: -scores[id])
@@ -1,9 +1,47 @@
-from typing import List
+from typing import List, Dict, Tuple, Iterator, Callable, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import concurrent.futures
+from array import array
+import asyncio
+import httpx
+import json
 import requests
+import requests.adapters
 import logging
+import math
 import re
-from langchain_ollama.llms import OllamaLLM
-from langchain_ollama import OllamaEmbeddings
+import threading
+import time
+import weakref
+import ollama
+from .vacache import CacheConfig, PersistentCache, hash_text
+from .vascheduler import SchedulerConfig, LlmScheduler, SingleFlight
+from .vausage import LlmUsageStats
+from .vareplay import (
+    ReplayConfig,
+    ReplayMode,
+    Recording,
+    ReplayClient,
+    AsyncReplayClient,
+    RecordingClient,
+    AsyncRecordingClient,
+    create_recording,
+)
+
+
+class ConnectionConfig:
+    pool_size: int
+    connect_timeout: float
+    read_timeout: float
+    health_check_interval: float
+
+    def __init__(self):
+        self.pool_size = 4
+        self.connect_timeout = 5.0
+        # Generation on CPU may take minutes, so no limit by default
+        self.read_timeout = 0
+        # Seconds between health checks of multiple endpoints, 0 disables them
+        self.health_check_interval = 30.0
 
 
 class LlmConfig:
@@ -12,70 +50,709 @@ class LlmConfig:
     chat_model: object
     embeddings_model: object
     url: str
+    urls: List[str]
     temperature: float
+    embeddings_batch_size: int
+    embedding_cache: CacheConfig
+    response_cache: CacheConfig
+    connection_config: ConnectionConfig
+    scheduler_config: SchedulerConfig
+    keep_alive: int
+    task_routes: Dict[str, Dict]
+    replay_config: ReplayConfig
 
     def __init__(self):
         self.chat_model_name = "qwen3:0.6b"
         self.embeddings_model_name = "nomic-embed-text"
         self.url = None
+        # Multiple Ollama servers, used instead of the single URL when provided
+        self.urls = []
         self.temperature = 0.8
+        # Seconds for which Ollama keeps the models loaded after a request,
+        # a negative value keeps them loaded indefinitely
+        self.keep_alive = 1800
+        self.embeddings_batch_size = 64
+        # About 170k embeddings of 768 dimensions
+        self.embedding_cache = CacheConfig(
+            enabled=True, path="embedding_cache.db", max_bytes=512 * 1024 * 1024
+        )
+        # Replies are reproducible only for deterministic settings, so opt-in
+        self.response_cache = CacheConfig(
+            enabled=False, path="response_cache.db", max_entries=10000
+        )
+        self.connection_config = ConnectionConfig()
+        self.scheduler_config = SchedulerConfig()
+        # Task name (e.g. chat, history, predefined query id, batch-pair) mapped to
+        # {"model": name, "options": {...}}, both optional, overriding the defaults
+        self.task_routes = {}
+        self.replay_config = ReplayConfig()
+
+
+class LlmEndpoint:
+    url: str
+    client: ollama.Client
+    create_async_client: Callable[[], ollama.AsyncClient]
+    async_clients: weakref.WeakKeyDictionary
+    outstanding: int
+    healthy: bool
+    _async_clients_lock: threading.Lock
+
+    def __init__(self, url: str, client_kwargs: Optional[Dict] = None):
+        self.url = url
+        client_kwargs = client_kwargs or {}
+        self.client = ollama.Client(host=url, **client_kwargs)
+        self.create_async_client = lambda: ollama.AsyncClient(host=url, **client_kwargs)
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.outstanding = 0
+        self.healthy = True
+        self._async_clients_lock = threading.Lock()
+
+    def get_async_client(self) -> ollama.AsyncClient:
+        # The connections of an asynchronous client are bound to the event loop
+        # they were opened in, so every loop gets its own client
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            client = self.async_clients.get(loop)
+            if client is None:
+                client = self.create_async_client()
+                self.async_clients[loop] = client
+            return client
+
+    def generate(self, request: Dict) -> Dict:
+        return self.client.generate(**request)
+
+    async def agenerate(self, request: Dict) -> Dict:
+        return await self.get_async_client().generate(**request)
+
+    def stream(self, request: Dict) -> Iterator[Dict]:
+        return self.client.generate(stream=True, **request)
+
+    def embed(self, request: Dict) -> Dict:
+        return self.client.embed(**request)
+
+    async def aembed(self, request: Dict) -> Dict:
+        return await self.get_async_client().embed(**request)
+
+    def close(self):
+        self.client.close()
+        # The asynchronous clients are closed with their event loops
+        with self._async_clients_lock:
+            self.async_clients.clear()
 
 
 class Llm:
     chat_model_name: str
     embeddings_model_name: str
-    chat_model: object
-    embeddings_model: object
     url: str
+    urls: List[str]
+    endpoints: List[LlmEndpoint]
     temperature: float
+    embeddings_batch_size: int
+    embedding_cache: PersistentCache
+    response_cache: PersistentCache
+    connection_config: ConnectionConfig
+    session: requests.Session
+    scheduler: LlmScheduler
+    keep_alive: int
+    task_routes: Dict[str, Dict]
+    usage: LlmUsageStats
+    recording: Recording
+    pending_responses: SingleFlight
+    pending_embeddings: SingleFlight
+    _endpoints_lock: threading.Lock
+    _health_checks: threading.Thread
+    _health_checks_stop: threading.Event
 
     def __init__(self, config: LlmConfig):
         self.url = config.url
+        self.urls = list(config.urls or [])
+        self.keep_alive = config.keep_alive
+        self.task_routes = dict(config.task_routes or {})
+        self.connection_config = config.connection_config
+        self.session = self.create_session()
+        self.scheduler = LlmScheduler(config.scheduler_config)
+        self.usage = LlmUsageStats()
+        # Identical concurrent calls share a single backend call
+        self.pending_responses = SingleFlight()
+        self.pending_embeddings = SingleFlight()
+        self.recording = create_recording(config.replay_config)
         self.temperature = config.temperature
-        self.set_chat_model(config.chat_model_name)
-        self.set_embedding_model(config.embeddings_model_name)
+        self.embeddings_batch_size = config.embeddings_batch_size
+        self.embedding_cache = (
+            PersistentCache(config.embedding_cache)
+            if config.embedding_cache.enabled
+            else None
+        )
+        self.response_cache = (
+            PersistentCache(config.response_cache)
+            if config.response_cache.enabled
+            else None
+        )
+        self._endpoints_lock = threading.Lock()
+        self._health_checks = None
+        self._health_checks_stop = threading.Event()
+        self.chat_model_name = config.chat_model_name
+        self.embeddings_model_name = config.embeddings_model_name
+        self.create_endpoints()
+
+    def create_endpoints(self):
+        urls = self.urls if len(self.urls) > 0 else [self.url]
+        self.endpoints = [LlmEndpoint(url, self.get_client_kwargs()) for url in urls]
+        for endpoint in self.endpoints:
+            self.attach_recording(endpoint)
+        if len(self.endpoints) > 1:
+            self.start_health_checks()
+
+    def attach_recording(self, endpoint: LlmEndpoint):
+        if self.recording is None:
+            return
+        if self.is_replaying():
+            endpoint.client = ReplayClient(self.recording)
+            endpoint.create_async_client = lambda: AsyncReplayClient(self.recording)
+        else:
+            endpoint.client = RecordingClient(endpoint.client, self.recording)
+            create_async_client = endpoint.create_async_client
+            endpoint.create_async_client = lambda: AsyncRecordingClient(
+                create_async_client(), self.recording
+            )
+
+    def is_replaying(self) -> bool:
+        return (
+            self.recording is not None
+            and self.recording.config.mode == ReplayMode.REPLAY
+        )
 
     def set_url(self, url: str):
         self.url = url
-        self.set_chat_model(self.chat_model_name)
-        self.set_embedding_model(self.embeddings_model_name)
+        self.urls = []
+        self.create_endpoints()
+
+    def set_urls(self, urls: List[str]):
+        self.urls = list(urls)
+        self.create_endpoints()
 
     def set_temperature(self, temperature: float):
         self.temperature = temperature
-        # Temperature is relevant only to a chat
-        self.set_chat_model(self.chat_model_name)
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=self.connection_config.pool_size
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get_client_kwargs(self) -> Dict:
+        # Both the synchronous and the asynchronous Ollama clients are httpx based,
+        # and keep the connections alive within the configured pool
+        config = self.connection_config
+        return {
+            "timeout": httpx.Timeout(
+                config.read_timeout or None, connect=config.connect_timeout or None
+            ),
+            "limits": httpx.Limits(
+                max_connections=config.pool_size,
+                max_keepalive_connections=config.pool_size,
+            ),
+        }
 
     def set_chat_model(self, name: str):
         self.chat_model_name = name
-        self.chat_model = OllamaLLM(
-            model=name, base_url=self.url, temperature=self.temperature
-        )
 
     def set_embedding_model(self, name: str):
         self.embeddings_model_name = name
-        self.embeddings_model = OllamaEmbeddings(model=name, base_url=self.url)
 
-    def query(self, question: str) -> str:
-        result = self.chat_model.invoke(question)
-        return str(result)
+    def get_route(self, routes: List[str]) -> Dict:
+        # The first configured route wins, so specific names precede generic ones
+        for name in routes:
+            if name in self.task_routes:
+                return self.task_routes[name]
+        return {}
+
+    def get_routed_models(self) -> List[str]:
+        models = [self.chat_model_name]
+        for route in self.task_routes.values():
+            model = route.get("model")
+            if model and model not in models:
+                models.append(model)
+        return models
 
-    def embedding(self, text: str) -> List[float]:
-        result = self.embeddings_model.embed_query(text)
+    def get_generate_request(
+        self, prompt: str, routes: List[str] = [], constraints: Dict = None
+    ) -> Dict:
+        # Constraints are additional request fields (e.g. format or think),
+        # and their options take precedence over the routed ones
+        route = self.get_route(routes)
+        constraints = dict(constraints or {})
+        options = {}
+        if self.temperature is not None:
+            # Temperature is relevant only to a chat
+            options["temperature"] = self.temperature
+        options.update(route.get("options") or {})
+        options.update(constraints.pop("options", None) or {})
+        request = {
+            "model": route.get("model") or self.chat_model_name,
+            "prompt": prompt,
+            "keep_alive": self.keep_alive,
+        }
+        request.update(constraints)
+        if len(options) > 0:
+            request["options"] = options
+        return request
+
+    def get_embed_request(self, texts: List[str]) -> Dict:
+        return {
+            "model": self.embeddings_model_name,
+            "input": texts,
+            "keep_alive": self.keep_alive,
+        }
+
+    def generate(self, endpoint: LlmEndpoint, request: Dict, task: str) -> str:
+        started = time.monotonic()
+        response = endpoint.generate(request)
+        self.usage.record(task, response, time.monotonic() - started)
+        return response["response"]
+
+    async def agenerate(self, endpoint: LlmEndpoint, request: Dict, task: str) -> str:
+        started = time.monotonic()
+        response = await endpoint.agenerate(request)
+        self.usage.record(task, response, time.monotonic() - started)
+        return response["response"]
+
+    def stream(self, endpoint: LlmEndpoint, request: Dict, task: str) -> Iterator[str]:
+        started = time.monotonic()
+        for chunk in endpoint.stream(request):
+            # Only the final chunk carries the counters
+            if chunk.get("done"):
+                self.usage.record(task, chunk, time.monotonic() - started)
+            if chunk.get("response"):
+                yield chunk["response"]
+
+    def embed(
+        self, endpoint: LlmEndpoint, texts: List[str], task: str
+    ) -> List[List[float]]:
+        started = time.monotonic()
+        response = endpoint.embed(self.get_embed_request(texts))
+        self.usage.record(task, response, time.monotonic() - started)
+        return [list(embedding) for embedding in response["embeddings"]]
+
+    async def aembed(
+        self, endpoint: LlmEndpoint, texts: List[str], task: str
+    ) -> List[List[float]]:
+        started = time.monotonic()
+        response = await endpoint.aembed(self.get_embed_request(texts))
+        self.usage.record(task, response, time.monotonic() - started)
+        return [list(embedding) for embedding in response["embeddings"]]
+
+    def acquire_endpoint(self, excluded: List[LlmEndpoint]) -> LlmEndpoint:
+        with self._endpoints_lock:
+            candidates = [e for e in self.endpoints if e not in excluded]
+            healthy = [e for e in candidates if e.healthy]
+            # When all endpoints seem to be down, try the remaining ones anyway
+            candidates = healthy if len(healthy) > 0 else candidates
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+            endpoint.outstanding = endpoint.outstanding + 1
+            return endpoint
+
+    def release_endpoint(self, endpoint: LlmEndpoint):
+        with self._endpoints_lock:
+            endpoint.outstanding = endpoint.outstanding - 1
+
+    def is_endpoint_failure(self, error: Exception) -> bool:
+        # Rejected requests, e.g. of an unknown model, would fail on any endpoint
+        if isinstance(error, ollama.ResponseError):
+            return error.status_code >= 500
+        return isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError))
+
+    def handle_endpoint_failure(
+        self, endpoint: LlmEndpoint, excluded: List[LlmEndpoint], error: Exception
+    ) -> bool:
+        if not self.is_endpoint_failure(error):
+            return False
+        endpoint.healthy = False
+        excluded.append(endpoint)
+        if len(excluded) >= len(self.endpoints):
+            return False
+        logging.warning(
+            f"Request to {endpoint.url} failed ({str(error)}), retrying on another endpoint"
+        )
+        return True
+
+    def dispatch(self, function: Callable, *args):
+        # Function is called with the least loaded endpoint as the first argument
+        excluded = []
+        while True:
+            endpoint = self.acquire_endpoint(excluded)
+            try:
+                return function(endpoint, *args)
+            except Exception as e:
+                if not self.handle_endpoint_failure(endpoint, excluded, e):
+                    raise
+            finally:
+                self.release_endpoint(endpoint)
+
+    async def adispatch(self, function: Callable, *args):
+        excluded = []
+        while True:
+            endpoint = self.acquire_endpoint(excluded)
+            try:
+                return await function(endpoint, *args)
+            except Exception as e:
+                if not self.handle_endpoint_failure(endpoint, excluded, e):
+                    raise
+            finally:
+                self.release_endpoint(endpoint)
+
+    def dispatch_stream(self, function: Callable, *args) -> Iterator:
+        excluded = []
+        while True:
+            endpoint = self.acquire_endpoint(excluded)
+            started = False
+            try:
+                for item in function(endpoint, *args):
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                # Partially consumed stream cannot be repeated
+                if started or not self.handle_endpoint_failure(endpoint, excluded, e):
+                    raise
+            finally:
+                self.release_endpoint(endpoint)
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            healthy = self.is_endpoint_available(endpoint.url)
+            if healthy != endpoint.healthy:
+                logging.warning(
+                    f"Endpoint {endpoint.url} is {'up' if healthy else 'down'}"
+                )
+            endpoint.healthy = healthy
+
+    def run_health_checks(self):
+        while not self._health_checks_stop.wait(
+            self.connection_config.health_check_interval
+        ):
+            self.check_health()
+
+    def start_health_checks(self):
+        if self._health_checks is not None:
+            return
+        if self.connection_config.health_check_interval <= 0:
+            return
+        self._health_checks = threading.Thread(
+            target=self.run_health_checks, daemon=True
+        )
+        self._health_checks.start()
+
+    def close(self):
+        self._health_checks_stop.set()
+        if self._health_checks is not None:
+            self._health_checks.join()
+            self._health_checks = None
+        self.scheduler.shutdown()
+        for endpoint in self.endpoints:
+            endpoint.close()
+        self.session.close()
+        for cache in [self.embedding_cache, self.response_cache]:
+            if cache is not None:
+                cache.close()
+
+    def warm_up(self) -> bool:
+        # An empty prompt makes Ollama load the model without generating anything
+        if self.is_replaying():
+            return True
+        ready = False
+        for endpoint in self.endpoints:
+            try:
+                for model in self.get_routed_models():
+                    logging.info(f"Loading chat model {model} on {endpoint.url}")
+                    request = self.get_generate_request("")
+                    request["model"] = model
+                    self.scheduler.run(self.generate, endpoint, request, "warm-up")
+                logging.info(
+                    f"Loading embeddings model {self.embeddings_model_name} on {endpoint.url}"
+                )
+                self.scheduler.run(self.embed, endpoint, ["warm-up"], "warm-up")
+                ready = True
+            except Exception as e:
+                logging.error(f"Model warm-up on {endpoint.url} failed: {str(e)}")
+                endpoint.healthy = False
+        return ready
+
+    def get_response_cache_key(self, request: Dict) -> str:
+        settings = {
+            key: value
+            for key, value in request.items()
+            if key not in ["model", "prompt", "keep_alive"]
+        }
+        settings = json.dumps(settings, sort_keys=True)
+        return (
+            f"{request['model']}:{hash_text(settings)}:{hash_text(request['prompt'])}"
+        )
+
+    def get_cached_response(self, request: Dict, use_cache: bool) -> str:
+        if not use_cache or self.response_cache is None:
+            return None
+        key = self.get_response_cache_key(request)
+        cached = self.response_cache.get(key)
+        if cached is None:
+            return None
+        logging.debug(f"Response cache hit for {key}")
+        return cached.decode("utf-8")
+
+    def store_response(self, request: Dict, use_cache: bool, response: str):
+        if not use_cache or self.response_cache is None:
+            return
+        key = self.get_response_cache_key(request)
+        self.response_cache.put(key, response.encode("utf-8"))
+
+    def query(
+        self,
+        question: str,
+        use_cache: bool = False,
+        task: str = "query",
+        routes: List[str] = None,
+        constraints: Dict = None,
+    ) -> str:
+        # Routes default to the task name
+        request = self.get_generate_request(question, routes or [task], constraints)
+        cached = self.get_cached_response(request, use_cache)
+        if cached is not None:
+            return cached
+        return self.pending_responses.run(
+            self.get_response_cache_key(request),
+            self.generate_response,
+            request,
+            task,
+            use_cache,
+        )
+
+    def generate_response(self, request: Dict, task: str, use_cache: bool) -> str:
+        result = self.scheduler.run(self.dispatch, self.generate, request, task)
+        self.store_response(request, use_cache, result)
         return result
 
-    def is_available(self) -> bool:
+    async def aquery(
+        self,
+        question: str,
+        use_cache: bool = False,
+        task: str = "query",
+        routes: List[str] = None,
+        constraints: Dict = None,
+    ) -> str:
+        request = self.get_generate_request(question, routes or [task], constraints)
+        cached = self.get_cached_response(request, use_cache)
+        if cached is not None:
+            return cached
+        return await self.pending_responses.arun(
+            self.get_response_cache_key(request),
+            self.agenerate_response,
+            request,
+            task,
+            use_cache,
+        )
+
+    async def agenerate_response(
+        self, request: Dict, task: str, use_cache: bool
+    ) -> str:
+        result = await self.scheduler.arun(
+            self.adispatch, self.agenerate, request, task
+        )
+        self.store_response(request, use_cache, result)
+        return result
+
+    def stream_query(
+        self, question: str, task: str = "query", routes: List[str] = None
+    ) -> Iterator[str]:
+        request = self.get_generate_request(question, routes or [task])
+        yield from self.scheduler.stream(
+            self.dispatch_stream, self.stream, request, task
+        )
+
+    def embedding(self, text: str, task: str = "embedding") -> List[float]:
+        return self.embeddings([text], task=task)[0]
+
+    async def aembedding(self, text: str, task: str = "embedding") -> List[float]:
+        return (await self.aembeddings([text], task=task))[0]
+
+    def get_embedding_cache_key(self, text: str) -> str:
+        # Marks the single precision entries, so that older double precision ones are not misread
+        return f"{self.embeddings_model_name}:f32:{hash_text(text)}"
+
+    def get_cached_embeddings(
+        self, texts: List[str]
+    ) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        keys = [self.get_embedding_cache_key(text) for text in texts]
+        cached = {}
+        if self.embedding_cache is not None:
+            stored = self.embedding_cache.get_many(keys)
+            cached = {key: array("f", value).tolist() for key, value in stored.items()}
+        # Identical texts are computed only once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        logging.debug(
+            f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses"
+        )
+        return keys, cached, missing
+
+    def store_embeddings(
+        self, keys: List[str], embeddings: List[List[float]]
+    ) -> Dict[str, List[float]]:
+        if self.embedding_cache is not None:
+            self.embedding_cache.put_many(
+                [
+                    (key, array("f", embedding).tobytes())
+                    for key, embedding in zip(keys, embeddings)
+                ]
+            )
+        return dict(zip(keys, embeddings))
+
+    def embeddings(
+        self, texts: List[str], batch_size: int = None, task: str = "embedding"
+    ) -> List[List[float]]:
+        keys, cached, missing = self.get_cached_embeddings(texts)
+        owned, pending = self.claim_embeddings(missing)
+        if len(owned) > 0:
+            try:
+                computed = self.compute_embeddings(
+                    list(owned.values()), batch_size, task
+                )
+                stored = self.store_embeddings(list(owned.keys()), computed)
+            except BaseException as e:
+                self.complete_embeddings(list(owned.keys()), error=e)
+                raise
+            self.complete_embeddings(list(owned.keys()), stored)
+            cached.update(stored)
+        for key, future in pending.items():
+            cached[key] = future.result()
+        return [cached[key] for key in keys]
+
+    async def aembeddings(
+        self, texts: List[str], batch_size: int = None, task: str = "embedding"
+    ) -> List[List[float]]:
+        keys, cached, missing = self.get_cached_embeddings(texts)
+        owned, pending = self.claim_embeddings(missing)
+        if len(owned) > 0:
+            try:
+                computed = await self.acompute_embeddings(
+                    list(owned.values()), batch_size, task
+                )
+                stored = self.store_embeddings(list(owned.keys()), computed)
+            except BaseException as e:
+                self.complete_embeddings(list(owned.keys()), error=e)
+                raise
+            self.complete_embeddings(list(owned.keys()), stored)
+            cached.update(stored)
+        for key, future in pending.items():
+            cached[key] = await asyncio.wrap_future(future)
+        return [cached[key] for key in keys]
+
+    def claim_embeddings(
+        self, missing: Dict[str, str]
+    ) -> Tuple[Dict[str, str], Dict[str, Future]]:
+        # Texts already being embedded by another caller are awaited instead
+        owned = {}
+        pending = {}
+        for key, text in missing.items():
+            future, leader = self.pending_embeddings.claim(key)
+            if leader:
+                owned[key] = text
+            else:
+                pending[key] = future
+        if len(pending) > 0:
+            logging.debug(f"Joining {len(pending)} in-flight embeddings")
+        return owned, pending
+
+    def complete_embeddings(
+        self,
+        keys: List[str],
+        embeddings: Dict[str, List[float]] = {},
+        error: BaseException = None,
+    ):
+        for key in keys:
+            self.pending_embeddings.complete(key, embeddings.get(key), error)
+
+    def split_batches(
+        self, texts: List[str], batch_size: int = None
+    ) -> List[List[str]]:
+        # A batch size below one would not split the texts at all
+        batch_size = max(batch_size or self.embeddings_batch_size, 1)
+        return [
+            texts[start : start + batch_size]
+            for start in range(0, len(texts), batch_size)
+        ]
+
+    def compute_embeddings(
+        self, texts: List[str], batch_size: int = None, task: str = "embedding"
+    ) -> List[List[float]]:
+        # Ollama accepts a list of inputs, so a single call serves the whole batch,
+        # and the batches are computed concurrently, as allowed by the scheduler
+        futures = []
+        for batch in self.split_batches(texts, batch_size):
+            logging.debug(f"Embedding batch of {len(batch)} texts")
+            futures.append(
+                self.scheduler.submit(self.dispatch, self.embed, batch, task)
+            )
+        result = []
+        for future in futures:
+            result.extend(self.scheduler.result(future))
+        return result
+
+    async def acompute_embeddings(
+        self, texts: List[str], batch_size: int = None, task: str = "embedding"
+    ) -> List[List[float]]:
+        # The scheduler rejects asynchronous requests over its queue size instead of
+        # waiting, so no more batches are submitted than can be executed at once
+        slots = asyncio.Semaphore(max(self.scheduler.config.max_in_flight, 1))
+
+        async def compute(batch: List[str]) -> List[List[float]]:
+            async with slots:
+                logging.debug(f"Embedding batch of {len(batch)} texts")
+                return await self.scheduler.arun(
+                    self.adispatch, self.aembed, batch, task
+                )
+
+        batches = self.split_batches(texts, batch_size)
+        results = await asyncio.gather(*[compute(batch) for batch in batches])
+        return [embedding for result in results for embedding in result]
+
+    def is_endpoint_available(self, url: str) -> bool:
+        if self.is_replaying():
+            return True
         try:
-            url = self.url or "127.0.0.1:11434"
-            response = requests.get(f"http://{url}/api/tags")
+            url = url or "127.0.0.1:11434"
+            response = self.session.get(
+                f"http://{url}/api/tags",
+                timeout=self.connection_config.connect_timeout or None,
+            )
             return response.status_code == 200
         except:
             return False
 
+    def is_available(self) -> bool:
+        return any(self.is_endpoint_available(e.url) for e in self.endpoints)
+
+
+class MemoryStrategy:
+    SUMMARY = "summary"
+    ROLLING = "rolling"
+
 
 class ChatConfig:
     query_template: str
     history_summarization_template: str
+    turn_template: str
     remove_thinking: bool
+    background_summarization: bool
+    summary_wait_timeout: float
+    memory_strategy: str
+    memory_token_budget: int
+    chars_per_token: float
+    memory_compression_template: str
 
     def __init__(self):
         self.query_template = """### History
@@ -94,17 +771,125 @@ You are an expert requirements engineer, working in the space industry. You have
 {2}
 ### Instruction
 Summarize the conversation history to include both the previous history, and the new query and reply. Be as concise as possible, do not include any formatting directives."""
+        # Verbatim form of the exchanges which are not summarized yet
+        self.turn_template = """
+User: {0}
+System: {1}"""
+        # Summarize the history after the reply is returned, instead of before
+        self.background_summarization = False
+        # Seconds for which the next query waits for a pending summary, before
+        # using the unsummarized exchanges verbatim; negative waits until done
+        self.summary_wait_timeout = -1
+        # summary: the whole history is summarized after every exchange
+        # rolling: exchanges are kept verbatim, and only the oldest ones are
+        # summarized once they exceed the token budget
+        self.memory_strategy = MemoryStrategy.SUMMARY
+        self.memory_token_budget = 1024
+        # Rough estimate, used instead of a tokenizer
+        self.chars_per_token = 4
+        self.memory_compression_template = """### Previous summary
+{0}
+### Older conversation
+{1}
+### Instruction
+Summarize the conversation to include both the previous summary, and the older conversation. Be as concise as possible, do not include any formatting directives."""
+
+
+class ThinkingFilter:
+    START_MARKER = "<think>"
+    END_MARKER = "</think>"
+
+    buffer: str
+    thinking: bool
+    started: bool
+
+    def __init__(self):
+        self.buffer = ""
+        self.thinking = False
+        self.started = False
+
+    def get_partial_marker_length(self, marker: str) -> int:
+        # A marker may be split between tokens, so its beginning is withheld
+        for length in range(min(len(marker) - 1, len(self.buffer)), 0, -1):
+            if self.buffer.endswith(marker[:length]):
+                return length
+        return 0
+
+    def emit(self, text: str) -> str:
+        # Mimic the stripping done when the thinking is removed from a full reply
+        if not self.started:
+            text = text.lstrip()
+            self.started = len(text) > 0
+        return text
+
+    def feed(self, token: str) -> str:
+        self.buffer = self.buffer + token
+        output = ""
+        while True:
+            if self.thinking:
+                end = self.buffer.find(self.END_MARKER)
+                if end < 0:
+                    partial = self.get_partial_marker_length(self.END_MARKER)
+                    self.buffer = self.buffer[len(self.buffer) - partial :]
+                    return self.emit(output)
+                self.buffer = self.buffer[end + len(self.END_MARKER) :]
+                self.thinking = False
+            else:
+                start = self.buffer.find(self.START_MARKER)
+                if start < 0:
+                    partial = self.get_partial_marker_length(self.START_MARKER)
+                    output = output + self.buffer[: len(self.buffer) - partial]
+                    self.buffer = self.buffer[len(self.buffer) - partial :]
+                    return self.emit(output)
+                output = output + self.buffer[:start]
+                self.buffer = self.buffer[start + len(self.START_MARKER) :]
+                self.thinking = True
+
+    def flush(self) -> str:
+        remainder = "" if self.thinking else self.buffer
+        self.buffer = ""
+        return self.emit(remainder)
 
 
 class Chat:
     llm: Llm
     history: str
+    pending_exchanges: List[Tuple[str, str]]
     config: ChatConfig
+    _summarizer: ThreadPoolExecutor
+    _summary: Future
+    _lock: threading.Lock
 
     def __init__(self, llm: Llm, config: ChatConfig):
         self.llm = llm
         self.config = config
         self.history = ""
+        self.pending_exchanges = []
+        self._summarizer = None
+        self._summary = None
+        self._lock = threading.Lock()
+
+    def get_state(self) -> Dict:
+        # Exchanges awaiting a summary are kept verbatim
+        with self._lock:
+            return {
+                "history": self.history,
+                "pending_exchanges": [list(e) for e in self.pending_exchanges],
+            }
+
+    def set_state(self, state: Dict):
+        with self._lock:
+            self.history = state.get("history", "")
+            self.pending_exchanges = [
+                tuple(e) for e in state.get("pending_exchanges", [])
+            ]
+            if not self.is_rolling():
+                # Their summaries were lost with the previous chat, so the exchanges
+                # stay in the history verbatim
+                self.history = self.history + self.format_exchanges(
+                    self.pending_exchanges
+                )
+                self.pending_exchanges = []
 
     def set_history_summarization_template(self, template: str):
         self.config.history_summarization_template = template
@@ -118,18 +903,142 @@ class Chat:
             return re.sub(pattern, "", reply, flags=re.DOTALL).strip()
         return reply
 
-    def chat(self, context_data: str, question: str) -> str:
-        query = self.config.query_template.format(self.history, context_data, question)
+    def format_exchanges(self, exchanges: List[Tuple[str, str]]) -> str:
+        return "".join(
+            self.config.turn_template.format(question, answer)
+            for question, answer in exchanges
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.config.chars_per_token)
+
+    def is_rolling(self) -> bool:
+        return self.config.memory_strategy == MemoryStrategy.ROLLING
+
+    def get_history(self) -> str:
+        summary = self._summary
+        # Rolling memory keeps the exchanges verbatim until they are compressed
+        if not self.is_rolling() and summary is not None and not summary.done():
+            timeout = self.config.summary_wait_timeout
+            logging.debug("Waiting for the pending history summary")
+            concurrent.futures.wait([summary], timeout if timeout >= 0 else None)
+        with self._lock:
+            return self.history + self.format_exchanges(self.pending_exchanges)
+
+    def get_query(self, context_data: str, question: str) -> str:
+        query = self.config.query_template.format(
+            self.get_history(), context_data, question
+        )
         logging.debug(f"Query:\n---\n{query}\n---")
-        answer = self.llm.query(query)
+        return query
+
+    def chat(self, context_data: str, question: str) -> str:
+        query = self.get_query(context_data, question)
+        answer = self.llm.query(query, task="chat")
         logging.debug(f"Asnwer:\n---\n{answer}\n---")
         clean_answer = self.cleanup_reply(answer)
+        self.update_history(question, clean_answer)
+        return clean_answer
+
+    def chat_stream(self, context_data: str, question: str) -> Iterator[str]:
+        query = self.get_query(context_data, question)
+        thinking_filter = ThinkingFilter() if self.config.remove_thinking else None
+        tokens = []
+        for token in self.llm.stream_query(query, task="chat"):
+            tokens.append(token)
+            text = thinking_filter.feed(token) if thinking_filter else token
+            if len(text) > 0:
+                yield text
+        if thinking_filter:
+            text = thinking_filter.flush()
+            if len(text) > 0:
+                yield text
+        answer = "".join(tokens)
+        logging.debug(f"Asnwer:\n---\n{answer}\n---")
+        self.update_history(question, self.cleanup_reply(answer))
+
+    def update_history(self, question: str, clean_answer: str):
         # thinking does not need to clutter the memory
+        if self.is_rolling():
+            self.update_rolling_memory(question, clean_answer)
+            return
+        if not self.config.background_summarization:
+            self.history = self.summarize(question, clean_answer)
+            return
+        with self._lock:
+            self.pending_exchanges.append((question, clean_answer))
+        self.submit_summary(self.summarize_in_background, question, clean_answer)
+
+    def submit_summary(self, function: Callable, *args):
+        if self._summarizer is None:
+            # A single worker keeps the summaries in the order of the exchanges
+            self._summarizer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="summary"
+            )
+        self._summary = self._summarizer.submit(function, *args)
+
+    def update_rolling_memory(self, question: str, clean_answer: str):
+        with self._lock:
+            self.pending_exchanges.append((question, clean_answer))
+            exchanges = self.format_exchanges(self.pending_exchanges)
+        if self.count_tokens(exchanges) <= self.config.memory_token_budget:
+            return
+        if not self.config.background_summarization:
+            self.compress_memory()
+        elif self._summary is None or self._summary.done():
+            # A compression in progress covers the oldest exchanges already
+            self.submit_summary(self.compress_memory)
+
+    def select_oldest_exchanges(self) -> int:
+        # Compressing down to half of the budget avoids compressing on every turn,
+        # and the latest exchange is always kept verbatim
+        with self._lock:
+            count = 0
+            while count < len(self.pending_exchanges) - 1:
+                remaining = self.format_exchanges(self.pending_exchanges[count:])
+                if self.count_tokens(remaining) <= self.config.memory_token_budget / 2:
+                    break
+                count = count + 1
+            return count
+
+    def compress_memory(self):
+        count = self.select_oldest_exchanges()
+        if count == 0:
+            return
+        oldest = self.format_exchanges(self.pending_exchanges[:count])
+        compression_query = self.config.memory_compression_template.format(
+            self.history, oldest
+        )
+        logging.debug(f"Compressing {count} oldest exchanges")
+        try:
+            new_history = self.llm.query(compression_query, task="history")
+        except Exception as e:
+            # The exchanges stay verbatim, and the compression is retried later
+            logging.error(f"History compression failed: {str(e)}")
+            return
+        logging.debug(f"History:\n---\n{new_history}\n---")
+        with self._lock:
+            self.history = new_history
+            del self.pending_exchanges[:count]
+
+    def summarize(self, question: str, clean_answer: str) -> str:
         history_query = self.config.history_summarization_template.format(
             self.history, question, clean_answer
         )
         logging.debug(f"History query:\n---\n{history_query}\n---")
-        new_history = self.llm.query(history_query)
+        new_history = self.llm.query(history_query, task="history")
         logging.debug(f"History:\n---\n{new_history}\n---")
-        self.history = new_history
-        return clean_answer
+        return new_history
+
+    def summarize_in_background(self, question: str, clean_answer: str):
+        try:
+            new_history = self.summarize(question, clean_answer)
+        except Exception as e:
+            # The exchange is kept verbatim rather than lost
+            logging.error(f"History summarization failed: {str(e)}")
+            new_history = self.history + self.config.turn_template.format(
+                question, clean_answer
+            )
+        with self._lock:
+            self.history = new_history
+            self.pending_exchanges.remove((question, clean_answer))
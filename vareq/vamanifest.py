@@ -0,0 +1,172 @@
+from typing import Dict, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+MIGRATED_MTIME_TOLERANCE = 0.001
+
+
+class ManifestEntry:
+    path: str
+    mtime: float
+    size: int
+    hash: str
+    count: int
+
+    def __init__(
+        self,
+        path: str,
+        mtime: float,
+        size: int = None,
+        hash: str = None,
+        count: int = 0,
+    ):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.hash = hash
+        self.count = count
+
+    def to_dict(self) -> Dict:
+        return {
+            "path": self.path,
+            "mtime": self.mtime,
+            "size": self.size,
+            "hash": self.hash,
+            "count": self.count,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> "ManifestEntry":
+        return ManifestEntry(
+            data.get("path"),
+            data.get("mtime", -1),
+            data.get("size"),
+            data.get("hash"),
+            data.get("count", 0),
+        )
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def create_entry(path: str, count: int = 0) -> ManifestEntry:
+    stat = os.stat(path)
+    return ManifestEntry(path, stat.st_mtime, stat.st_size, hash_file(path), count)
+
+
+class IndexManifest:
+    path: str
+    documents: Dict[str, ManifestEntry]
+    requirements: Optional[ManifestEntry]
+    dirty: bool
+    _lock: threading.RLock
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents = dict()
+        self.requirements = None
+        self.dirty = False
+        self._lock = threading.RLock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self):
+        if not self.exists():
+            return
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Reading index manifest {self.path} failed: {str(e)}")
+            return
+        with self._lock:
+            self.documents = {
+                path: ManifestEntry.from_dict(entry)
+                for path, entry in data.get("documents", {}).items()
+            }
+            requirements = data.get("requirements")
+            self.requirements = (
+                ManifestEntry.from_dict(requirements) if requirements else None
+            )
+        logging.debug(
+            f"Loaded index manifest of {len(self.documents)} documents from {self.path}"
+        )
+
+    def save(self):
+        with self._lock:
+            data = {
+                "documents": {
+                    path: entry.to_dict() for path, entry in self.documents.items()
+                },
+                "requirements": (
+                    self.requirements.to_dict() if self.requirements else None
+                ),
+            }
+            # Replaced at once, so that an interrupted write does not corrupt it
+            temporary_path = f"{self.path}.tmp"
+            try:
+                with open(temporary_path, "w") as file:
+                    json.dump(data, file)
+                os.replace(temporary_path, self.path)
+                self.dirty = False
+            except OSError as e:
+                logging.error(f"Storing index manifest {self.path} failed: {str(e)}")
+
+    def save_if_dirty(self):
+        with self._lock:
+            if self.dirty:
+                self.save()
+
+    def get_document(self, path: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            return self.documents.get(path)
+
+    def set_document(self, entry: ManifestEntry):
+        with self._lock:
+            self.documents[entry.path] = entry
+
+    def remove_document(self, path: str):
+        with self._lock:
+            self.documents.pop(path, None)
+
+    def clear_documents(self):
+        with self._lock:
+            self.documents = dict()
+
+    def set_requirements(self, entry: Optional[ManifestEntry]):
+        with self._lock:
+            self.requirements = entry
+
+    def is_up_to_date(self, entry: Optional[ManifestEntry], path: str) -> bool:
+        if entry is None:
+            # Not registered, so not up to date
+            return False
+        stat = os.stat(path)
+        # Timestamps of the migrated entries may have been rounded by the store
+        tolerance = MIGRATED_MTIME_TOLERANCE if entry.size is None else 0
+        not_modified = stat.st_mtime <= entry.mtime + tolerance
+        if not_modified and entry.size in [None, stat.st_size]:
+            return True
+        if entry.hash is not None and entry.size == stat.st_size:
+            # Touched, but possibly not modified
+            if hash_file(path) == entry.hash:
+                logging.info(f'File "{path}" touched, but its content is unchanged')
+                # Saved once by the caller, after all the files were checked
+                with self._lock:
+                    entry.mtime = stat.st_mtime
+                    self.dirty = True
+                return True
+        logging.info(
+            f'File "{path}" timestamp changed from {entry.mtime} to {stat.st_mtime}'
+        )
+        return False
@@ -1,5 +1,6 @@
 from enum import Enum
-from typing import List, Dict, Optional
+from typing import List, Dict, FrozenSet, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from .varequirementreader import Requirement
 from .vallminterface import Llm, Chat, LlmConfig, ChatConfig
 from . import helpers
@@ -9,6 +10,7 @@ from mako.lookup import TemplateLookup
 import logging
 import json
 import os
+import threading
 
 
 class QueryArity(Enum):
@@ -37,6 +39,28 @@ class PredefinedQuery:
         self.threshold = 0 if self.kind == QueryKind.BINARY else None
 
 
+class BinaryScoringConfig:
+    enabled: bool
+    num_predict: int
+    stop: List[str]
+    think: bool
+    instruction: str
+
+    def __init__(self):
+        # Binary queries are answered with a JSON score instead of a free text
+        self.enabled = False
+        # Maximum number of generated tokens per score
+        self.num_predict = 16
+        # Stop sequences, must not cut a pretty-printed JSON reply
+        self.stop = []
+        # Thinking would take most of the generated tokens
+        self.think = False
+        self.instruction = (
+            "\nRespond only with a JSON object containing the estimate in percent "
+            'as the score, e.g. {"score": 42}.'
+        )
+
+
 class BatchResponseElement:
     requirement: Requirement
     embedding: List[float]
@@ -66,14 +90,25 @@ class BatchResponseElement:
 
 
 class PredefinedQueries:
+    SCORE_SCHEMA = {
+        "type": "object",
+        "properties": {"score": {"type": "number", "minimum": 0, "maximum": 100}},
+        "required": ["score"],
+    }
+
     llm: Llm
     queries: Dict[str, PredefinedQuery]
     batch_query_context_size: int
+    batch_query_workers: int
+    binary_scoring_config: BinaryScoringConfig
 
     def __init__(self, llm: Llm):
         self.queries = dict()
         self.llm = llm
         self.batch_query_context_size = 3
+        # Requirements of a batch query processed at once
+        self.batch_query_workers = 4
+        self.binary_scoring_config = BinaryScoringConfig()
 
     def register(self, query: PredefinedQuery):
         logging.debug(f"Registering query for ID {query.id}")
@@ -88,7 +123,53 @@ class PredefinedQueries:
     def exists(self, id: str) -> bool:
         return id in self.queries.keys()
 
-    def process(self, id: str, requirement: Requirement) -> str:
+    def get_route(self, query: PredefinedQuery) -> str:
+        # Generic route for unary queries of the given kind, e.g. binary-query
+        return f"{query.kind.name.lower()}-query"
+
+    def get_scoring_constraints(self) -> Dict:
+        config = self.binary_scoring_config
+        constraints = {
+            "format": self.SCORE_SCHEMA,
+            "options": {"num_predict": config.num_predict},
+        }
+        if config.stop:
+            constraints["options"]["stop"] = config.stop
+        if config.think is not None:
+            constraints["think"] = config.think
+        return constraints
+
+    def extract_score(self, reply: str) -> Optional[float]:
+        # Unparsable replies (e.g. cut by the token limit) fall back to the first number
+        try:
+            return float(json.loads(reply)["score"])
+        except (ValueError, TypeError, KeyError):
+            return helpers.extract_number(reply)
+
+    def score(
+        self, query: PredefinedQuery, question: str, use_cache: bool, routes: List[str]
+    ) -> Tuple[Optional[float], str]:
+        if not self.binary_scoring_config.enabled:
+            # It is simpler to ask the LLM for estimate than change its sensititivy and try to get a yes/no answer directly
+            # so an estimate is used; in order to extract properly, we need to ignore the thinking phase (if applicable)
+            reply = self.llm.query(
+                question, use_cache=use_cache, task=query.id, routes=routes
+            )
+            logging.debug(f"Query result is: {reply}")
+            thoughtless_reply = helpers.remove_think_markers(reply)
+            return helpers.extract_number(thoughtless_reply), thoughtless_reply
+        reply = self.llm.query(
+            question + self.binary_scoring_config.instruction,
+            use_cache=use_cache,
+            task=query.id,
+            routes=routes,
+            constraints=self.get_scoring_constraints(),
+        )
+        logging.debug(f"Query result is: {reply}")
+        estimate = self.extract_score(helpers.remove_think_markers(reply))
+        return estimate, f"Estimate: {estimate:g}%" if estimate is not None else reply
+
+    def process(self, id: str, requirement: Requirement, use_cache: bool = True) -> str:
         if not id in self.queries.keys():
             logging.error(f"Query for ID {id} not found")
             return None
@@ -107,29 +188,30 @@ class PredefinedQueries:
             ",".join(requirement.traces),
         )
         logging.debug(f"Query got resolved to: {question}")
-        reply = self.llm.query(question)
-        logging.debug(f"Query result is: {reply}")
+        routes = [id, self.get_route(query)]
         if query.kind == QueryKind.BINARY:
-            # It is simpler to ask the LLM for estimate than change its sensititivy and try to get a yes/no answer directly
-            # so an estimate is used; in order to extract properly, we need to ignore the thinking phase (if applicable)
-            thoughtless_reply = helpers.remove_think_markers(reply)
-            estimate = helpers.extract_number(thoughtless_reply)
+            estimate, _ = self.score(query, question, use_cache, routes)
             if estimate is None:
                 return "False"
             if estimate >= query.threshold:
                 return "True"
             return "False"
+        reply = self.llm.query(question, use_cache=use_cache, task=id, routes=routes)
+        logging.debug(f"Query result is: {reply}")
         return reply
 
     def initialize_batch_response(
-        self, requirements: List[Requirement]
+        self, requirements: List[Requirement], task: str = "embedding"
     ) -> List[BatchResponseElement]:
         response = []
-        for requirement in requirements:
+        logging.debug(f"Calculating embeddings for {len(requirements)} requirements")
+        embeddings = self.llm.embeddings(
+            [requirement.description for requirement in requirements], task=task
+        )
+        for requirement, embedding in zip(requirements, embeddings):
             element = BatchResponseElement()
             element.requirement = requirement
-            logging.debug(f"Calculating embedding for {requirement.description}")
-            element.embedding = self.llm.embedding(requirement.description)
+            element.embedding = embedding
             response.append(element)
 
         for element in response:
@@ -150,93 +232,126 @@ class PredefinedQueries:
             ]
         return response
 
-    def find_existing_result(
+    def process_batch_response(
         self,
+        query: PredefinedQuery,
         response: List[BatchResponseElement],
-        requirement_1: Requirement,
-        requirement_2: Requirement,
-    ) -> Optional[str]:
-        for element in response:
-            if element.requirement == requirement_1:
-                for applied_requirement in element.applied_requirements:
-                    if applied_requirement == requirement_2:
-                        return element.message
-        return None
-
-    def process_batch_response(
-        self, query: PredefinedQuery, response: List[BatchResponseElement]
+        use_cache: bool = True,
     ) -> List[BatchResponseElement]:
-        total_requirement_count = len(response)
-        pairs = {}
-        for count, element in enumerate(response, 1):
+        # Elements are processed concurrently, so that the LLM is kept busy, while
+        # each element compares its context requirements in order
+        outcomes: Dict[FrozenSet[Requirement], Future] = dict()
+        lock = threading.Lock()
+        workers = max(min(self.batch_query_workers, len(response)), 1)
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="batch"
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self.process_batch_element,
+                    query,
+                    element,
+                    outcomes,
+                    lock,
+                    use_cache,
+                )
+                for element in response
+            ]
+            for count, future in enumerate(futures, 1):
+                future.result()
+                logging.debug(f"Processed requirement {count} of {len(response)}")
+        return response
+
+    def process_batch_element(
+        self,
+        query: PredefinedQuery,
+        element: BatchResponseElement,
+        outcomes: Dict[FrozenSet[Requirement], Future],
+        lock: threading.Lock,
+        use_cache: bool,
+    ):
+        requirement = element.requirement
+        for other in element.context_requirements:
             logging.debug(
-                f"Processing requirement {count} of {total_requirement_count}"
+                f"Processing pair: {requirement.description} and {other.description}"
             )
-            requirement = element.requirement
-            for other in element.context_requirements:
+            # Every pair is queried once, the outcome holds the message of an applied pair
+            key = frozenset([requirement, other])
+            with lock:
+                outcome = outcomes.get(key)
+                claimed = outcome is None
+                if claimed:
+                    outcome = Future()
+                    outcomes[key] = outcome
+            if not claimed:
+                # Query was already executed (for a different order)
                 logging.debug(
-                    f"Processing pair: {requirement.description} and {other.description}"
+                    f"Skipping query for {requirement.id} and {other.id} [already done in reverse]"
                 )
-                if (requirement, other) in pairs:
-                    # Query was already executed (for a different order)
+                existing_result = outcome.result()
+                if existing_result:
                     logging.debug(
-                        f"Skipping query for {requirement.id} and {other.id} [already done in reverse]"
+                        f"Reusing positive result for {requirement.id} and {other.id}"
                     )
-                    existing_result = self.find_existing_result(
-                        response, other, requirement
-                    )
-                    if existing_result:
-                        logging.debug(
-                            f"Reusing positive result for {requirement.id} and {other.id}"
-                        )
-                        element.applied_requirements.append(other)
-                        element.message = existing_result
-                    break
-                # Do not query again
-                pairs[(requirement, other)] = True
-                pairs[(other, requirement)] = True
-                question = query.template.format(
-                    requirement.id,
-                    requirement.description,
-                    requirement.note,
-                    requirement.justification,
-                    requirement.type,
-                    requirement.validation_type,
-                    ",".join(requirement.traces),
-                    other.id,
-                    other.description,
-                    other.note,
-                    other.justification,
-                    other.type,
-                    other.validation_type,
-                    ",".join(other.traces),
-                )
-                logging.debug(f"Query got resolved to: {question}")
-                reply = self.llm.query(question)
-                logging.debug(f"Query result is: {reply}")
-                thoughtless_reply = helpers.remove_think_markers(reply)
-                if query.kind == QueryKind.FREETEXT:
-                    # Only a single comparison with the closes requirement
                     element.applied_requirements.append(other)
-                    element.message = thoughtless_reply
-                    break
-                elif query.kind == QueryKind.BINARY:
-                    # It is simpler to ask the LLM for estimate than change its sensititivy and try to get a yes/no answer directly
-                    # so an estimate is used; in order to extract properly, we need to ignore the thinking phase (if applicable)
-                    estimate = helpers.extract_number(thoughtless_reply)
-                    if estimate is None:
-                        continue
-                    if estimate >= query.threshold:
-                        logging.info(
-                            f"Detection: {estimate}% for [{requirement.id}:{requirement.description}] and [{other.id}: {other.description}]"
-                        )
-                        element.applied_requirements.append(other)
-                        element.message = thoughtless_reply
-                        break
-        return response
+                    element.message = existing_result
+                break
+            try:
+                applied, message = self.process_pair(
+                    query, requirement, other, use_cache
+                )
+            except BaseException as e:
+                outcome.set_exception(e)
+                raise
+            outcome.set_result(message if applied else None)
+            if applied:
+                element.applied_requirements.append(other)
+                element.message = message
+                break
+
+    def process_pair(
+        self,
+        query: PredefinedQuery,
+        requirement: Requirement,
+        other: Requirement,
+        use_cache: bool,
+    ) -> Tuple[bool, Optional[str]]:
+        question = query.template.format(
+            requirement.id,
+            requirement.description,
+            requirement.note,
+            requirement.justification,
+            requirement.type,
+            requirement.validation_type,
+            ",".join(requirement.traces),
+            other.id,
+            other.description,
+            other.note,
+            other.justification,
+            other.type,
+            other.validation_type,
+            ",".join(other.traces),
+        )
+        logging.debug(f"Query got resolved to: {question}")
+        routes = [query.id, "batch-pair"]
+        if query.kind == QueryKind.FREETEXT:
+            reply = self.llm.query(
+                question, use_cache=use_cache, task=query.id, routes=routes
+            )
+            logging.debug(f"Query result is: {reply}")
+            # Only a single comparison with the closes requirement
+            return True, helpers.remove_think_markers(reply)
+        elif query.kind == QueryKind.BINARY:
+            estimate, message = self.score(query, question, use_cache, routes)
+            if estimate is not None and estimate >= query.threshold:
+                logging.info(
+                    f"Detection: {estimate}% for [{requirement.id}:{requirement.description}] and [{other.id}: {other.description}]"
+                )
+                return True, message
+        return False, None
 
     def process_batch(
-        self, id: str, requirements: List[Requirement]
+        self, id: str, requirements: List[Requirement], use_cache: bool = True
     ) -> List[BatchResponseElement]:
         if id not in self.queries:
             logging.error(f"Query for ID {id} not found")
@@ -246,8 +361,8 @@ class PredefinedQueries:
             logging.error(f"Query for ID {id} is not nary, but {query.arity}")
             return None
 
-        response = self.initialize_batch_response(requirements)
-        response = self.process_batch_response(query, response)
+        response = self.initialize_batch_response(requirements, id)
+        response = self.process_batch_response(query, response, use_cache)
         return response
 
 
@@ -0,0 +1,278 @@
+from typing import Dict, Iterator, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from .vacache import hash_text
+
+
+class ReplayMode:
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class ReplayConfig:
+    mode: str
+    path: str
+    latency: float
+    token_latency: float
+    synthesize_missing: bool
+    embedding_dimension: int
+
+    def __init__(self):
+        # One of off, record or replay
+        self.mode = ReplayMode.OFF
+        self.path = "llm_recording.jsonl"
+        # Synthetic latency of replayed calls in seconds, per call and per generated token
+        self.latency = 0.0
+        self.token_latency = 0.0
+        # Replay unknown requests with deterministic placeholders instead of failing
+        self.synthesize_missing = False
+        self.embedding_dimension = 768
+
+
+# Only the fields relevant to the callers are recorded, the token context is dropped
+RECORDED_FIELDS = [
+    "response",
+    "thinking",
+    "done",
+    "done_reason",
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+]
+
+
+def get_generate_key(request: Dict) -> str:
+    data = {
+        "model": request.get("model"),
+        "prompt": request.get("prompt"),
+        "options": request.get("options") or {},
+        "format": request.get("format"),
+        "think": request.get("think"),
+    }
+    return hash_text(json.dumps(data, sort_keys=True))
+
+
+def get_embed_key(model: str, text: str) -> str:
+    return f"{model}:{hash_text(text)}"
+
+
+class Recording:
+    config: ReplayConfig
+    responses: Dict[str, Dict]
+    embeddings: Dict[str, List[float]]
+    _lock: threading.Lock
+
+    def __init__(self, config: ReplayConfig):
+        self.config = config
+        self.responses = dict()
+        self.embeddings = dict()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.config.path):
+            return
+        logging.debug(f"Loading LLM recording from {self.config.path}")
+        with open(self.config.path, "r") as file:
+            for line in file:
+                if len(line.strip()) == 0:
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "generate":
+                    self.responses[entry["key"]] = entry["response"]
+                elif entry["kind"] == "embed":
+                    self.embeddings[entry["key"]] = entry["embedding"]
+        logging.debug(
+            f"Loaded {len(self.responses)} responses and {len(self.embeddings)} embeddings"
+        )
+
+    def append(self, entries: List[Dict]):
+        with self._lock:
+            with open(self.config.path, "a") as file:
+                for entry in entries:
+                    file.write(json.dumps(entry) + "\n")
+
+    def record_response(self, request: Dict, response: Dict):
+        key = get_generate_key(request)
+        recorded = {
+            field: response.get(field)
+            for field in RECORDED_FIELDS
+            if response.get(field) is not None
+        }
+        with self._lock:
+            self.responses[key] = recorded
+        self.append([{"kind": "generate", "key": key, "response": recorded}])
+
+    def record_embeddings(self, request: Dict, response: Dict):
+        texts = request["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        entries = []
+        for text, embedding in zip(texts, response.get("embeddings")):
+            key = get_embed_key(request["model"], text)
+            embedding = list(embedding)
+            with self._lock:
+                self.embeddings[key] = embedding
+            entries.append({"kind": "embed", "key": key, "embedding": embedding})
+        self.append(entries)
+
+    def synthesize_embedding(self, key: str) -> List[float]:
+        # Deterministic pseudo-random unit vector, derived from the key
+        values = []
+        counter = 0
+        while len(values) < self.config.embedding_dimension:
+            digest = hashlib.sha256(f"{key}:{counter}".encode("utf-8")).digest()
+            values.extend((byte - 127.5) / 127.5 for byte in digest)
+            counter = counter + 1
+        values = values[: self.config.embedding_dimension]
+        norm = sum(value * value for value in values) ** 0.5
+        return [value / norm for value in values]
+
+    def find_response(self, request: Dict) -> Dict:
+        key = get_generate_key(request)
+        with self._lock:
+            response = self.responses.get(key)
+        if response is not None:
+            return response
+        if self.config.synthesize_missing:
+            return {"response": "", "done": True}
+        raise LookupError(
+            f"No recorded response for prompt {hash_text(request['prompt'])}"
+        )
+
+    def find_embeddings(self, request: Dict) -> Dict:
+        texts = request["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        embeddings = []
+        for text in texts:
+            key = get_embed_key(request["model"], text)
+            with self._lock:
+                embedding = self.embeddings.get(key)
+            if embedding is None:
+                if not self.config.synthesize_missing:
+                    raise LookupError(f"No recorded embedding for {key}")
+                embedding = self.synthesize_embedding(key)
+            embeddings.append(embedding)
+        return {"embeddings": embeddings, "prompt_eval_count": len(texts)}
+
+    def get_latency(self, response: Dict) -> float:
+        return (
+            self.config.latency
+            + (response.get("eval_count") or 0) * self.config.token_latency
+        )
+
+
+class ReplayClient:
+    recording: Recording
+
+    def __init__(self, recording: Recording):
+        self.recording = recording
+
+    def generate(self, stream: bool = False, **request):
+        response = self.recording.find_response(request)
+        time.sleep(self.recording.get_latency(response))
+        if stream:
+            return self.split_response(response)
+        return response
+
+    def split_response(self, response: Dict) -> Iterator[Dict]:
+        # Words are replayed as separate chunks, and the counters come last
+        text = response.get("response", "")
+        for word in text.split(" ")[:-1]:
+            yield {"response": word + " ", "done": False}
+        last = dict(response)
+        last["response"] = text.split(" ")[-1]
+        yield last
+
+    def embed(self, **request):
+        response = self.recording.find_embeddings(request)
+        time.sleep(self.recording.get_latency(response))
+        return response
+
+    def close(self):
+        pass
+
+
+class AsyncReplayClient:
+    recording: Recording
+
+    def __init__(self, recording: Recording):
+        self.recording = recording
+
+    async def generate(self, **request):
+        response = self.recording.find_response(request)
+        await asyncio.sleep(self.recording.get_latency(response))
+        return response
+
+    async def embed(self, **request):
+        response = self.recording.find_embeddings(request)
+        await asyncio.sleep(self.recording.get_latency(response))
+        return response
+
+
+class RecordingClient:
+    client: object
+    recording: Recording
+
+    def __init__(self, client: object, recording: Recording):
+        self.client = client
+        self.recording = recording
+
+    def generate(self, stream: bool = False, **request):
+        if stream:
+            return self.record_stream(request)
+        response = self.client.generate(**request)
+        self.recording.record_response(request, response)
+        return response
+
+    def record_stream(self, request: Dict) -> Iterator:
+        parts = []
+        for chunk in self.client.generate(stream=True, **request):
+            parts.append(chunk.get("response") or "")
+            if chunk.get("done"):
+                response = {field: chunk.get(field) for field in RECORDED_FIELDS}
+                response["response"] = "".join(parts)
+                self.recording.record_response(request, response)
+            yield chunk
+
+    def embed(self, **request):
+        response = self.client.embed(**request)
+        self.recording.record_embeddings(request, response)
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncRecordingClient:
+    client: object
+    recording: Recording
+
+    def __init__(self, client: object, recording: Recording):
+        self.client = client
+        self.recording = recording
+
+    async def generate(self, **request):
+        response = await self.client.generate(**request)
+        self.recording.record_response(request, response)
+        return response
+
+    async def embed(self, **request):
+        response = await self.client.embed(**request)
+        self.recording.record_embeddings(request, response)
+        return response
+
+
+def create_recording(config: ReplayConfig) -> Optional[Recording]:
+    if config.mode not in [ReplayMode.RECORD, ReplayMode.REPLAY]:
+        return None
+    logging.info(f"LLM calls are in {config.mode} mode, using {config.path}")
+    return Recording(config)
@@ -5,7 +5,7 @@ from vareq import vaconfig
 
 from .vaqueries import QueryArity, BatchResponseElement
 from .vallminterface import LlmConfig
-from .vaengine import Engine, EngineConfig
+from .vaengine import Engine, EngineConfig, AugmentedChatReply
 from .varequirementreader import Mappings, RequirementReader
 from .vaqueries import PredefinedQueryReader
 from .vaserver import VaServer, ServerConfig
@@ -43,6 +43,11 @@ def parse_arguments() -> object:
     parser.add_argument("--server-config-json", help="Server config JSON string")
     parser.add_argument("--query-id", help="Query ID for query mode")
     parser.add_argument("--requirement-id", help="Requirement ID for query mode")
+    parser.add_argument(
+        "--bypass-cache",
+        help="Do not use the LLM response cache in query mode",
+        action="store_true",
+    )
     parser.add_argument(
         "--setup-instructions",
         help="Print installation instructions",
@@ -116,7 +121,11 @@ def handle_chat(config: EngineConfig) -> int:
         if len(query) == 0:
             logging.info("System: Exiting...")
             return 0
-        reply = chat.chat(query)
+        logging.info(f"-- System response:")
+        reply = AugmentedChatReply()
+        for text in chat.chat_stream(query, reply):
+            print(text, end="", flush=True)
+        print()
         for index, reference in enumerate(reply.references):
             logging.info(
                 f"-- Reference {index}(length {len(reference)}):\n{reference}\n"
@@ -124,11 +133,12 @@ def handle_chat(config: EngineConfig) -> int:
         logging.info(f"-- Total references: {len(reply.references)}")
         logging.info(f"-- Reference names: {','.join(reply.reference_names)}")
         logging.debug(f"-- User query: {reply.query}")
-        logging.info(f"-- System response:")
-        print(reply.answer)
+        engine.log_usage_stats()
 
 
 def handle_reset_db(config: EngineConfig) -> int:
+    # The models are not used
+    config.warm_up = False
     logging.info(f"Deleting all documents")
     engine = Engine(config)
     engine.lib.delete_all_documents()
@@ -157,9 +167,10 @@ def handle_unary_query(engine: Engine, args: object) -> int:
     if not requirement:
         print(f"Requirement {requirement_id} was not found")
         return -1
-    reply = engine.process_query(query_id, requirement)
+    reply = engine.process_query(query_id, requirement, not args.bypass_cache)
     logging.info("Query result:")
     print(reply)
+    engine.log_usage_stats()
     return 0
 
 
@@ -195,7 +206,7 @@ def handle_nary_query(engine: Engine, args: object) -> int:
         config.requirements_file_path
     )
     query_id = args.query_id
-    reply = engine.process_batch_query(query_id, requirements)
+    reply = engine.process_batch_query(query_id, requirements, not args.bypass_cache)
     clean_reply = extract_unique_detections(reply)
     logging.info(f"Query result:")
     for element in clean_reply:
@@ -209,6 +220,7 @@ def handle_nary_query(engine: Engine, args: object) -> int:
             print(
                 f"Detection: [{requirement.id}:{requirement.description}] and [{other.id}: {other.description}] - {element.message}"
             )
+    engine.log_usage_stats()
     return 0
 
 
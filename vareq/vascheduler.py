@@ -0,0 +1,291 @@
+from typing import Callable, Dict, Iterator, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import concurrent.futures
+import asyncio
+import logging
+import threading
+import time
+
+
+class SchedulerConfig:
+    max_in_flight: int
+    queue_size: int
+    queue_timeout: float
+    request_timeout: float
+
+    def __init__(self):
+        # Should match OLLAMA_NUM_PARALLEL of the server
+        self.max_in_flight = 4
+        self.queue_size = 64
+        # Timeouts in seconds, 0 means waiting indefinitely
+        self.queue_timeout = 0
+        self.request_timeout = 0
+
+
+class SchedulerStats:
+    submitted: int
+    completed: int
+    failed: int
+    rejected: int
+    timed_out: int
+    queue_depth: int
+    max_queue_depth: int
+    in_flight: int
+    max_in_flight: int
+    total_wait_time: float
+    total_run_time: float
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def average_wait_time(self) -> float:
+        started = self.completed + self.failed
+        return self.total_wait_time / started if started > 0 else 0.0
+
+    def average_run_time(self) -> float:
+        started = self.completed + self.failed
+        return self.total_run_time / started if started > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "average_wait_time": self.average_wait_time(),
+            "average_run_time": self.average_run_time(),
+        }
+
+
+class LlmScheduler:
+    config: SchedulerConfig
+    stats: SchedulerStats
+    _executor: ThreadPoolExecutor
+    _queue_slots: threading.BoundedSemaphore
+    _run_slots: threading.BoundedSemaphore
+    _lock: threading.Lock
+
+    def __init__(self, config: SchedulerConfig):
+        self.config = config
+        self.stats = SchedulerStats()
+        max_in_flight = max(config.max_in_flight, 1)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="llm"
+        )
+        # Requests waiting in the queue and requests being executed both take
+        # a queue slot, so that the total number of pending requests is bounded
+        self._queue_slots = threading.BoundedSemaphore(
+            max_in_flight + max(config.queue_size, 0)
+        )
+        self._run_slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    def _admit(self, blocking: bool = True) -> float:
+        timeout = self.config.queue_timeout or None
+        if not blocking:
+            admitted = self._queue_slots.acquire(blocking=False)
+        else:
+            admitted = self._queue_slots.acquire(timeout=timeout)
+        with self._lock:
+            if not admitted:
+                self.stats.rejected = self.stats.rejected + 1
+            else:
+                self.stats.submitted = self.stats.submitted + 1
+                self.stats.queue_depth = self.stats.queue_depth + 1
+                self.stats.max_queue_depth = max(
+                    self.stats.max_queue_depth, self.stats.queue_depth
+                )
+        if not admitted:
+            logging.warning("LLM request rejected, as the queue is full")
+            raise TimeoutError("LLM request queue is full")
+        return time.monotonic()
+
+    def _start(self, enqueued: float) -> float:
+        started = time.monotonic()
+        with self._lock:
+            self.stats.queue_depth = self.stats.queue_depth - 1
+            self.stats.in_flight = self.stats.in_flight + 1
+            self.stats.max_in_flight = max(
+                self.stats.max_in_flight, self.stats.in_flight
+            )
+            self.stats.total_wait_time = self.stats.total_wait_time + (
+                started - enqueued
+            )
+        return started
+
+    def _finish(self, started: float, succeeded: bool):
+        with self._lock:
+            self.stats.in_flight = self.stats.in_flight - 1
+            self.stats.total_run_time = self.stats.total_run_time + (
+                time.monotonic() - started
+            )
+            if succeeded:
+                self.stats.completed = self.stats.completed + 1
+            else:
+                self.stats.failed = self.stats.failed + 1
+        self._run_slots.release()
+        self._queue_slots.release()
+
+    def _execute(self, enqueued: float, function: Callable, args, kwargs):
+        self._run_slots.acquire()
+        started = self._start(enqueued)
+        succeeded = False
+        try:
+            result = function(*args, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            self._finish(started, succeeded)
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        enqueued = self._admit()
+        return self._executor.submit(self._execute, enqueued, function, args, kwargs)
+
+    def result(self, future: Future):
+        try:
+            return future.result(timeout=self.config.request_timeout or None)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.stats.timed_out = self.stats.timed_out + 1
+            if future.cancel():
+                # The request never started, so its queue slot is returned here
+                with self._lock:
+                    self.stats.queue_depth = self.stats.queue_depth - 1
+                self._queue_slots.release()
+            logging.warning("LLM request timed out")
+            raise TimeoutError("LLM request timed out")
+
+    def run(self, function: Callable, *args, **kwargs):
+        return self.result(self.submit(function, *args, **kwargs))
+
+    def stream(self, function: Callable, *args, **kwargs) -> Iterator:
+        # Streams are consumed by the caller, so they occupy an execution slot
+        # until the iteration finishes, but do not use the worker threads
+        enqueued = self._admit()
+        if not self._run_slots.acquire(timeout=self.config.request_timeout or None):
+            with self._lock:
+                self.stats.timed_out = self.stats.timed_out + 1
+                self.stats.queue_depth = self.stats.queue_depth - 1
+            self._queue_slots.release()
+            raise TimeoutError("LLM request timed out")
+        started = self._start(enqueued)
+        succeeded = False
+        try:
+            yield from function(*args, **kwargs)
+            succeeded = True
+        except GeneratorExit:
+            # The consumer stopped the iteration early
+            succeeded = True
+            raise
+        finally:
+            self._finish(started, succeeded)
+
+    async def arun(self, function: Callable, *args, **kwargs):
+        # The event loop must not block, so a full queue rejects immediately,
+        # and execution slots are polled
+        enqueued = self._admit(blocking=False)
+        deadline = (
+            enqueued + self.config.request_timeout
+            if self.config.request_timeout
+            else None
+        )
+        while not self._run_slots.acquire(blocking=False):
+            if deadline is not None and time.monotonic() > deadline:
+                with self._lock:
+                    self.stats.timed_out = self.stats.timed_out + 1
+                    self.stats.queue_depth = self.stats.queue_depth - 1
+                self._queue_slots.release()
+                raise TimeoutError("LLM request timed out")
+            await asyncio.sleep(0.01)
+        started = self._start(enqueued)
+        succeeded = False
+        try:
+            timeout = deadline - time.monotonic() if deadline is not None else None
+            result = await asyncio.wait_for(function(*args, **kwargs), timeout)
+            succeeded = True
+            return result
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.stats.timed_out = self.stats.timed_out + 1
+            raise TimeoutError("LLM request timed out")
+        finally:
+            self._finish(started, succeeded)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class SingleFlight:
+    coalesced: int
+    _calls: Dict[str, Future]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> Tuple[Future, bool]:
+        # The first caller of a key becomes the leader, which executes the call
+        # and completes the future awaited by the others
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced = self.coalesced + 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def complete(self, key: str, result=None, error: BaseException = None):
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: str, function: Callable, *args, **kwargs):
+        future, leader = self.claim(key)
+        if not leader:
+            logging.debug(f"Joining in-flight call {key}")
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.complete(key, error=e)
+            raise
+        self.complete(key, result)
+        return result
+
+    async def arun(self, key: str, function: Callable, *args, **kwargs):
+        future, leader = self.claim(key)
+        if not leader:
+            logging.debug(f"Joining in-flight call {key}")
+            return await asyncio.wrap_future(future)
+        try:
+            result = await function(*args, **kwargs)
+        except BaseException as e:
+            self.complete(key, error=e)
+            raise
+        self.complete(key, result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -1,24 +1,37 @@
 from typing import List
-from flask import Flask, jsonify, views
+from flask import Flask, jsonify, request, views
 import logging
 import warnings
-from .vaengine import Engine, EngineConfig, AugmentedChat
+from .vaengine import Engine, EngineConfig
 from .varequirementreader import Requirement, RequirementReader
+from .vasessions import SessionConfig, SessionStore
 
 
 class Context:
+    DEFAULT_SESSION = "default"
+    SESSION_HEADER = "X-Session-Id"
+
     engine: Engine
     config: EngineConfig
+    session_config: SessionConfig
     requirements: List[Requirement]
-    chat: AugmentedChat
+    sessions: SessionStore
 
-    def __init__(self, config: EngineConfig):
+    def __init__(self, config: EngineConfig, session_config: SessionConfig = None):
         self.config = config
+        self.session_config = session_config or SessionConfig()
+        self.engine = None
         self.reinit()
 
     def reinit(self):
-        self.engine = Engine(self.config)
-        self.chat = self.engine.get_chat()
+        if self.engine is not None:
+            # The sessions are restored by the new engine on their next use
+            self.sessions.spill_all()
+            self.engine.stop()
+        # The server can respond while the models are being loaded
+        self.engine = Engine(self.config, warm_up_in_background=True)
+        # Every session has its own chat history
+        self.sessions = SessionStore(self.session_config, self.engine.create_chat)
         self.requirements = []
         if self.config.requirements_file_path:
             mappings = self.config.lib_config.requirement_document_mappings
@@ -38,6 +51,7 @@ class AreYouAliveView(views.View):
         logging.info(f"Server are you alive")
         result = {
             "status": "ok",
+            "ready": self.context.engine.is_ready(),
         }
         return jsonify(result)
 
@@ -70,10 +84,18 @@ class ChatView(views.View):
     def __init__(self, context: Context):
         self.context = context
 
-    def dispatch_request(self, query: str):
-        logging.info(f"Server chat: {query}")
+    def dispatch_request(self, query: str, session_id: str):
+        # Session is identified by the path or a header, a shared one is used otherwise
+        session_id = (
+            session_id
+            or request.headers.get(Context.SESSION_HEADER)
+            or Context.DEFAULT_SESSION
+        )
+        logging.info(f"Server chat ({session_id}): {query}")
         try:
-            reply = self.context.chat.chat(query)
+            session = self.context.sessions.get(session_id)
+            with session.lock:
+                reply = session.chat.chat(query)
             logging.info(f"Server chat reply: {reply}")
             result = {
                 "query": query,
@@ -187,11 +209,13 @@ class ServerConfig:
     host: str
     port: int
     debug: bool
+    session_config: SessionConfig
 
     def __init__(self, host: str = "127.0.0.1", port: int = 8080, debug: bool = False):
         self.debug = debug
         self.host = host
         self.port = port
+        self.session_config = SessionConfig()
 
 
 class VaServer:
@@ -203,7 +227,7 @@ class VaServer:
     def __init__(self, server_config: ServerConfig, engine_config: EngineConfig):
         self.app = None
         self.config = server_config
-        self.context = Context(engine_config)
+        self.context = Context(engine_config, server_config.session_config)
 
     def prepare(self):
         if not self.config.debug:
@@ -231,8 +255,13 @@ class VaServer:
         )
         self.app.add_url_rule(
             "/chat/<string:query>/",
+            defaults={"session_id": None},
             view_func=ChatView.as_view("chat", self.context),
         )
+        self.app.add_url_rule(
+            "/chat/<string:session_id>/<string:query>/",
+            view_func=ChatView.as_view("session-chat", self.context),
+        )
         self.app.add_url_rule(
             "/areyoualive/",
             view_func=AreYouAliveView.as_view("areyoualive", self.context),
@@ -0,0 +1,147 @@
+from typing import Callable
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+from .vacache import hash_text
+from .vaengine import AugmentedChat
+
+
+class SessionConfig:
+    max_sessions: int
+    idle_timeout: float
+    spill_directory: str
+
+    def __init__(self):
+        self.max_sessions = 64
+        # Seconds after which an unused session is evicted, 0 keeps sessions until
+        # they are evicted as the least recently used
+        self.idle_timeout = 3600
+        # Evicted sessions are stored there and restored on their next use,
+        # no directory discards them
+        self.spill_directory = None
+
+
+class Session:
+    id: str
+    chat: AugmentedChat
+    last_used: float
+    lock: threading.Lock
+
+    def __init__(self, id: str, chat: AugmentedChat):
+        self.id = id
+        self.chat = chat
+        self.last_used = time.monotonic()
+        # Queries of a single session are answered one at a time
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+    config: SessionConfig
+    create_chat: Callable[[], AugmentedChat]
+    sessions: OrderedDict
+    evictions: int
+    _lock: threading.Lock
+
+    def __init__(self, config: SessionConfig, create_chat: Callable[[], AugmentedChat]):
+        self.config = config
+        self.create_chat = create_chat
+        self.sessions = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.config.spill_directory:
+            os.makedirs(self.config.spill_directory, exist_ok=True)
+
+    def get(self, id: str) -> Session:
+        with self._lock:
+            self.evict_idle()
+            session = self.sessions.get(id)
+            if session is None:
+                self.evict_least_recently_used(max(self.config.max_sessions, 1) - 1)
+                session = Session(id, self.create_chat())
+                self.restore(session)
+                self.sessions[id] = session
+            self.sessions.move_to_end(id)
+            session.last_used = time.monotonic()
+            return session
+
+    def evict_idle(self):
+        if self.config.idle_timeout <= 0:
+            return
+        deadline = time.monotonic() - self.config.idle_timeout
+        idle = [s for s in self.sessions.values() if s.last_used < deadline]
+        for session in idle:
+            if self.try_evict(session):
+                logging.debug(f"Evicted idle session {session.id}")
+
+    def evict_least_recently_used(self, count: int):
+        # The store may grow over its limit while all its sessions are busy
+        for session in list(self.sessions.values()):
+            if len(self.sessions) <= count:
+                return
+            if self.try_evict(session):
+                logging.debug(f"Evicted least recently used session {session.id}")
+
+    def try_evict(self, session: Session) -> bool:
+        # A session answering a query would be stored without its latest exchange,
+        # and a second session of the same ID would be created on the next query
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            self.evict(session)
+        finally:
+            session.lock.release()
+        return True
+
+    def evict(self, session: Session):
+        del self.sessions[session.id]
+        self.evictions = self.evictions + 1
+        self.spill(session)
+
+    def get_spill_path(self, id: str) -> str:
+        return os.path.join(self.config.spill_directory, f"{hash_text(id)}.json")
+
+    def spill(self, session: Session):
+        if not self.config.spill_directory:
+            return
+        state = session.chat.llm_chat.get_state()
+        try:
+            with open(self.get_spill_path(session.id), "w") as file:
+                json.dump(state, file)
+        except OSError as e:
+            logging.error(f"Storing session {session.id} failed: {str(e)}")
+
+    def restore(self, session: Session):
+        if not self.config.spill_directory:
+            return
+        path = self.get_spill_path(session.id)
+        if not os.path.exists(path):
+            return
+        logging.debug(f"Restoring session {session.id}")
+        try:
+            with open(path, "r") as file:
+                session.chat.llm_chat.set_state(json.load(file))
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Restoring session {session.id} failed: {str(e)}")
+
+    def spill_all(self):
+        with self._lock:
+            for session in self.sessions.values():
+                # Waits for the current query of the session
+                with session.lock:
+                    self.spill(session)
+            self.sessions.clear()
+
+    def remove(self, id: str):
+        with self._lock:
+            if id in self.sessions:
+                del self.sessions[id]
+        if self.config.spill_directory and os.path.exists(self.get_spill_path(id)):
+            os.remove(self.get_spill_path(id))
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self.sessions)
@@ -0,0 +1,101 @@
+from typing import Dict, List, Mapping
+import threading
+
+NANOSECONDS_PER_SECOND = 1e9
+
+
+class LlmUsage:
+    calls: int
+    prompt_eval_count: int
+    eval_count: int
+    # Durations in seconds
+    prompt_eval_duration: float
+    eval_duration: float
+    load_duration: float
+    total_duration: float
+    wall_time: float
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_eval_count = 0
+        self.eval_count = 0
+        self.prompt_eval_duration = 0.0
+        self.eval_duration = 0.0
+        self.load_duration = 0.0
+        self.total_duration = 0.0
+        self.wall_time = 0.0
+
+    def add(self, response: Mapping, wall_time: float):
+        # Ollama reports counts in tokens and durations in nanoseconds,
+        # and omits the fields which are not applicable
+        def value(key: str) -> int:
+            return response.get(key) or 0
+
+        self.calls = self.calls + 1
+        self.prompt_eval_count = self.prompt_eval_count + value("prompt_eval_count")
+        self.eval_count = self.eval_count + value("eval_count")
+        self.prompt_eval_duration = (
+            self.prompt_eval_duration
+            + value("prompt_eval_duration") / NANOSECONDS_PER_SECOND
+        )
+        self.eval_duration = (
+            self.eval_duration + value("eval_duration") / NANOSECONDS_PER_SECOND
+        )
+        self.load_duration = (
+            self.load_duration + value("load_duration") / NANOSECONDS_PER_SECOND
+        )
+        self.total_duration = (
+            self.total_duration + value("total_duration") / NANOSECONDS_PER_SECOND
+        )
+        self.wall_time = self.wall_time + wall_time
+
+    def to_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "prompt_eval_count": self.prompt_eval_count,
+            "eval_count": self.eval_count,
+            "prompt_eval_duration": self.prompt_eval_duration,
+            "eval_duration": self.eval_duration,
+            "load_duration": self.load_duration,
+            "total_duration": self.total_duration,
+            "wall_time": self.wall_time,
+        }
+
+
+class LlmUsageStats:
+    tasks: Dict[str, LlmUsage]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.tasks = dict()
+        self._lock = threading.Lock()
+
+    def record(self, task: str, response: Mapping, wall_time: float):
+        with self._lock:
+            if task not in self.tasks:
+                self.tasks[task] = LlmUsage()
+            self.tasks[task].add(response, wall_time)
+
+    def get(self, task: str) -> LlmUsage:
+        with self._lock:
+            return self.tasks.get(task, LlmUsage())
+
+    def reset(self):
+        with self._lock:
+            self.tasks = dict()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {task: usage.to_dict() for task, usage in self.tasks.items()}
+
+    def summary(self) -> List[str]:
+        lines = []
+        for task, usage in sorted(self.to_dict().items()):
+            lines.append(
+                f"{task}: {usage['calls']} calls, "
+                f"prompt {usage['prompt_eval_count']} tokens in {usage['prompt_eval_duration']:.2f}s, "
+                f"generation {usage['eval_count']} tokens in {usage['eval_duration']:.2f}s, "
+                f"load {usage['load_duration']:.2f}s, "
+                f"wall time {usage['wall_time']:.2f}s"
+            )
+        return lines
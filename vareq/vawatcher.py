@@ -0,0 +1,128 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+from .vaknowledgelibrary import KnowledgeLibrary
+
+
+class WatcherConfig:
+    enabled: bool
+    interval: float
+    debounce: float
+
+    def __init__(self):
+        self.enabled = False
+        # Seconds between scans of the watched files
+        self.interval = 5.0
+        # Seconds a changed file needs to stay unchanged before it is indexed,
+        # so that files being written are not indexed repeatedly
+        self.debounce = 2.0
+
+
+# Modification time and size
+FileStamp = Tuple[float, int]
+
+
+class LibraryWatcher:
+    library: KnowledgeLibrary
+    config: WatcherConfig
+    directories: List[str]
+    requirements_path: Optional[str]
+    stamps: Dict[str, FileStamp]
+    changes: Dict[str, float]
+    updates: int
+    _stop: threading.Event
+    _thread: threading.Thread
+
+    def __init__(
+        self,
+        library: KnowledgeLibrary,
+        config: WatcherConfig,
+        directories: List[str],
+        requirements_path: Optional[str] = None,
+    ):
+        self.library = library
+        self.config = config
+        self.directories = directories
+        self.requirements_path = requirements_path
+        # The files are expected to be indexed already
+        self.stamps = self.scan()
+        self.changes = dict()
+        self.updates = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        logging.info(
+            f"Watching {len(self.stamps)} files for changes every {self.config.interval}s"
+        )
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        while not self._stop.wait(self.config.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Updating the knowledge library failed: {str(e)}")
+
+    def get_stamp(self, path: str) -> Optional[FileStamp]:
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def scan(self) -> Dict[str, FileStamp]:
+        stamps = dict()
+        for directory in self.directories:
+            for path in self.library.list_documents(directory):
+                stamp = self.get_stamp(path)
+                if stamp is not None:
+                    stamps[path] = stamp
+        if self.requirements_path:
+            stamp = self.get_stamp(self.requirements_path)
+            if stamp is not None:
+                stamps[self.requirements_path] = stamp
+        return stamps
+
+    def poll(self, now: float = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        stamps = self.scan()
+        for path in set(stamps.keys()) | set(self.stamps.keys()):
+            if stamps.get(path) != self.stamps.get(path):
+                # Every further change postpones the update
+                self.changes[path] = now
+        self.stamps = stamps
+        settled = [
+            path
+            for path, changed in self.changes.items()
+            if now - changed >= self.config.debounce
+        ]
+        if len(settled) == 0:
+            return []
+        for path in settled:
+            del self.changes[path]
+        self.update(sorted(settled))
+        return settled
+
+    def update(self, paths: List[str]):
+        logging.info(f"Updating the knowledge library with {len(paths)} changed files")
+        documents = []
+        for path in paths:
+            if path == self.requirements_path:
+                if path in self.stamps:
+                    self.library.set_requirements_document(path)
+            elif path not in self.stamps:
+                self.library.remove_document(path)
+            elif not self.library.is_document_up_to_date(path):
+                documents.append(path)
+        self.library.add_documents(documents)
+        self.updates = self.updates + 1